@@ -1,141 +1,126 @@
-import json
-import os
-import hashlib
-import secrets
 from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import db
+import limits
+import passwords
+import sessions
+from router import Field, HttpError, Request, Response, Router
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    Business: User authentication and registration API
-    Args: event with httpMethod (POST), body with action (register/login/verify)
-          context with request_id
-    Returns: HTTP response with user data and auth token
-    '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
-    
-    body_data = json.loads(event.get('body', '{}'))
-    action = body_data.get('action')
+USER_COLUMNS = "id, username, email, display_name, avatar_url, bio, created_at"
+
+router = Router(allow_headers='Content-Type, X-Auth-Token')
+
+
+def hashing_busy() -> HttpError:
+    return HttpError(503, 'Server busy, try again', {'Retry-After': '1'})
+
+
+# register and login hash passwords with no pooled connection or admission slot held:
+# a hash takes far longer than their queries, and connections would sit idle meanwhile
+@router.route('POST', action='register', rate='register', uses_db=False, body={
+    'username': Field(str, required=True, strip=True),
+    'email': Field(str, required=True, strip=True),
+    'password': Field(str, required=True),
+    'display_name': Field(str)
+})
+def register(request: Request) -> Response:
+    '''Create the account and open its first session'''
+    username, email = request.data['username'], request.data['email']
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        password_hash = passwords.hash_password(request.data['password'])
+    except passwords.HasherBusy:
+        raise hashing_busy()
     
-    if action == 'register':
-        username = body_data.get('username', '').strip()
-        email = body_data.get('email', '').strip()
-        password = body_data.get('password', '')
-        display_name = body_data.get('display_name', username)
-        
-        if not username or not email or not password:
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Username, email and password required'}),
-                'isBase64Encoded': False
-            }
-        
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        auth_token = secrets.token_urlsafe(32)
-        
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
+    with limits.admission(), db.connection() as conn, db.cursor(conn) as cursor:
         cursor.execute("SELECT id FROM users WHERE username = %s OR email = %s", (username, email))
         if cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Username or email already exists'}),
-                'isBase64Encoded': False
-            }
+            raise HttpError(400, 'Username or email already exists')
         
         cursor.execute(
-            "INSERT INTO users (username, email, password_hash, display_name) VALUES (%s, %s, %s, %s) RETURNING id, username, email, display_name, avatar_url, bio, created_at",
-            (username, email, password_hash, display_name)
+            "INSERT INTO users (username, email, password_hash, display_name) VALUES (%s, %s, %s, %s) RETURNING " + USER_COLUMNS,
+            (username, email, password_hash, request.data['display_name'] or username)
         )
-        user = dict(cursor.fetchone())
-        user['created_at'] = user['created_at'].isoformat()
+        user = cursor.fetchone()
+        auth_token = sessions.create_session(cursor, user['id'])
         conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'user': user, 'token': auth_token}),
-            'isBase64Encoded': False
-        }
     
-    elif action == 'login':
-        username = body_data.get('username', '').strip()
-        password = body_data.get('password', '')
-        
-        if not username or not password:
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Username and password required'}),
-                'isBase64Encoded': False
-            }
-        
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        auth_token = secrets.token_urlsafe(32)
-        
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+    return Response({'user': user, 'token': auth_token}, status=201)
+
+
+@router.route('POST', action='login', rate='login', uses_db=False, body={
+    'username': Field(str, required=True, strip=True),
+    'password': Field(str, required=True)
+})
+def login(request: Request) -> Response:
+    '''Check credentials, upgrade legacy hashes and open a session'''
+    password = request.data['password']
+    with limits.admission(), db.connection() as conn, db.cursor(conn) as cursor:
         cursor.execute(
-            "SELECT id, username, email, display_name, avatar_url, bio, created_at FROM users WHERE username = %s AND password_hash = %s",
-            (username, password_hash)
+            "SELECT " + USER_COLUMNS + ", password_hash FROM users WHERE username = %s",
+            (request.data['username'],)
         )
         user = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if not user:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Invalid credentials'}),
-                'isBase64Encoded': False
-            }
-        
-        user = dict(user)
-        user['created_at'] = user['created_at'].isoformat()
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'user': user, 'token': auth_token}),
-            'isBase64Encoded': False
-        }
     
-    conn.close()
-    return {
-        'statusCode': 400,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Invalid action'}),
-        'isBase64Encoded': False
-    }
+    try:
+        # Unknown usernames still pay for one hash so timing does not reveal them
+        matches, needs_rehash = passwords.verify_password(
+            password, user['password_hash'] if user else passwords.DUMMY_HASH
+        )
+        new_hash = passwords.hash_password(password) if user and matches and needs_rehash else None
+    except passwords.HasherBusy:
+        raise hashing_busy()
+    
+    if not user or not matches:
+        raise HttpError(401, 'Invalid credentials')
+    
+    old_hash = user.pop('password_hash')
+    with limits.admission(), db.connection() as conn, db.cursor(conn) as cursor:
+        if new_hash:
+            # Skipped if the password changed while we were hashing
+            cursor.execute(
+                "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                (new_hash, user['id'], old_hash)
+            )
+        auth_token = sessions.create_session(cursor, user['id'])
+        conn.commit()
+    
+    return Response({'user': user, 'token': auth_token})
+
+
+@router.route('POST', action='verify', body={'token': Field(str)})
+def verify(request: Request, cursor: Any) -> Response:
+    '''Resolve a token (body or X-Auth-Token) to its user'''
+    token = request.data['token'] or sessions.token_from_event(request.event)
+    user_id = sessions.verify_token(cursor, token)
+    
+    user = None
+    if user_id:
+        cursor.execute("SELECT " + USER_COLUMNS + " FROM users WHERE id = %s", (user_id,))
+        user = cursor.fetchone()
+    
+    if not user:
+        raise HttpError(401, 'Invalid or expired token')
+    
+    return Response({'user': user})
+
+
+@router.route('POST', action='logout', body={'token': Field(str)})
+def logout(request: Request, cursor: Any) -> Response:
+    '''Revoke the session behind the token'''
+    token = request.data['token'] or sessions.token_from_event(request.event)
+    if token:
+        sessions.revoke_session(cursor, token)
+        request.conn.commit()
+    
+    return Response({'message': 'Logged out'})
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: User authentication and registration API
+    Args: event with httpMethod (POST), body with action (register/login/verify/logout),
+          token for verify/logout (or X-Auth-Token header)
+          context with request_id
+    Returns: HTTP response with user data and auth token
+    '''
+    return router(event, context)
@@ -0,0 +1,204 @@
+'''
+Admission control: per-client token buckets and a per-instance concurrency cap.
+
+Every function directory ships an identical copy of this module - change them
+together. A route opts in with Router.route(rate=...) naming one of RATE_LIMITS;
+every (limit, client) pair has its own bucket, the client being the user of a
+session this instance has already verified, otherwise the caller's IP - a token
+nobody verified proves nothing, so inventing a new one per request does not buy
+a new bucket. login and register are always charged to the IP, and login also
+to the account it targets (ACCOUNT_LIMITS), so spreading password guesses over
+many addresses does not help either. Requests nobody can be identified for are
+not limited. An empty bucket answers 429 with Retry-After.
+
+Buckets live in process memory, so every warm instance limits on its own.
+RATE_LIMIT_STORE=postgres additionally keeps them in the unlogged
+rate_limit_buckets table (V0015), shared by all instances at the cost of one
+upsert per limited request; the in-process buckets still turn away a flood
+before it costs a connection.
+
+The concurrency cap admits at most MAX_IN_FLIGHT database-backed requests per
+instance; one that cannot get in within ADMISSION_WAIT seconds is shed with
+503 instead of queueing for the pool. Routes that park on their connection
+(chat long-polls) use the separate long_poll lane of MAX_LONG_POLLS slots so
+they cannot crowd out short requests. Parked requests still hold a pooled
+connection, so the two lanes split DB_POOL_MAX_SIZE between them: by default
+half the pool goes to long-polls and the rest to MAX_IN_FLIGHT, and settings
+whose sum exceeds the pool fail at import. Functions without long-polls can
+set MAX_LONG_POLLS=0 to give the whole pool to short requests.
+RATE_LIMIT=0 switches the buckets off.
+'''
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import db
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT', '1') == '1'
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'memory')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+MAX_LONG_POLLS = int(os.environ.get('MAX_LONG_POLLS', str(db.POOL_MAX_SIZE // 2)))
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', str(max(1, db.POOL_MAX_SIZE - MAX_LONG_POLLS))))
+if MAX_IN_FLIGHT + MAX_LONG_POLLS > db.POOL_MAX_SIZE:
+    # Admitted requests would queue for the pool after all, the lanes would be pointless
+    raise ValueError(f'MAX_IN_FLIGHT ({MAX_IN_FLIGHT}) + MAX_LONG_POLLS ({MAX_LONG_POLLS}) '
+                     f'exceeds DB_POOL_MAX_SIZE ({db.POOL_MAX_SIZE})')
+ADMISSION_WAIT = float(os.environ.get('ADMISSION_WAIT', '0.5'))
+SHED_RETRY_AFTER = 1
+# Share of shared-store upserts that also delete buckets idle long enough to be full again
+PRUNE_PROBABILITY = 0.001
+
+
+def _limit(name: str, per_minute: float, burst: int) -> Tuple[float, int]:
+    '''(tokens per second, bucket size), overridable as RATE_LIMIT_<NAME>=per_minute/burst'''
+    override = os.environ.get('RATE_LIMIT_' + name.upper())
+    if override:
+        per_minute, burst = float(override.split('/')[0]), int(override.split('/')[1])
+    return per_minute / 60, burst
+
+
+RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    'login': _limit('login', 5, 5),
+    'login_account': _limit('login_account', 10, 10),
+    'register': _limit('register', 1, 3),
+    'comment': _limit('comment', 12, 10),
+    'interaction': _limit('interaction', 120, 30),
+    'chat': _limit('chat', 30, 10),
+    'dm': _limit('dm', 30, 10),
+    'publish': _limit('publish', 6, 5)
+}
+
+# Limits charged before a session can exist: the IP only, whatever token is sent
+IP_KEYED_LIMITS = ('login', 'register')
+# limit -> (account limit, body field naming the account) charged alongside the client's bucket
+ACCOUNT_LIMITS: Dict[str, Tuple[str, str]] = {'login': ('login_account', 'username')}
+
+# Tokens after refilling for the time since the bucket was last touched
+REFILLED_SQL = "LEAST(%(burst)s, b.tokens + EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - b.updated_at) * %(rate)s)"
+
+TAKE_SQL = """
+    INSERT INTO rate_limit_buckets AS b (key, tokens, allowed, updated_at)
+    VALUES (%(key)s, %(burst)s - 1, TRUE, CURRENT_TIMESTAMP)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = """ + REFILLED_SQL + """
+                 - CASE WHEN """ + REFILLED_SQL + """ >= 1 THEN 1 ELSE 0 END,
+        allowed = """ + REFILLED_SQL + """ >= 1,
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING tokens, allowed
+"""
+
+
+class Limited(Exception):
+    '''A request turned away: 429 for an empty bucket, 503 when the instance is saturated'''
+
+    def __init__(self, status: int, message: str, retry_after: float):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBuckets:
+    '''Bounded LRU of key -> (tokens, last refill); a key unseen for a while starts full'''
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, buckets: List[Tuple[str, float, int]]) -> float:
+        '''
+        Take one token from every (key, rate, burst) bucket, or from none of them
+        Returns: 0 when granted, otherwise seconds until all of them have a token
+        '''
+        now = time.monotonic()
+        with self._lock:
+            refilled = []
+            for key, rate, burst in buckets:
+                tokens, updated = self._buckets.get(key, (burst, now))
+                refilled.append((key, min(burst, tokens + (now - updated) * rate), rate))
+            wait = max([(1 - tokens) / rate for _, tokens, rate in refilled if tokens < 1], default=0.0)
+            for key, tokens, _ in refilled:
+                self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+_buckets = TokenBuckets(RATE_LIMIT_MAX_KEYS)
+LANES = ('default', 'long_poll')
+_lanes = {
+    'default': threading.BoundedSemaphore(MAX_IN_FLIGHT),
+    'long_poll': threading.BoundedSemaphore(MAX_LONG_POLLS)
+}
+
+
+def client_key(event: Dict[str, Any], name: str) -> Optional[str]:
+    '''User of an already verified session token, else the source IP, None if neither'''
+    if name not in IP_KEYED_LIMITS:
+        # Imported here: sessions imports router, which imports this module
+        import sessions
+        user_id = sessions.cached_user(event)
+        if user_id is not None:
+            return f'user:{user_id}'
+    source_ip = ((event.get('requestContext') or {}).get('identity') or {}).get('sourceIp')
+    return 'ip:' + source_ip if source_ip else None
+
+
+def take(name: str, event: Dict[str, Any], data: Optional[Dict[str, Any]] = None) -> List[Tuple[str, str]]:
+    '''
+    Charge the in-process buckets of limit name for the event's client and, per
+    ACCOUNT_LIMITS, for the account named in the validated body data - all of
+    them or, when one is empty, none
+    Returns: (limit, bucket key) pairs for take_shared(), empty when nothing is limited
+    Raises: Limited(429) when a bucket is empty
+    '''
+    if not RATE_LIMIT_ENABLED:
+        return []
+    buckets = []
+    client = client_key(event, name)
+    if client is not None:
+        buckets.append((name, f'{name}:{client}'))
+    if name in ACCOUNT_LIMITS and data:
+        account_limit, field = ACCOUNT_LIMITS[name]
+        account = str(data.get(field) or '').lower()
+        if account:
+            buckets.append((account_limit, f'{account_limit}:' + hashlib.sha256(account.encode()).hexdigest()[:32]))
+    wait = _buckets.take([(key, *RATE_LIMITS[limit]) for limit, key in buckets])
+    if wait:
+        raise Limited(429, 'Too many requests, slow down', wait)
+    return buckets
+
+
+def take_shared(cursor: Any, name: str, key: str) -> None:
+    '''
+    Charge the shared bucket as well (RATE_LIMIT_STORE=postgres), caller commits
+    only once every bucket of the request passed, so a rejection charges none
+    Raises: Limited(429) when the bucket is empty
+    '''
+    rate, burst = RATE_LIMITS[name]
+    cursor.execute(TAKE_SQL, {'key': key, 'rate': rate, 'burst': burst})
+    bucket = cursor.fetchone()
+    if random.random() < PRUNE_PROBABILITY:
+        cursor.execute("DELETE FROM rate_limit_buckets WHERE updated_at < CURRENT_TIMESTAMP - interval '1 hour'")
+    if not bucket['allowed']:
+        raise Limited(429, 'Too many requests, slow down', (1 - bucket['tokens']) / rate)
+
+
+@contextmanager
+def admission(lane: str = 'default') -> Iterator[None]:
+    '''Hold one slot of lane for the block, Limited(503) if none frees up in time'''
+    slots = _lanes[lane]
+    if not slots.acquire(timeout=ADMISSION_WAIT):
+        raise Limited(503, 'Server busy, try again', SHED_RETRY_AFTER)
+    try:
+        yield
+    finally:
+        slots.release()
@@ -0,0 +1,95 @@
+'''
+Salted scrypt password hashing on a bounded worker pool.
+
+Stored format: scrypt$<n>$<r>$<p>$<salt b64>$<hash b64>. Rows created before
+this module hold a bare unsalted sha256 hex digest; they still verify and are
+reported as needing a rehash so login can upgrade them in place.
+
+hashlib.scrypt releases the GIL, so the pool runs HASH_WORKERS hashes in
+parallel; at most HASH_QUEUE more callers may wait for a worker; anyone beyond
+that gets HasherBusy instead of piling up memory-hungry work.
+'''
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Tuple
+
+SCRYPT_N = int(os.environ.get('SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.environ.get('SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('SCRYPT_P', '1'))
+SALT_BYTES = 16
+KEY_BYTES = 32
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', '2'))
+HASH_QUEUE = int(os.environ.get('HASH_QUEUE', '8'))
+HASH_QUEUE_TIMEOUT = float(os.environ.get('HASH_QUEUE_TIMEOUT', '2'))
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+
+
+class HasherBusy(Exception):
+    '''Every worker is busy and the wait queue is full'''
+
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode()
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=KEY_BYTES
+    )
+
+
+def _run(fn: Callable[..., Any], *args: Any) -> Any:
+    if not _slots.acquire(timeout=HASH_QUEUE_TIMEOUT):
+        raise HasherBusy()
+    try:
+        return _executor.submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+def _hash(password: str) -> str:
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}'
+
+
+def _verify(password: str, stored: str) -> Tuple[bool, bool]:
+    if not stored.startswith('scrypt$'):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored), True
+    try:
+        _, n, r, p, salt, key = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        expected = base64.b64decode(key)
+        candidate = _scrypt(password, base64.b64decode(salt), n, r, p)
+    except ValueError:
+        return False, False
+    needs_rehash = (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return hmac.compare_digest(candidate, expected), needs_rehash
+
+
+def hash_password(password: str) -> str:
+    '''Hash with the current cost settings on the worker pool, raises HasherBusy when saturated'''
+    return _run(_hash, password)
+
+
+def verify_password(password: str, stored: str) -> Tuple[bool, bool]:
+    '''
+    Check a password against a stored hash on the worker pool
+    Returns: (matches, needs_rehash) - needs_rehash is set for legacy sha256 rows
+             and for hashes made with other cost settings than the current ones
+    Raises: HasherBusy when the pool is saturated
+    '''
+    return _run(_verify, password, stored)
+
+
+# Checked against when the username does not exist so that both cases cost the same
+DUMMY_HASH = _hash(secrets.token_urlsafe(16))
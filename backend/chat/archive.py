@@ -0,0 +1,123 @@
+'''
+Partition upkeep, retention and archival for the public chat.
+
+chat_messages is partitioned by month (V0016). Run `python archive.py` from a
+periodic job (daily is plenty). It:
+  1. creates the partitions for the next CHAT_MONTHS_AHEAD months
+  2. exports every month older than CHAT_RETENTION_MONTHS to
+     CHAT_ARCHIVE_DIR/chat_messages_YYYY_MM.ndjson.gz, one JSON row per line
+     in id order, written to a temporary file and renamed once complete
+  3. records the file in chat_archives, then detaches and drops the partition
+     in the same transaction - a month is either live or archived, never both
+
+The history endpoint reads archived months back from CHAT_ARCHIVE_DIR, so point
+it at storage the chat function can read as well.
+'''
+import gzip
+import json
+import os
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+from psycopg2.extras import RealDictCursor
+import db
+from router import dumps
+
+CHAT_ARCHIVE_DIR = os.environ.get('CHAT_ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'chat_archive'))
+CHAT_RETENTION_MONTHS = int(os.environ.get('CHAT_RETENTION_MONTHS', '6'))
+CHAT_MONTHS_AHEAD = int(os.environ.get('CHAT_MONTHS_AHEAD', '3'))
+EXPORT_BATCH_SIZE = 5000
+
+# Live partitions that ended before the retention cutoff, oldest first
+EXPIRED_PARTITIONS_SQL = """
+    SELECT child.relname as name,
+           to_date(substring(child.relname from '(\\d{4}_\\d{2})$'), 'YYYY_MM') as month
+    FROM pg_inherits i
+    JOIN pg_class parent ON parent.oid = i.inhparent
+    JOIN pg_class child ON child.oid = i.inhrelid
+    WHERE parent.relname = 'chat_messages'
+      AND child.relname ~ '^chat_messages_\\d{4}_\\d{2}$'
+      AND to_date(substring(child.relname from '(\\d{4}_\\d{2})$'), 'YYYY_MM')
+          < date_trunc('month', LOCALTIMESTAMP) - make_interval(months => %s)
+    ORDER BY month
+"""
+
+
+def file_name(month: date) -> str:
+    return f'chat_messages_{month:%Y_%m}.ndjson.gz'
+
+
+def ensure_partitions(cursor: Any, months_ahead: int = CHAT_MONTHS_AHEAD) -> int:
+    '''Create missing partitions from this month on; returns how many were created'''
+    cursor.execute("SELECT chat_ensure_partitions(LOCALTIMESTAMP, %s) as created", (months_ahead,))
+    return cursor.fetchone()['created']
+
+
+def export_partition(conn: Any, partition: str, path: str) -> Tuple[int, Optional[int], Optional[int]]:
+    '''
+    Stream one partition into a gzip NDJSON file through a server-side cursor
+    Returns: (rows, min id, max id)
+    '''
+    rows, min_id, max_id = 0, None, None
+    partial = path + '.partial'
+    with conn.cursor(name=f'export_{partition}', cursor_factory=RealDictCursor) as source, gzip.open(partial, 'wt', encoding='utf-8') as target:
+        source.itersize = EXPORT_BATCH_SIZE
+        # partition comes from pg_class and matched the chat_messages_YYYY_MM pattern
+        source.execute(f"SELECT id, user_id, message, created_at FROM {partition} ORDER BY id")
+        for row in source:
+            target.write(dumps(row) + '\n')
+            rows += 1
+            min_id = row['id'] if min_id is None else min_id
+            max_id = row['id']
+    with open(partial, 'rb') as written:
+        os.fsync(written.fileno())
+    os.replace(partial, path)
+    return rows, min_id, max_id
+
+
+def archive_expired(retention_months: int = CHAT_RETENTION_MONTHS) -> List[Dict[str, Any]]:
+    '''Export, record and drop every partition past retention; returns the chat_archives rows written'''
+    os.makedirs(CHAT_ARCHIVE_DIR, exist_ok=True)
+    archived = []
+    with db.connection() as conn, db.cursor(conn) as cursor:
+        ensure_partitions(cursor)
+        conn.commit()
+        cursor.execute(EXPIRED_PARTITIONS_SQL, (retention_months,))
+        expired = cursor.fetchall()
+        conn.commit()
+        for partition in expired:
+            name = file_name(partition['month'])
+            rows, min_id, max_id = export_partition(conn, partition['name'], os.path.join(CHAT_ARCHIVE_DIR, name))
+            cursor.execute(
+                """INSERT INTO chat_archives (month, file_name, row_count, min_id, max_id)
+                   VALUES (%s, %s, %s, %s, %s)
+                   RETURNING month, file_name, row_count""",
+                (partition['month'], name, rows, min_id, max_id)
+            )
+            archived.append(cursor.fetchone())
+            cursor.execute(f"ALTER TABLE chat_messages DETACH PARTITION {partition['name']}")
+            cursor.execute(f"DROP TABLE {partition['name']}")
+            conn.commit()
+    return archived
+
+
+def read_archived(name: str, after_id: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], bool]:
+    '''
+    Rows of an archived month with id > after_id, oldest first
+    Returns: up to limit rows and whether the file has more
+    Raises: FileNotFoundError when CHAT_ARCHIVE_DIR does not hold the file
+    '''
+    rows = []
+    with gzip.open(os.path.join(CHAT_ARCHIVE_DIR, name), 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            row = json.loads(line)
+            if after_id is not None and row['id'] <= after_id:
+                continue
+            if len(rows) == limit:
+                return rows, True
+            rows.append(row)
+    return rows, False
+
+
+if __name__ == '__main__':
+    for entry in archive_expired():
+        print(f"Archived {entry['row_count']} message(s) of {entry['month']:%Y-%m} to {entry['file_name']}")
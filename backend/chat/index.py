@@ -1,98 +1,363 @@
-import json
-import os
-from typing import Dict, Any
+import select
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import archive
+import sessions
+from router import Field, HttpError, Request, Response, Router
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 200
+MAX_WAIT_SECONDS = 20.0
+NOTIFY_CHANNEL = 'chat_messages'
+DEFAULT_INBOX_LIMIT = 30
+MAX_INBOX_LIMIT = 100
+DEFAULT_THREAD_LIMIT = 50
+
+router = Router()
+
+
+def fetch_messages(cursor: Any, after_id: Optional[int], before_id: Optional[int],
+                   limit: int) -> Tuple[List[Dict[str, Any]], bool]:
     '''
-    Business: Public chat room for all users
-    Args: event with httpMethod (GET/POST), body with user_id, message
-          context with request_id
-    Returns: HTTP response with messages or send confirmation
+    Read one window of the chat, oldest first
+    Args: cursor, after_id for messages newer than the client has, before_id for
+          older history, neither for the newest window; limit of the window
+    Returns: messages and whether more rows exist past the window
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    if method == 'GET':
+    if after_id is not None:
         cursor.execute("""
             SELECT cm.*, u.username, u.display_name, u.avatar_url
             FROM chat_messages cm
             JOIN users u ON cm.user_id = u.id
-            ORDER BY cm.created_at DESC
-            LIMIT 100
-        """)
-        
+            WHERE cm.id > %s
+            ORDER BY cm.id ASC
+            LIMIT %s
+        """, (after_id, limit + 1))
         messages = [dict(msg) for msg in cursor.fetchall()]
-        for msg in messages:
-            msg['created_at'] = msg['created_at'].isoformat()
-        
-        messages.reverse()
-        
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'messages': messages}),
-            'isBase64Encoded': False
-        }
-    
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        user_id = body_data.get('user_id')
-        message = body_data.get('message', '').strip()
-        
-        if not user_id or not message:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'user_id and message required'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute(
-            "INSERT INTO chat_messages (user_id, message) VALUES (%s, %s) RETURNING id, created_at",
-            (user_id, message)
-        )
-        result = cursor.fetchone()
+        return messages[:limit], len(messages) > limit
+    
+    cursor.execute("""
+        SELECT cm.*, u.username, u.display_name, u.avatar_url
+        FROM chat_messages cm
+        JOIN users u ON cm.user_id = u.id
+        """ + ("WHERE cm.id < %s" if before_id is not None else "") + """
+        ORDER BY cm.id DESC
+        LIMIT %s
+    """, ((before_id,) if before_id is not None else ()) + (limit + 1,))
+    messages = [dict(msg) for msg in cursor.fetchall()]
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    messages.reverse()
+    return messages, has_more
+
+
+def wait_for_notify(conn: Any, timeout: float) -> bool:
+    '''Block until a NOTIFY arrives on a connection that is already LISTENing, False on timeout'''
+    # The server only delivers notifications to sessions that are idle outside a transaction
+    conn.commit()
+    deadline = time.monotonic() + timeout
+    while not conn.notifies:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if select.select([conn], [], [], remaining) != ([], [], []):
+            conn.poll()
+    return True
+
+
+def dm_user(request: Request, cursor: Any) -> int:
+    '''Direct messages are private: unlike the room they always need a live session'''
+    user_id = sessions.verify_token(cursor, sessions.token_from_event(request.event))
+    if user_id is None:
+        raise HttpError(401, 'Authentication required')
+    return user_id
+
+
+# Direct messages. Registered before the room routes, which take any GET/POST without an action.
+
+@router.route('GET', action='inbox', query={
+    'before': Field(int),
+    'limit': Field(int, default=DEFAULT_INBOX_LIMIT, min=1, max=MAX_INBOX_LIMIT, clamp=True)
+})
+def get_inbox(request: Request, cursor: Any) -> Response:
+    '''Conversations newest first with last message and unread count, read from the summary table'''
+    user_id = dm_user(request, cursor)
+    before, limit = request.args['before'], request.args['limit']
+    
+    cursor.execute("""
+        SELECT cv.peer_id, cv.unread_count, cv.last_message_id, cv.last_message_at,
+               m.sender_id as last_sender_id, m.content as last_message,
+               u.username, u.display_name, u.avatar_url
+        FROM conversations cv
+        JOIN messages m ON m.id = cv.last_message_id
+        JOIN users u ON u.id = cv.peer_id
+        WHERE cv.user_id = %s
+        """ + ("AND cv.last_message_id < %s" if before is not None else "") + """
+        ORDER BY cv.last_message_id DESC
+        LIMIT %s
+    """, (user_id,) + ((before,) if before is not None else ()) + (limit + 1,))
+    conversations = cursor.fetchall()
+    
+    next_before = None
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        next_before = conversations[-1]['last_message_id']
+    
+    cursor.execute("SELECT COALESCE(SUM(unread_count), 0) as unread FROM conversations WHERE user_id = %s", (user_id,))
+    return Response({
+        'conversations': conversations,
+        'next_before': next_before,
+        'unread_total': cursor.fetchone()['unread']
+    })
+
+
+@router.route('GET', action='thread', query={
+    'peer_id': Field(int, required=True),
+    'before_id': Field(int),
+    'limit': Field(int, default=DEFAULT_THREAD_LIMIT, min=1, max=MAX_LIMIT, clamp=True)
+})
+def get_thread(request: Request, cursor: Any) -> Response:
+    '''One conversation, newest window or older than before_id, returned oldest first'''
+    user_id = dm_user(request, cursor)
+    peer_id, before_id, limit = request.args['peer_id'], request.args['before_id'], request.args['limit']
+    
+    # One index range per direction instead of an OR the planner would have to sort
+    direction = """
+        (SELECT id, sender_id, receiver_id, content, is_read, created_at
+         FROM messages
+         WHERE sender_id = %s AND receiver_id = %s
+         """ + ("AND id < %s" if before_id is not None else "") + """
+         ORDER BY id DESC
+         LIMIT %s)
+    """
+    bound = (before_id,) if before_id is not None else ()
+    cursor.execute(
+        "SELECT * FROM (" + direction + " UNION " + direction + ") thread ORDER BY id DESC LIMIT %s",
+        (user_id, peer_id) + bound + (limit + 1,) + (peer_id, user_id) + bound + (limit + 1,) + (limit + 1,)
+    )
+    messages = cursor.fetchall()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    messages.reverse()
+    return Response({'messages': messages, 'has_more': has_more})
+
+
+@router.route('POST', action='dm', rate='dm', body={
+    'receiver_id': Field(int, required=True),
+    'content': Field(str, required=True, strip=True)
+})
+def send_direct_message(request: Request, cursor: Any) -> Response:
+    '''Store the message and move the conversation to the top of both inboxes'''
+    user_id = dm_user(request, cursor)
+    receiver_id = request.data['receiver_id']
+    if receiver_id == user_id:
+        raise HttpError(400, 'Cannot message yourself')
+    
+    cursor.execute("SELECT id FROM users WHERE id = %s", (receiver_id,))
+    if not cursor.fetchone():
+        raise HttpError(404, 'User not found')
+    
+    cursor.execute(
+        "INSERT INTO messages (sender_id, receiver_id, content) VALUES (%s, %s, %s) RETURNING id, created_at",
+        (user_id, receiver_id, request.data['content'])
+    )
+    result = cursor.fetchone()
+    
+    # Rows are upserted in key order so two users messaging each other cannot deadlock
+    rows = sorted([(user_id, receiver_id, 0), (receiver_id, user_id, 1)])
+    cursor.execute("""
+        INSERT INTO conversations (user_id, peer_id, last_message_id, last_message_at, unread_count)
+        VALUES (%s, %s, %s, %s, %s), (%s, %s, %s, %s, %s)
+        ON CONFLICT (user_id, peer_id) DO UPDATE SET
+            last_message_id = EXCLUDED.last_message_id,
+            last_message_at = EXCLUDED.last_message_at,
+            unread_count = conversations.unread_count + EXCLUDED.unread_count
+    """, tuple(value for owner, peer, unread in rows
+               for value in (owner, peer, result['id'], result['created_at'], unread)))
+    request.conn.commit()
+    
+    return Response({
+        'message': 'Message sent',
+        'message_id': result['id'],
+        'created_at': result['created_at']
+    }, status=201)
+
+
+@router.route('POST', action='read', body={
+    'peer_id': Field(int, required=True),
+    'up_to_id': Field(int)
+})
+def mark_read(request: Request, cursor: Any) -> Response:
+    '''Mark everything (or up to up_to_id) the peer sent as read in one statement'''
+    user_id = dm_user(request, cursor)
+    peer_id, up_to_id = request.data['peer_id'], request.data['up_to_id']
+    
+    cursor.execute("""
+        UPDATE messages SET is_read = TRUE
+        WHERE receiver_id = %s AND sender_id = %s AND NOT is_read
+        """ + ("AND id <= %s" if up_to_id is not None else ""),
+        (user_id, peer_id) + ((up_to_id,) if up_to_id is not None else ())
+    )
+    marked = cursor.rowcount
+    
+    # Subtract exactly what this statement flipped, messages arriving meanwhile stay counted
+    cursor.execute(
+        "UPDATE conversations SET unread_count = GREATEST(unread_count - %s, 0) WHERE user_id = %s AND peer_id = %s RETURNING unread_count",
+        (marked, user_id, peer_id)
+    )
+    conversation = cursor.fetchone()
+    request.conn.commit()
+    
+    return Response({'marked': marked, 'unread_count': conversation['unread_count'] if conversation else 0})
+
+
+def with_authors(cursor: Any, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''Add username, display_name and avatar_url to archived rows with one query'''
+    if not rows:
+        return rows
+    cursor.execute(
+        "SELECT id, username, display_name, avatar_url FROM users WHERE id = ANY(%s)",
+        (list({row['user_id'] for row in rows}),)
+    )
+    authors = {user.pop('id'): user for user in cursor.fetchall()}
+    empty = {'username': None, 'display_name': None, 'avatar_url': None}
+    return [{**row, **authors.get(row['user_id'], empty)} for row in rows]
+
+
+@router.route('GET', action='history', query={
+    'month': Field(str, required=True, strip=True),
+    'after_id': Field(int),
+    'limit': Field(int, default=DEFAULT_LIMIT, min=1, max=MAX_LIMIT, clamp=True),
+    'include_archived': Field(str, default='0', choices=('0', '1'))
+})
+def get_history(request: Request, cursor: Any) -> Response:
+    '''
+    One month of the room (month=YYYY-MM), oldest first, paged with after_id
+    Live months read a single partition; months past retention are served from
+    their archive file only with include_archived=1, otherwise archived is true
+    and messages stay empty
+    '''
+    try:
+        month = datetime.strptime(request.args['month'], '%Y-%m')
+    except ValueError:
+        raise HttpError(400, 'month must be YYYY-MM')
+    after_id, limit = request.args['after_id'], request.args['limit']
+    
+    cursor.execute("SELECT file_name FROM chat_archives WHERE month = %s", (month.date(),))
+    archived = cursor.fetchone()
+    if archived:
+        if request.args['include_archived'] != '1':
+            return Response({'messages': [], 'last_id': after_id, 'has_more': False, 'archived': True})
+        try:
+            rows, has_more = archive.read_archived(archived['file_name'], after_id, limit)
+        except FileNotFoundError:
+            raise HttpError(404, 'Archive of this month is not available')
+        messages = with_authors(cursor, rows)
+    else:
+        next_month = month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+        cursor.execute("""
+            SELECT cm.*, u.username, u.display_name, u.avatar_url
+            FROM chat_messages cm
+            JOIN users u ON cm.user_id = u.id
+            WHERE cm.created_at >= %s AND cm.created_at < %s AND cm.id > %s
+            ORDER BY cm.id ASC
+            LIMIT %s
+        """, (month, next_month, after_id or 0, limit + 1))
+        messages = [dict(msg) for msg in cursor.fetchall()]
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    
+    last_id = messages[-1]['id'] if messages else after_id
+    return Response({'messages': messages, 'last_id': last_id, 'has_more': has_more, 'archived': bool(archived)})
+
+
+def is_long_poll(request: Request) -> bool:
+    '''Reads that may park on their connection for up to wait seconds'''
+    try:
+        # after_id=0 (everything so far) long-polls too, only a missing or blank one does not
+        return request.params.get('after_id') not in (None, '') and float(request.params.get('wait') or 0) > 0
+    except ValueError:
+        return False
+
+
+MESSAGES_QUERY = {
+    'after_id': Field(int),
+    'before_id': Field(int),
+    'limit': Field(int, default=DEFAULT_LIMIT, min=1, max=MAX_LIMIT, clamp=True),
+    'wait': Field(float, default=0.0, min=0, max=MAX_WAIT_SECONDS, clamp=True)
+}
+
+
+# Long-polls get their own admission lane so parked readers cannot take every slot
+@router.route('GET', query=MESSAGES_QUERY)
+@router.route('GET', when=is_long_poll, query=MESSAGES_QUERY, lane='long_poll')
+def get_messages(request: Request, cursor: Any) -> Response:
+    '''Newest window, newer-than-after_id (optionally long-polled) or older-than-before_id'''
+    after_id, before_id = request.args['after_id'], request.args['before_id']
+    limit, wait = request.args['limit'], request.args['wait']
+    conn = request.conn
+    
+    # Long-poll only makes sense for "anything newer than what I have"
+    long_poll = wait > 0 and after_id is not None
+    if long_poll:
+        # Subscribe before reading so a message committed in between still wakes us
+        cursor.execute("LISTEN " + NOTIFY_CHANNEL)
         conn.commit()
-        
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'message': 'Message sent',
-                'message_id': result['id'],
-                'created_at': result['created_at'].isoformat()
-            }),
-            'isBase64Encoded': False
-        }
-    
-    cursor.close()
-    conn.close()
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+    
+    try:
+        messages, has_more = fetch_messages(cursor, after_id, before_id, limit)
+        if long_poll and not messages and wait_for_notify(conn, wait):
+            messages, has_more = fetch_messages(cursor, after_id, before_id, limit)
+    finally:
+        if long_poll:
+            cursor.execute("UNLISTEN " + NOTIFY_CHANNEL)
+            conn.commit()
+            conn.notifies.clear()
+    
+    last_id = messages[-1]['id'] if messages else after_id
+    return Response({'messages': messages, 'last_id': last_id, 'has_more': has_more})
+
+
+@router.route('POST', rate='chat', body={
+    'user_id': Field(int),
+    'message': Field(str, required=True, strip=True)
+})
+def send_message(request: Request, cursor: Any) -> Response:
+    '''Post to the room and wake long-polling readers'''
+    user_id = sessions.require_user(cursor, request.event, request.data['user_id'])
+    insert = "INSERT INTO chat_messages (user_id, message) VALUES (%s, %s) RETURNING id, created_at"
+    try:
+        cursor.execute(insert, (user_id, request.data['message']))
+    except psycopg2.errors.CheckViolation:
+        # No partition for this month yet: the upkeep job has not run, create it here
+        request.conn.rollback()
+        archive.ensure_partitions(cursor)
+        cursor.execute(insert, (user_id, request.data['message']))
+    result = cursor.fetchone()
+    # Delivered to long-polling readers when the transaction commits
+    cursor.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, str(result['id'])))
+    request.conn.commit()
+    
+    return Response({
+        'message': 'Message sent',
+        'message_id': result['id'],
+        'created_at': result['created_at']
+    }, status=201)
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Public chat room for all users and private direct messages
+    Args: event with httpMethod (GET/POST), queryStringParameters (after_id, before_id,
+          limit, wait seconds to long-poll with after_id), body with user_id, message;
+          action=history (month=YYYY-MM, after_id, limit, include_archived=1 to read
+          months moved to the archive);
+          direct messages need X-Auth-Token: GET action=inbox (before, limit) or
+          action=thread (peer_id, before_id, limit), POST action=dm (receiver_id,
+          content) or action=read (peer_id, up_to_id)
+          context with request_id
+    Returns: HTTP response with messages or send confirmation
+    '''
+    return router(event, context)
@@ -0,0 +1,285 @@
+'''
+Pooled Postgres access shared by the backend functions.
+
+Every function directory is deployed on its own, so each one ships an identical
+copy of this module - change them together. The pool lives at module level and
+survives between warm invocations of the same instance.
+
+Cursors handed out by cursor() are instrumented: while track_queries() is
+active (the router opens it around every invocation) each statement's time,
+row count and normalized SQL are recorded, and statements slower than
+SLOW_QUERY_MS are logged together with their EXPLAIN plan.
+'''
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_HEALTH_CHECK_INTERVAL', '30'))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', '1') == '1'
+EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', '300'))
+EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete')
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+_last_used: Dict[int, float] = {}
+_local = threading.local()
+_explained: Dict[str, float] = {}
+
+
+def get_pool() -> ThreadedConnectionPool:
+    '''Create the module-level pool on first use and reuse it afterwards'''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(POOL_MIN_SIZE, POOL_MAX_SIZE, os.environ['DATABASE_URL'])
+    return _pool
+
+
+def close_pool() -> None:
+    '''Close every pooled connection, the next get_pool() starts from scratch'''
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+
+
+def _is_healthy(conn: Any) -> bool:
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    # Connections the pool has just opened have never been handed out, no need to probe
+    if last_used is None or time.monotonic() - last_used < HEALTH_CHECK_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as probe:
+            probe.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout(pool: ThreadedConnectionPool) -> Any:
+    conn = pool.getconn()
+    if _is_healthy(conn):
+        return conn
+    # Stale connection (server restart, idle timeout): drop it and open a fresh one
+    _last_used.pop(id(conn), None)
+    pool.putconn(conn, close=True)
+    return pool.getconn()
+
+
+@contextmanager
+def connection() -> Iterator[Any]:
+    '''
+    Borrow a pooled connection for the duration of the block
+    Any transaction left open is rolled back before the connection goes back,
+    connections broken mid-request are discarded instead of reused.
+    Raises PoolError if no connection frees up within DB_POOL_TIMEOUT seconds.
+    '''
+    if not _slots.acquire(timeout=POOL_TIMEOUT):
+        raise PoolError('connection pool exhausted')
+    try:
+        pool = get_pool()
+        conn = _checkout(pool)
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if not broken and not conn.closed:
+                try:
+                    if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            discard = broken or bool(conn.closed)
+            if discard:
+                _last_used.pop(id(conn), None)
+            else:
+                _last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=discard)
+    finally:
+        _slots.release()
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s|%\(\w+\)s")
+_REPEATED_TUPLES = re.compile(r"(\([?, ]*\))(?:\s*,\s*\([?, ]*\))+")
+
+
+def normalize_sql(query: Any) -> str:
+    '''Collapse whitespace and replace literals and placeholders with ? so equal statements group together'''
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    sql = ' '.join(str(query).split())
+    sql = _LITERALS.sub('?', sql)
+    return _REPEATED_TUPLES.sub(r'\1, ...', sql)
+
+
+class QueryStats:
+    '''Statements executed during one invocation'''
+
+    def __init__(self, request_id: Optional[str] = None):
+        self.request_id = request_id
+        self.count = 0
+        self.total_ms = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.statements: Dict[str, List[float]] = {}
+
+    def record(self, sql: str, elapsed_ms: float, rows: int) -> None:
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.rows += max(rows, 0)
+        entry = self.statements.setdefault(sql, [0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += elapsed_ms
+        entry[2] += max(rows, 0)
+
+    def merge(self, other: 'QueryStats') -> None:
+        '''Add statements another thread recorded on behalf of this invocation'''
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.rows += other.rows
+        self.slow += other.slow
+        for sql, (calls, elapsed, rows) in other.statements.items():
+            entry = self.statements.setdefault(sql, [0, 0.0, 0])
+            entry[0] += calls
+            entry[1] += elapsed
+            entry[2] += rows
+
+    def summary(self, top: int = 5) -> Dict[str, Any]:
+        '''Totals plus the most expensive statements; calls > 1 on one statement hints at N+1'''
+        heaviest = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        return {
+            'queries': self.count,
+            'db_ms': round(self.total_ms, 2),
+            'rows': self.rows,
+            'slow': self.slow,
+            'statements': [
+                {'sql': sql[:300], 'calls': calls, 'ms': round(elapsed, 2), 'rows': rows}
+                for sql, (calls, elapsed, rows) in heaviest
+            ]
+        }
+
+
+@contextmanager
+def track_queries(request_id: Optional[str] = None) -> Iterator[QueryStats]:
+    '''Collect the statements this thread runs inside the block'''
+    stats = QueryStats(request_id)
+    previous = getattr(_local, 'stats', None)
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+
+def current_queries() -> Optional[QueryStats]:
+    '''Stats of the innermost track_queries() block of this thread, None outside one'''
+    return getattr(_local, 'stats', None)
+
+
+def _explain(cur: Any, query: Any, params: Any) -> Optional[str]:
+    conn = cur.connection
+    if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+        return None
+    # Plain EXPLAIN never runs the statement; the savepoint keeps a failing EXPLAIN from aborting the request
+    try:
+        with conn.cursor() as explain:
+            explain.execute('SAVEPOINT slow_query_explain')
+            try:
+                explain.execute(b'EXPLAIN ' + explain.mogrify(query, params))
+                plan = '\n'.join(row[0] for row in explain.fetchall())
+            except psycopg2.Error:
+                plan = None
+                explain.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            explain.execute('RELEASE SAVEPOINT slow_query_explain')
+        return plan
+    except psycopg2.Error:
+        return None
+
+
+def _log_slow(cur: Any, query: Any, params: Any, sql: str, elapsed_ms: float, stats: QueryStats) -> None:
+    stats.slow += 1
+    plan = None
+    now = time.monotonic()
+    # One plan per statement shape every EXPLAIN_INTERVAL seconds keeps a slow burst from doubling the load
+    if SLOW_QUERY_EXPLAIN and sql.split(' ', 1)[0].lower() in EXPLAINABLE and now - _explained.get(sql, -EXPLAIN_INTERVAL) >= EXPLAIN_INTERVAL:
+        _explained[sql] = now
+        plan = _explain(cur, query, params)
+    print(json.dumps({
+        'slow_query': sql[:2000],
+        'ms': round(elapsed_ms, 2),
+        'rows': cur.rowcount,
+        'request_id': stats.request_id,
+        'plan': plan[:4000] if plan else None
+    }))
+
+
+class InstrumentedCursor(RealDictCursor):
+    '''RealDictCursor that reports to the active track_queries() block, if any'''
+
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            sql = normalize_sql(query)
+            stats.record(sql, elapsed_ms, self.rowcount)
+            if elapsed_ms >= SLOW_QUERY_MS:
+                _log_slow(self, query, vars, sql, elapsed_ms, stats)
+
+    def executemany(self, query: Any, vars_list: Any) -> Any:
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            stats.record(normalize_sql(query), (time.perf_counter() - started) * 1000, self.rowcount)
+
+
+@contextmanager
+def cursor(conn: Any) -> Iterator[Any]:
+    '''Instrumented dict-row cursor that is closed when the block exits'''
+    cur = conn.cursor(cursor_factory=InstrumentedCursor)
+    try:
+        yield cur
+    finally:
+        cur.close()
+
+
+@contextmanager
+def transaction(conn: Any) -> Iterator[Any]:
+    '''Dict-row cursor whose work is committed on success and rolled back on error'''
+    try:
+        with cursor(conn) as cur:
+            yield cur
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
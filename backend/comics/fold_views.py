@@ -0,0 +1,39 @@
+import os
+from typing import Any
+import psycopg2
+
+# Deleting the shard rows and adding them to comics.views in one statement means
+# a view is either still in a shard or already folded, never both or neither
+FOLD_SQL = """
+    WITH moved AS (
+        DELETE FROM comic_view_shards RETURNING comic_id, views
+    ),
+    totals AS (
+        SELECT comic_id, SUM(views) as views FROM moved GROUP BY comic_id
+    )
+    UPDATE comics c SET views = COALESCE(c.views, 0) + t.views
+    FROM totals t
+    WHERE c.id = t.comic_id
+"""
+
+
+def fold_views(conn: Any) -> int:
+    '''
+    Move the view counts buffered in comic_view_shards into comics.views
+    Run periodically (every few minutes): a flush racing the fold simply
+    starts a new shard row that the next run picks up
+    Args: open psycopg2 connection
+    Returns: number of comics whose views changed
+    '''
+    cursor = conn.cursor()
+    cursor.execute(FOLD_SQL)
+    updated = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return updated
+
+
+if __name__ == '__main__':
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    print(f'Folded views of {fold_views(conn)} comic(s)')
+    conn.close()
@@ -1,167 +1,544 @@
 import json
-import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import base64
+import re
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from psycopg2.extras import execute_values
+import db
+import limits
+import sessions
+from cache import cached_response, response_cache
+from views import VIEWS_SQL, view_counter, viewer_key
+from router import Field, HttpError, Request, Response, Router, dumps, validate
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_IMPORT_COMICS = 500
+MAX_PAGES_PER_COMIC = 500
+INSERT_BATCH_SIZE = 1000
+
+# likes_count, comments_count and the rating totals are counters on comics
+# kept up to date by the interactions function (see reconcile_stats.py)
+AVG_RATING_SQL = "CASE WHEN c.rating_count > 0 THEN c.rating_sum::numeric / c.rating_count ELSE 0 END"
+
+# Everything clients see of a comic - spelled out so search_vector is never sent
+COMIC_COLUMN_NAMES = (
+    'id', 'user_id', 'title', 'description', 'cover_url', 'genre', 'views',
+    'created_at', 'updated_at', 'likes_count', 'rating_sum', 'rating_count',
+    'comments_count', 'trending_score', 'bayes_rating'
+)
+# The detail read also counts views that are not folded into comics.views yet
+DETAIL_COLUMNS = ', '.join(
+    VIEWS_SQL + ' as views' if name == 'views' else 'c.' + name for name in COMIC_COLUMN_NAMES
+)
+
+# What fields= can pick for listings and search, in the order of the full view
+LISTING_FIELDS = {
+    **{name: 'c.' + name for name in COMIC_COLUMN_NAMES},
+    **{name: 'u.' + name for name in ('username', 'display_name', 'avatar_url')},
+    'avg_rating': AVG_RATING_SQL + ' as avg_rating'
+}
+# view=card: what a thumbnail grid renders, no description or ranking internals
+CARD_FIELDS = (
+    'id', 'user_id', 'title', 'cover_url', 'genre', 'username', 'display_name',
+    'avatar_url', 'likes_count', 'avg_rating', 'created_at'
+)
+LISTING_VIEWS = ('full', 'card')
+
+# Listing orders, each served by a (column DESC, id DESC) index. The ranking
+# columns are materialized scores, see V0010 and refresh_rankings.py
+SORT_COLUMNS = {
+    'newest': 'created_at',
+    'trending': 'trending_score',
+    'top_rated': 'bayes_rating',
+    'most_liked': 'likes_count'
+}
+
+DEFAULT_RELATED = 10
+MAX_RELATED = 20
+
+MAX_SEARCH_TERMS = 8
+MAX_FACETS = 20
+MAX_AUTHOR_MATCHES = 200
+
+# Comic ids matching a search: full-text hits, misspelled titles (trigram word
+# similarity) and comics by matching authors - a UNION of index-driven sets
+# rather than one OR, which would scan every comic. ranked adds the score.
+SEARCH_MATCHES_SQL = """
+    WITH q AS (SELECT to_tsquery('simple', %(tsquery)s) as query),
+    authors AS (
+        SELECT u.id FROM users u, q
+        WHERE u.search_vector @@ q.query
+           OR %(text)s <%% (coalesce(u.username, '') || ' ' || coalesce(u.display_name, ''))
+        LIMIT """ + str(MAX_AUTHOR_MATCHES) + """
+    ),
+    matched AS (
+        SELECT c.id FROM comics c, q WHERE c.search_vector @@ q.query
+        UNION
+        SELECT c.id FROM comics c WHERE %(text)s <%% c.title
+        UNION
+        SELECT c.id FROM comics c JOIN authors a ON c.user_id = a.id
+    ),
+    ranked AS (
+        SELECT c.id, c.genre,
+               (ts_rank(c.search_vector, q.query) + word_similarity(%(text)s, c.title)
+                + CASE WHEN c.user_id IN (SELECT id FROM authors) THEN 0.5 ELSE 0 END)::float8 as rank
+        FROM matched m
+        JOIN comics c ON c.id = m.id
+        CROSS JOIN q
+    )
+"""
+
+COMIC_FIELDS = {
+    'user_id': Field(int),
+    'title': Field(str, required=True, strip=True),
+    'description': Field(str, default=''),
+    'genre': Field(str, default=''),
+    'cover_url': Field(str, default=''),
+    'pages': Field(list, default=[])
+}
+
+PAGE_FIELDS = {
+    'page_number': Field(int, required=True, min=1, max=2 ** 31 - 1),
+    'image_url': Field(str, required=True, strip=True),
+    'caption': Field(str, default='')
+}
+
+router = Router(allow_headers='Content-Type, X-Auth-Token, X-User-Id, If-None-Match')
+
+
+def encode_cursor(sort_value: Any, comic_id: int) -> str:
+    '''Pack the (sort value, id) keyset position into an opaque URL-safe token'''
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, comic_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str = 'newest') -> Optional[Tuple[Any, int]]:
+    '''Unpack a token produced by encode_cursor for the given sort, None if it is malformed'''
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, comic_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if sort == 'newest':
+            return datetime.fromisoformat(sort_value), int(comic_id)
+        if isinstance(sort_value, bool) or not isinstance(sort_value, (int, float)):
+            return None
+        return sort_value, int(comic_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def search_query(text: str) -> Optional[str]:
+    '''Prefix tsquery (every word as typed so far) for to_tsquery, None without any word'''
+    words = re.findall(r'\w+', text.lower())[:MAX_SEARCH_TERMS]
+    return ' & '.join(word + ':*' for word in words) or None
+
+
+def listing_columns(request: Request, always: Tuple[str, ...]) -> str:
     '''
-    Business: Comics management API - create, read, update comics and pages
-    Args: event with httpMethod (GET/POST/PUT), queryStringParameters, body
-          context with request_id
-    Returns: HTTP response with comics data
+    SELECT list for the fields= (comma separated) or view= of a listing request
+    The always fields, such as the keyset cursor's columns, are selected either way
+    '''
+    if request.args['fields']:
+        names = [name.strip() for name in request.args['fields'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in LISTING_FIELDS]
+        if unknown:
+            raise HttpError(400, 'Unknown fields: ' + ', '.join(unknown))
+    elif request.args['view'] == 'card':
+        names = list(CARD_FIELDS)
+    else:
+        names = list(LISTING_FIELDS)
+    return ', '.join(LISTING_FIELDS[name] for name in dict.fromkeys([*always, *names]))
+
+
+def insert_comics(cursor: Any, comics: List[Tuple[Any, ...]]) -> List[int]:
+    '''
+    Insert comics and all of their pages with set-based statements
+    Args: cursor, list of (user_id, title, description, genre, cover_url, pages)
+    Returns: ids of the new comics in input order
+    '''
+    rows = execute_values(
+        cursor,
+        "INSERT INTO comics (user_id, title, description, genre, cover_url) VALUES %s RETURNING id",
+        [comic[:5] for comic in comics],
+        page_size=INSERT_BATCH_SIZE,
+        fetch=True
+    )
+    comic_ids = [row['id'] for row in rows]
+    
+    page_rows = [
+        (comic_id, page['page_number'], page['image_url'], page['caption'])
+        for comic_id, comic in zip(comic_ids, comics)
+        for page in comic[5]
+    ]
+    if page_rows:
+        execute_values(
+            cursor,
+            "INSERT INTO comic_pages (comic_id, page_number, image_url, caption) VALUES %s",
+            page_rows,
+            page_size=INSERT_BATCH_SIZE
+        )
+    
+    # One user_stats row per author, in id order so concurrent imports cannot deadlock
+    execute_values(
+        cursor,
+        """INSERT INTO user_stats (user_id, comics_count, last_published_at, last_activity_at) VALUES %s
+           ON CONFLICT (user_id) DO UPDATE SET
+               comics_count = user_stats.comics_count + EXCLUDED.comics_count,
+               last_published_at = EXCLUDED.last_published_at,
+               last_activity_at = EXCLUDED.last_activity_at""",
+        sorted(Counter(comic[0] for comic in comics).items()),
+        template='(%s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)'
+    )
+    return comic_ids
+
+
+def cached_read(request: Request, tags: List[str], load: Callable[[Any], Any]) -> Response:
+    '''
+    Serve a read from the response cache, or run load(cursor) and cache its payload
+    Cache name is the full query string so every parameter combination is its own entry;
+    only a miss takes an admission slot and a connection
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    if method == 'GET':
-        params = event.get('queryStringParameters') or {}
-        comic_id = params.get('id')
-        user_id = params.get('user_id')
+    name = '&'.join(f'{key}={value}' for key, value in sorted(request.params.items()))
+    body = response_cache.get(name, tags)
+    if body is None:
+        with limits.admission(), db.connection() as conn, db.cursor(conn) as cursor:
+            payload = load(cursor)
+        body = dumps(payload)
+        response_cache.set(name, tags, body)
+    return cached_response(request, body)
+
+
+def comic_row(entry: Any, session_user_id: Optional[int]) -> Tuple[Any, ...]:
+    '''Validate one comic to create and shape it for insert_comics'''
+    if not isinstance(entry, dict):
+        raise HttpError(400, 'expected a JSON object')
+    data = validate(entry, COMIC_FIELDS)
+    user_id = session_user_id or data['user_id']
+    if not user_id:
+        raise HttpError(400, 'user_id required')
+    if len(data['pages']) > MAX_PAGES_PER_COMIC:
+        raise HttpError(400, f'A comic has at most {MAX_PAGES_PER_COMIC} pages')
+    
+    # Checked here so a bad page is a 400 naming it, not a failed batch insert
+    pages = []
+    for index, page in enumerate(data['pages'], 1):
+        if not isinstance(page, dict):
+            raise HttpError(400, f'page {index}: expected a JSON object')
+        try:
+            pages.append(validate(page, PAGE_FIELDS))
+        except HttpError as error:
+            error.message = f'page {index}: {error.message}'
+            raise
+    numbers = [page['page_number'] for page in pages]
+    if len(set(numbers)) != len(numbers):
+        raise HttpError(400, 'page_number must be unique within a comic')
+    return user_id, data['title'], data['description'], data['genre'], data['cover_url'], pages
+
+
+def create_comics(request: Request, cursor: Any, entries: List[Any], numbered: bool = False) -> List[int]:
+    '''Authenticate, validate and insert; with numbered, errors name the NDJSON line'''
+    session_user_id, authenticated = sessions.authenticate(cursor, request.event, None)
+    if not authenticated:
+        raise sessions.unauthorized(request.event)
+    
+    new_comics = []
+    for line_number, entry in enumerate(entries, 1):
+        try:
+            new_comics.append(comic_row(entry, session_user_id))
+        except HttpError as error:
+            if numbered:
+                error.message = f'line {line_number}: {error.message}'
+            raise
+    
+    comic_ids = insert_comics(cursor, new_comics)
+    request.conn.commit()
+    response_cache.invalidate('search', *{f'user:{comic[0]}' for comic in new_comics})
+    return comic_ids
+
+
+@router.route('GET', action='search', uses_db=False, query={
+    'q': Field(str, required=True, strip=True),
+    'genre': Field(str),
+    'limit': Field(int, default=DEFAULT_PAGE_SIZE, min=1, max=MAX_PAGE_SIZE, clamp=True),
+    'cursor': Field(str),
+    'fields': Field(str, strip=True),
+    'view': Field(str, default='full', choices=LISTING_VIEWS)
+})
+def search_comics(request: Request) -> Response:
+    '''Ranked matches by title, genre, description or author; the first page adds genre facets'''
+    text, genre, limit = request.args['q'], request.args['genre'], request.args['limit']
+    tsquery = search_query(text)
+    if not tsquery:
+        raise HttpError(400, 'q must contain at least one word')
+    columns = listing_columns(request, ('id',))
+    
+    position = None
+    if request.args['cursor']:
+        position = decode_cursor(request.args['cursor'], 'rank')
+        if not position:
+            raise HttpError(400, 'Invalid cursor')
+    
+    def load(cursor: Any) -> Dict[str, Any]:
+        query_params = {'tsquery': tsquery, 'text': text, 'genre': genre, 'limit': limit + 1}
+        conditions = []
+        if genre:
+            conditions.append("r.genre = %(genre)s")
+        if position:
+            conditions.append("(r.rank, r.id) < (%(rank)s, %(id)s)")
+            query_params.update(rank=position[0], id=position[1])
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
         
-        if comic_id:
-            cursor.execute("""
-                SELECT c.*, u.username, u.display_name, u.avatar_url,
-                       COALESCE(AVG(r.rating), 0) as avg_rating,
-                       COUNT(DISTINCT l.id) as likes_count,
-                       COUNT(DISTINCT cm.id) as comments_count
-                FROM comics c
-                JOIN users u ON c.user_id = u.id
-                LEFT JOIN ratings r ON c.id = r.comic_id
-                LEFT JOIN likes l ON c.id = l.comic_id
-                LEFT JOIN comments cm ON c.id = cm.comic_id
-                WHERE c.id = %s
-                GROUP BY c.id, u.id
-            """, (comic_id,))
-            comic = cursor.fetchone()
-            
-            if not comic:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Comic not found'}),
-                    'isBase64Encoded': False
-                }
-            
-            comic = dict(comic)
-            comic['created_at'] = comic['created_at'].isoformat()
-            comic['updated_at'] = comic['updated_at'].isoformat()
-            comic['avg_rating'] = float(comic['avg_rating'])
-            
-            cursor.execute(
-                "SELECT id, page_number, image_url, caption FROM comic_pages WHERE comic_id = %s ORDER BY page_number",
-                (comic_id,)
-            )
-            pages = [dict(page) for page in cursor.fetchall()]
-            for page in pages:
-                page['created_at'] = page.get('created_at').isoformat() if page.get('created_at') else None
-            
-            comic['pages'] = pages
-            
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'comic': comic}),
-                'isBase64Encoded': False
-            }
+        cursor.execute(SEARCH_MATCHES_SQL + """
+            SELECT """ + columns + """, r.rank
+            FROM ranked r
+            JOIN comics c ON c.id = r.id
+            JOIN users u ON u.id = c.user_id
+        """ + where + """
+            ORDER BY r.rank DESC, r.id DESC
+            LIMIT %(limit)s
+        """, query_params)
+        comics = cursor.fetchall()
+        next_cursor = None
+        if len(comics) > limit:
+            comics = comics[:limit]
+            next_cursor = encode_cursor(comics[-1]['rank'], comics[-1]['id'])
+        payload = {'comics': comics, 'next_cursor': next_cursor}
         
-        query = """
-            SELECT c.*, u.username, u.display_name, u.avatar_url,
-                   COALESCE(AVG(r.rating), 0) as avg_rating,
-                   COUNT(DISTINCT l.id) as likes_count
+        # Facets ignore the genre filter so clients can offer the other genres
+        if not position:
+            cursor.execute(SEARCH_MATCHES_SQL + """
+                SELECT COALESCE(genre, '') as genre, COUNT(*) as count
+                FROM ranked
+                GROUP BY 1
+                ORDER BY count DESC, genre
+                LIMIT """ + str(MAX_FACETS), query_params)
+            payload['facets'] = {'genre': cursor.fetchall()}
+        return payload
+    
+    return cached_read(request, ['search'], load)
+
+
+@router.route('GET', action='related', uses_db=False, query={
+    'id': Field(int, required=True),
+    'limit': Field(int, default=DEFAULT_RELATED, min=1, max=MAX_RELATED, clamp=True),
+    'fields': Field(str, strip=True),
+    'view': Field(str, default='card', choices=LISTING_VIEWS)
+})
+def related_comics(request: Request) -> Response:
+    '''
+    "Readers also liked": neighbours precomputed by recommendations.py, read as
+    one primary key range. Comics without neighbours yet (new, or too few
+    readers) get the top rated comics of their genre instead
+    '''
+    comic_id, limit = request.args['id'], request.args['limit']
+    columns = listing_columns(request, ('id',))
+    
+    def load(cursor: Any) -> Dict[str, Any]:
+        cursor.execute("""
+            SELECT """ + columns + """, n.score
+            FROM comic_neighbours n
+            JOIN comics c ON c.id = n.neighbour_id
+            JOIN users u ON u.id = c.user_id
+            WHERE n.comic_id = %s AND n.rank <= %s
+            ORDER BY n.rank
+        """, (comic_id, limit))
+        comics = cursor.fetchall()
+        if comics:
+            return {'comics': comics, 'source': 'readers'}
+        
+        cursor.execute("""
+            SELECT """ + columns + """, NULL::real as score
+            FROM comics c
+            JOIN users u ON u.id = c.user_id
+            WHERE c.genre = (SELECT genre FROM comics WHERE id = %s) AND c.id <> %s
+            ORDER BY c.bayes_rating DESC, c.id DESC
+            LIMIT %s
+        """, (comic_id, comic_id, limit))
+        return {'comics': cursor.fetchall(), 'source': 'genre'}
+    
+    return cached_read(request, [f'comic:{comic_id}'], load)
+
+
+@router.route('GET', action='profile', uses_db=False, query={'user_id': Field(int, required=True)})
+def get_profile(request: Request) -> Response:
+    '''
+    Author header for profile pages: the user and their user_stats totals in one
+    primary-key read, cached until the author publishes or their works get new interactions
+    '''
+    user_id = request.args['user_id']
+    
+    def load(cursor: Any) -> Dict[str, Any]:
+        cursor.execute("""
+            SELECT u.id, u.username, u.display_name, u.avatar_url, u.bio, u.created_at,
+                   COALESCE(s.comics_count, 0) as comics_count,
+                   COALESCE(s.likes_received, 0) as likes_received,
+                   COALESCE(s.ratings_received, 0) as ratings_received,
+                   COALESCE(s.comments_received, 0) as comments_received,
+                   CASE WHEN s.ratings_received > 0
+                        THEN s.rating_sum_received::numeric / s.ratings_received ELSE 0 END as avg_rating,
+                   s.last_published_at, s.last_activity_at
+            FROM users u
+            LEFT JOIN user_stats s ON s.user_id = u.id
+            WHERE u.id = %s
+        """, (user_id,))
+        profile = cursor.fetchone()
+        if not profile:
+            raise HttpError(404, 'User not found')
+        return profile
+    
+    return cached_read(request, [f'user:{user_id}'], load)
+
+
+@router.route('GET', when=lambda request: request.params.get('id'), uses_db=False, query={
+    'id': Field(int, required=True),
+    'pages_from': Field(int, min=1),
+    'pages_to': Field(int, min=1)
+})
+def get_comic(request: Request) -> Response:
+    '''
+    Comic with its author, counters and pages
+    pages_from/pages_to limit pages to that page_number range (inclusive) so a
+    reader can open a long comic with its first few pages; page_count is the total.
+    The view is buffered in memory (see views.py), the read itself never writes
+    '''
+    comic_id, pages_from, pages_to = request.args['id'], request.args['pages_from'], request.args['pages_to']
+    if pages_from and pages_to and pages_to < pages_from:
+        raise HttpError(400, 'pages_to must not be less than pages_from')
+    
+    def load(cursor: Any) -> Dict[str, Any]:
+        cursor.execute("""
+            SELECT """ + DETAIL_COLUMNS + """, u.username, u.display_name, u.avatar_url,
+                   """ + AVG_RATING_SQL + """ as avg_rating,
+                   (SELECT COUNT(*) FROM comic_pages p WHERE p.comic_id = c.id) as page_count
             FROM comics c
             JOIN users u ON c.user_id = u.id
-            LEFT JOIN ratings r ON c.id = r.comic_id
-            LEFT JOIN likes l ON c.id = l.comic_id
-        """
-        
-        if user_id:
-            query += " WHERE c.user_id = %s"
-            cursor.execute(query + " GROUP BY c.id, u.id ORDER BY c.created_at DESC", (user_id,))
-        else:
-            cursor.execute(query + " GROUP BY c.id, u.id ORDER BY c.created_at DESC")
-        
-        comics = [dict(comic) for comic in cursor.fetchall()]
-        for comic in comics:
-            comic['created_at'] = comic['created_at'].isoformat()
-            comic['updated_at'] = comic['updated_at'].isoformat()
-            comic['avg_rating'] = float(comic['avg_rating'])
-        
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'comics': comics}),
-            'isBase64Encoded': False
-        }
-    
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        user_id = body_data.get('user_id')
-        title = body_data.get('title', '').strip()
-        description = body_data.get('description', '')
-        genre = body_data.get('genre', '')
-        cover_url = body_data.get('cover_url', '')
-        pages = body_data.get('pages', [])
-        
-        if not user_id or not title:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'user_id and title required'}),
-                'isBase64Encoded': False
-            }
+            WHERE c.id = %s
+        """, (comic_id,))
+        comic = cursor.fetchone()
+        if not comic:
+            raise HttpError(404, 'Comic not found')
         
+        conditions = ["comic_id = %s"]
+        query_params = [comic_id]
+        if pages_from:
+            conditions.append("page_number >= %s")
+            query_params.append(pages_from)
+        if pages_to:
+            conditions.append("page_number <= %s")
+            query_params.append(pages_to)
         cursor.execute(
-            "INSERT INTO comics (user_id, title, description, genre, cover_url) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-            (user_id, title, description, genre, cover_url)
+            "SELECT id, page_number, image_url, caption FROM comic_pages WHERE "
+            + " AND ".join(conditions) + " ORDER BY page_number",
+            query_params
         )
-        comic_id = cursor.fetchone()['id']
+        comic['pages'] = cursor.fetchall()
+        return {'comic': comic}
+    
+    response = cached_read(request, [f'comic:{comic_id}'], load)
+    # Only the first page range of a visit counts, the reader fetching more pages does not
+    if not pages_from or pages_from == 1:
+        view_counter.record(comic_id, viewer_key(request.event))
+        view_counter.flush_in_background()
+    return response
+
+
+@router.route('GET', uses_db=False, query={
+    'user_id': Field(int),
+    'sort': Field(str, default='newest', choices=tuple(SORT_COLUMNS)),
+    'limit': Field(int, default=DEFAULT_PAGE_SIZE, min=1, max=MAX_PAGE_SIZE, clamp=True),
+    'cursor': Field(str),
+    'fields': Field(str, strip=True),
+    'view': Field(str, default='full', choices=LISTING_VIEWS)
+})
+def list_comics(request: Request) -> Response:
+    '''
+    Keyset-paginated feed, newest first or ranked by sort, in the full or card
+    view or just the fields asked for. Per-author listings are cached until the author publishes, ranked pages for
+    CACHE_TTL since every like moves them
+    '''
+    user_id, sort, limit = request.args['user_id'], request.args['sort'], request.args['limit']
+    sort_column = SORT_COLUMNS[sort]
+    columns = listing_columns(request, ('id', sort_column))
+    
+    position = None
+    if request.args['cursor']:
+        position = decode_cursor(request.args['cursor'], sort)
+        if not position:
+            raise HttpError(400, 'Invalid cursor')
+    
+    def load(cursor: Any) -> Dict[str, Any]:
+        conditions = []
+        query_params = []
+        if user_id:
+            conditions.append("c.user_id = %s")
+            query_params.append(user_id)
+        if position:
+            conditions.append("(c." + sort_column + ", c.id) < (%s, %s)")
+            query_params.extend(position)
         
-        for page in pages:
-            cursor.execute(
-                "INSERT INTO comic_pages (comic_id, page_number, image_url, caption) VALUES (%s, %s, %s, %s)",
-                (comic_id, page['page_number'], page['image_url'], page.get('caption', ''))
-            )
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+        cursor.execute("""
+            SELECT """ + columns + """
+            FROM comics c
+            JOIN users u ON c.user_id = u.id
+        """ + where + """
+            ORDER BY c.""" + sort_column + """ DESC, c.id DESC
+            LIMIT %s
+        """, query_params + [limit + 1])
         
-        return {
-            'statusCode': 201,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'comic_id': comic_id, 'message': 'Comic created'}),
-            'isBase64Encoded': False
-        }
-    
-    cursor.close()
-    conn.close()
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
+        comics = cursor.fetchall()
+        next_cursor = None
+        if len(comics) > limit:
+            comics = comics[:limit]
+            next_cursor = encode_cursor(comics[-1][sort_column], comics[-1]['id'])
+        return {'comics': comics, 'next_cursor': next_cursor}
+    
+    if user_id:
+        return cached_read(request, [f'user:{user_id}'], load)
+    if sort != 'newest':
+        return cached_read(request, [f'ranking:{sort}'], load)
+    
+    with limits.admission(), db.connection() as conn, db.cursor(conn) as cursor:
+        return Response(load(cursor))
+
+
+@router.route('POST', action='import', action_in='query', rate='publish')
+def import_comics(request: Request, cursor: Any) -> Response:
+    '''Bulk create from an NDJSON body, one comic per line'''
+    try:
+        entries = [json.loads(line) for line in request.raw_body.splitlines() if line.strip()]
+    except ValueError:
+        raise HttpError(400, 'Body must be NDJSON, one comic per line')
+    
+    if not entries or len(entries) > MAX_IMPORT_COMICS:
+        raise HttpError(400, f'Import accepts 1 to {MAX_IMPORT_COMICS} comics per request')
+    
+    comic_ids = create_comics(request, cursor, entries, numbered=True)
+    return Response({'comic_ids': comic_ids, 'message': f'{len(comic_ids)} comics imported'}, status=201)
+
+
+@router.route('POST', rate='publish', body=COMIC_FIELDS)
+def create_comic(request: Request, cursor: Any) -> Response:
+    '''Create one comic with its pages'''
+    comic_ids = create_comics(request, cursor, [request.body])
+    return Response({'comic_id': comic_ids[0], 'message': 'Comic created'}, status=201)
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Comics management API - create, read, update comics and pages
+    Args: event with httpMethod (GET/POST), queryStringParameters
+          (id with pages_from, pages_to; user_id, sort=newest|trending|
+          top_rated|most_liked, limit, cursor, view=full|card, fields;
+          action=search with q, genre, limit, cursor, view, fields;
+          action=related with id, limit, view, fields;
+          action=profile with user_id for the author's totals;
+          action=import for NDJSON bulk POST), body
+          context with request_id
+    Returns: HTTP response with comics data
+    '''
+    return router(event, context)
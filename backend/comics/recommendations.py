@@ -0,0 +1,185 @@
+'''
+Offline "readers also liked" neighbours for the related endpoint.
+
+Every like (weight 1) and every rating of 3 or more (weight (rating - 2) / 3)
+is one entry of a sparse reader x comic matrix; a reader who both liked and
+rated a comic counts with the larger weight. Two comics are as similar as the
+cosine of their reader columns, computed as one sparse matrix product per block
+of target comics so memory stays bounded by RECOMMEND_BLOCK_CELLS, and the
+RECOMMEND_TOP_K most similar comics of each target go to comic_neighbours.
+
+By default only comics with a like, unlike or rating since the previous run are
+recomputed, --full recomputes every comic. Unlikes are only remembered for
+INTERACTION_EVENT_RETENTION_HOURS (the interactions function's setting), so a
+run whose previous run is older than that recomputes every comic too. A list that was not recomputed keeps
+the scores of the run that wrote it, so schedule a full run now and then (e.g.
+nightly, incremental runs hourly).
+
+Needs numpy and scipy, which the comics function itself does not depend on:
+  pip install numpy scipy
+  DATABASE_URL=postgresql://... python recommendations.py [--full]
+'''
+import argparse
+import io
+import os
+from datetime import datetime, timedelta
+from typing import Any, Iterator, List, Tuple
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+from scipy import sparse
+
+TOP_K = int(os.environ.get('RECOMMEND_TOP_K', '20'))
+# Comics with fewer readers get no neighbours (and are nobody's neighbour): too little signal
+MIN_READERS = int(os.environ.get('RECOMMEND_MIN_READERS', '2'))
+# Dense similarity block size, comics x targets float32 cells (32M cells = 128 MB)
+BLOCK_CELLS = int(os.environ.get('RECOMMEND_BLOCK_CELLS', str(32 * 1024 * 1024)))
+INSERT_BATCH_SIZE = 1000
+# How long the interactions function keeps applied events, keep both in sync
+EVENT_RETENTION = timedelta(hours=int(os.environ.get('INTERACTION_EVENT_RETENTION_HOURS', '24')))
+
+# One row per (reader, comic): weight and whether anything changed after %(since)s.
+# Ratings below 3 keep weight 0 so lowering a rating still marks the comic changed.
+INTERACTIONS_SQL = """
+    SELECT user_id, comic_id, MAX(weight), MAX(changed)
+    FROM (
+        SELECT user_id, comic_id, 1.0 as weight, (created_at > %(since)s)::int as changed
+        FROM likes
+        UNION ALL
+        SELECT user_id, comic_id, GREATEST(rating - 2, 0) / 3.0,
+               (COALESCE(updated_at, created_at) > %(since)s)::int
+        FROM ratings
+    ) e
+    GROUP BY user_id, comic_id
+"""
+
+# Unlikes leave no row behind, the applied write-behind events remember them
+UNLIKED_SQL = """
+    SELECT DISTINCT comic_id FROM interaction_events
+    WHERE kind = 'unlike' AND applied_at > %(since)s
+"""
+
+Interactions = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def load_interactions(cursor: Any, since: datetime) -> Interactions:
+    '''
+    Stream every interaction with COPY and parse it straight into arrays
+    Returns: (user ids, comic ids, weights, changed since `since`)
+    '''
+    buffer = io.StringIO()
+    query = cursor.mogrify(INTERACTIONS_SQL, {'since': since}).decode()
+    cursor.copy_expert("COPY (" + query + ") TO STDOUT", buffer)
+    values = np.array(buffer.getvalue().split(), dtype=np.float64).reshape(-1, 4)
+    return (values[:, 0].astype(np.int64), values[:, 1].astype(np.int64),
+            values[:, 2].astype(np.float32), values[:, 3] > 0)
+
+
+def build_matrix(user_ids: np.ndarray, comic_ids: np.ndarray,
+                 weights: np.ndarray) -> Tuple[sparse.csc_matrix, np.ndarray, np.ndarray]:
+    '''
+    Reader x comic matrix with every comic column scaled to unit length
+    Returns: (matrix, comic id of every column, readers per column)
+    '''
+    keep = weights > 0
+    users, rows = np.unique(user_ids[keep], return_inverse=True)
+    comics, columns = np.unique(comic_ids[keep], return_inverse=True)
+    matrix = sparse.csc_matrix((weights[keep], (rows, columns)), shape=(len(users), len(comics)), dtype=np.float32)
+    readers = np.diff(matrix.indptr)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return (matrix @ sparse.diags(scale.astype(np.float32))).tocsc(), comics, readers
+
+
+def top_neighbours(matrix: sparse.csc_matrix, readers: np.ndarray, targets: np.ndarray,
+                   k: int = TOP_K) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    '''
+    Most similar columns for every target column, one block of targets at a time
+    Yields: (target columns, neighbour columns k x block, scores k x block), best first
+            per target; slots without a similar comic score 0
+    '''
+    comics = matrix.shape[1]
+    k = min(k, comics - 1)
+    if k <= 0:
+        return
+    transposed = matrix.T.tocsr()
+    ineligible = readers < MIN_READERS
+    block = max(1, BLOCK_CELLS // comics)
+    for start in range(0, len(targets), block):
+        columns = targets[start:start + block]
+        similarity = (transposed @ matrix[:, columns]).toarray()
+        similarity[ineligible, :] = 0
+        similarity[columns, np.arange(len(columns))] = 0
+        # argpartition finds the k best rows in linear time, only those k get sorted
+        top = np.argpartition(-similarity, k - 1, axis=0)[:k]
+        scores = np.take_along_axis(similarity, top, axis=0)
+        order = np.argsort(-scores, axis=0, kind='stable')
+        yield columns, np.take_along_axis(top, order, axis=0), np.take_along_axis(scores, order, axis=0)
+
+
+def neighbour_rows(comics: np.ndarray, columns: np.ndarray, top: np.ndarray,
+                   scores: np.ndarray) -> List[Tuple[int, int, int, float]]:
+    '''comic_neighbours rows (comic_id, rank, neighbour_id, score) of one block, zero scores dropped'''
+    keep = scores > 0
+    comic_ids = np.broadcast_to(comics[columns], top.shape)[keep]
+    ranks = np.broadcast_to(np.arange(1, top.shape[0] + 1)[:, None], top.shape)[keep]
+    return list(zip(comic_ids.tolist(), ranks.tolist(), comics[top][keep].tolist(), scores[keep].tolist()))
+
+
+def recompute(conn: Any, full: bool = False) -> Tuple[int, int]:
+    '''
+    Recompute the neighbours of changed comics (all comics with full) in one transaction
+    Args: open psycopg2 connection, full
+    Returns: (comics recomputed, neighbour rows written)
+    '''
+    cursor = conn.cursor()
+    cursor.execute("SELECT computed_at, CURRENT_TIMESTAMP FROM recommendation_state FOR UPDATE")
+    computed_at, started = cursor.fetchone()
+    # Unlikes applied before the retention window are gone, UNLIKED_SQL could miss some
+    full = full or computed_at is None or started - computed_at >= EVENT_RETENTION
+    since = computed_at or datetime.min
+
+    user_ids, comic_ids, weights, changed = load_interactions(cursor, since)
+    matrix, comics, readers = build_matrix(user_ids, comic_ids, weights)
+
+    if full:
+        changed_ids = comics
+        cursor.execute("DELETE FROM comic_neighbours")
+    else:
+        cursor.execute(UNLIKED_SQL, {'since': since})
+        unliked = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+        changed_ids = np.union1d(np.unique(comic_ids[changed]), unliked)
+        cursor.execute("DELETE FROM comic_neighbours WHERE comic_id = ANY(%s)", (changed_ids.tolist(),))
+
+    # Changed comics nobody reads anymore only lose their old list
+    positions = np.searchsorted(comics, changed_ids)
+    present = positions < len(comics)
+    present[present] = comics[positions[present]] == changed_ids[present]
+    targets = positions[present]
+    targets = targets[readers[targets] >= MIN_READERS]
+
+    written = 0
+    for columns, top, scores in top_neighbours(matrix, readers, targets):
+        rows = neighbour_rows(comics, columns, top, scores)
+        execute_values(
+            cursor,
+            "INSERT INTO comic_neighbours (comic_id, rank, neighbour_id, score) VALUES %s",
+            rows, page_size=INSERT_BATCH_SIZE
+        )
+        written += len(rows)
+
+    cursor.execute("UPDATE recommendation_state SET computed_at = %s", (started,))
+    conn.commit()
+    cursor.close()
+    return len(targets), written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recompute "readers also liked" neighbours')
+    parser.add_argument('--full', action='store_true', help='recompute every comic, not only changed ones')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    recomputed, rows = recompute(conn, args.full)
+    print(f'Recomputed neighbours of {recomputed} comic(s), {rows} row(s) written')
+    conn.close()
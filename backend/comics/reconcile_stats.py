@@ -0,0 +1,85 @@
+import os
+import sys
+from typing import Any, Optional
+import psycopg2
+
+RECONCILE_SQL = """
+    WITH actual AS (
+        SELECT c.id,
+               (SELECT COUNT(*) FROM likes l WHERE l.comic_id = c.id) as likes_count,
+               (SELECT COALESCE(SUM(r.rating), 0) FROM ratings r WHERE r.comic_id = c.id) as rating_sum,
+               (SELECT COUNT(*) FROM ratings r WHERE r.comic_id = c.id) as rating_count,
+               (SELECT COUNT(*) FROM comments cm WHERE cm.comic_id = c.id) as comments_count
+        FROM comics c
+        WHERE %(comic_id)s IS NULL OR c.id = %(comic_id)s
+    )
+    UPDATE comics c SET
+        likes_count = a.likes_count,
+        rating_sum = a.rating_sum,
+        rating_count = a.rating_count,
+        comments_count = a.comments_count
+    FROM actual a
+    WHERE c.id = a.id
+      AND (c.likes_count, c.rating_sum, c.rating_count, c.comments_count)
+          IS DISTINCT FROM (a.likes_count, a.rating_sum, a.rating_count, a.comments_count)
+    RETURNING c.id
+"""
+
+RECONCILE_REPLIES_SQL = """
+    UPDATE comments c SET replies_count = actual.replies_count
+    FROM (
+        SELECT p.id, (SELECT COUNT(*) FROM comments r WHERE r.parent_id = p.id) as replies_count
+        FROM comments p
+        WHERE p.parent_id IS NULL AND (%(comic_id)s IS NULL OR p.comic_id = %(comic_id)s)
+    ) actual
+    WHERE c.id = actual.id AND c.replies_count <> actual.replies_count
+"""
+
+# Per-author totals from the (already reconciled) comic counters. last_activity_at
+# only moves forward here, it is too costly to rebuild from every interaction
+RECONCILE_USER_STATS_SQL = """
+    INSERT INTO user_stats (user_id, comics_count, likes_received, rating_sum_received, ratings_received,
+                            comments_received, last_published_at, last_activity_at)
+    SELECT c.user_id, COUNT(*), SUM(c.likes_count), SUM(c.rating_sum), SUM(c.rating_count),
+           SUM(c.comments_count), MAX(c.created_at), MAX(c.created_at)
+    FROM comics c
+    WHERE %(comic_id)s IS NULL OR c.user_id = (SELECT user_id FROM comics WHERE id = %(comic_id)s)
+    GROUP BY c.user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        comics_count = EXCLUDED.comics_count,
+        likes_received = EXCLUDED.likes_received,
+        rating_sum_received = EXCLUDED.rating_sum_received,
+        ratings_received = EXCLUDED.ratings_received,
+        comments_received = EXCLUDED.comments_received,
+        last_published_at = EXCLUDED.last_published_at,
+        last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at)
+    WHERE (user_stats.comics_count, user_stats.likes_received, user_stats.rating_sum_received,
+           user_stats.ratings_received, user_stats.comments_received, user_stats.last_published_at)
+          IS DISTINCT FROM (EXCLUDED.comics_count, EXCLUDED.likes_received, EXCLUDED.rating_sum_received,
+                            EXCLUDED.ratings_received, EXCLUDED.comments_received, EXCLUDED.last_published_at)
+"""
+
+
+def reconcile_stats(conn: Any, comic_id: Optional[int] = None) -> int:
+    '''
+    Recompute the denormalized counters on comics from likes, ratings and comments,
+    the per-thread replies_count on comments and the authors' user_stats
+    Args: open psycopg2 connection, optional comic_id to limit the pass to one comic
+          (and its author's totals)
+    Returns: number of comics whose counters had drifted and were corrected
+    '''
+    cursor = conn.cursor()
+    cursor.execute(RECONCILE_SQL, {'comic_id': comic_id})
+    fixed = cursor.rowcount
+    cursor.execute(RECONCILE_REPLIES_SQL, {'comic_id': comic_id})
+    cursor.execute(RECONCILE_USER_STATS_SQL, {'comic_id': comic_id})
+    conn.commit()
+    cursor.close()
+    return fixed
+
+
+if __name__ == '__main__':
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    target = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    print(f'Reconciled {reconcile_stats(conn, target)} comic(s)')
+    conn.close()
@@ -0,0 +1,71 @@
+import os
+from typing import Any
+import psycopg2
+
+# Events older than this many half-lives weigh < 0.1% of a new one and are dropped
+WINDOW_HALF_LIVES = 10
+
+REBASE_SQL = """
+    UPDATE ranking_params SET
+        trending_epoch = CURRENT_TIMESTAMP,
+        rating_prior_mean = COALESCE(
+            (SELECT SUM(rating_sum)::float / NULLIF(SUM(rating_count), 0) FROM comics), rating_prior_mean
+        )
+"""
+
+REFRESH_SQL = """
+    WITH params AS (
+        SELECT trending_epoch, half_life_hours, rating_prior_mean, rating_prior_weight,
+               trending_epoch - make_interval(hours => (half_life_hours * %(window)s)::int) as since
+        FROM ranking_params
+    ),
+    events AS (
+        SELECT comic_id, created_at as at, 1.0 as weight FROM likes, params WHERE created_at > params.since
+        UNION ALL
+        SELECT comic_id, COALESCE(updated_at, created_at), rating / 5.0 FROM ratings, params
+        WHERE COALESCE(updated_at, created_at) > params.since
+    ),
+    trending AS (
+        SELECT e.comic_id,
+               SUM(e.weight * power(2, EXTRACT(EPOCH FROM (e.at - p.trending_epoch)) / 3600.0 / p.half_life_hours)) as score
+        FROM events e, params p
+        GROUP BY e.comic_id
+    ),
+    fresh AS (
+        SELECT c.id, COALESCE(t.score, 0) as trending_score,
+               (p.rating_prior_weight * p.rating_prior_mean + c.rating_sum)
+                   / (p.rating_prior_weight + c.rating_count) as bayes_rating
+        FROM comics c
+        CROSS JOIN params p
+        LEFT JOIN trending t ON t.comic_id = c.id
+    )
+    UPDATE comics c SET trending_score = f.trending_score, bayes_rating = f.bayes_rating
+    FROM fresh f
+    WHERE c.id = f.id
+      AND (c.trending_score, c.bayes_rating) IS DISTINCT FROM (f.trending_score, f.bayes_rating)
+"""
+
+
+def refresh_rankings(conn: Any) -> int:
+    '''
+    Move the trending epoch to now, re-estimate the rating prior and recompute
+    trending_score and bayes_rating for every comic in one transaction
+    Run periodically (hourly is plenty): between runs the interactions function
+    keeps the scores current incrementally; a write racing the refresh may be
+    scored against the previous epoch until the next run
+    Args: open psycopg2 connection
+    Returns: number of comics whose scores changed
+    '''
+    cursor = conn.cursor()
+    cursor.execute(REBASE_SQL)
+    cursor.execute(REFRESH_SQL, {'window': WINDOW_HALF_LIVES})
+    updated = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return updated
+
+
+if __name__ == '__main__':
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    print(f'Refreshed rankings of {refresh_rankings(conn)} comic(s)')
+    conn.close()
@@ -0,0 +1,446 @@
+'''
+Minimal request routing shared by the backend functions.
+
+Every function directory ships an identical copy of this module - change them
+together. A function builds one Router, registers its routes with declarative
+query/body schemas and exposes the router as `handler`. The router answers
+CORS preflight, picks the route, validates input, opens a pooled connection
+when the route needs one, serializes the result and reports timings.
+
+Every invocation runs inside db.track_queries(). ROUTE_TIMING_LOG=1 prints one
+JSON line per invocation (route, timings, query summary, request_id);
+SERVER_TIMING=1 adds a Server-Timing header browsers show in their dev tools.
+
+Every router also answers POST ?action=batch, which runs several of its own
+routes in one invocation (see Router.batch). Routes registered with rate= are
+rate limited and every database-backed route passes the concurrency cap in
+limits.py first; turned-away requests get 429/503 with Retry-After.
+'''
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from psycopg2.pool import PoolError
+
+import db
+import limits
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+SERVER_TIMING = os.environ.get('SERVER_TIMING') == '1'
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', '20'))
+# Every parallel read holds its own pooled connection
+BATCH_WORKERS = max(1, min(int(os.environ.get('BATCH_WORKERS', '4')), db.POOL_MAX_SIZE))
+
+_batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+
+
+class HttpError(Exception):
+    '''Raised anywhere inside a route to answer with {"error": message}'''
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload: Any) -> str:
+    '''JSON-encode cursor rows directly: datetimes become ISO strings, Decimals floats'''
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default).decode()
+    return json.dumps(payload, default=_default)
+
+
+class Response:
+    '''Route result: a payload to serialize, or a ready body string'''
+
+    def __init__(self, payload: Any = None, status: int = 200,
+                 headers: Optional[Dict[str, str]] = None, body: Optional[str] = None):
+        self.payload = payload
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+
+
+class Field:
+    '''
+    One declared input value
+    Query strings are converted to kind; with clamp, out-of-range numbers are
+    pulled into [min, max] instead of rejected; choices lists the allowed values.
+    '''
+
+    def __init__(self, kind: type = str, required: bool = False, default: Any = None,
+                 min: Optional[float] = None, max: Optional[float] = None,
+                 strip: bool = False, clamp: bool = False, choices: Optional[Tuple[Any, ...]] = None):
+        self.kind = kind
+        self.required = required
+        self.default = default
+        self.min = min
+        self.max = max
+        self.strip = strip
+        self.clamp = clamp
+        self.choices = choices
+
+    def parse(self, name: str, value: Any) -> Any:
+        if value is None or value == '':
+            if self.required:
+                raise HttpError(400, f'{name} is required')
+            return self.default
+        if self.kind in (int, float):
+            if isinstance(value, bool) or (self.kind is int and isinstance(value, float) and not value.is_integer()):
+                raise HttpError(400, f'{name} must be {"an integer" if self.kind is int else "a number"}')
+            try:
+                value = self.kind(value)
+            except (TypeError, ValueError):
+                raise HttpError(400, f'{name} must be a number')
+            if self.min is not None and value < self.min:
+                if not self.clamp:
+                    raise HttpError(400, f'{name} must be at least {self.min}')
+                value = self.kind(self.min)
+            if self.max is not None and value > self.max:
+                if not self.clamp:
+                    raise HttpError(400, f'{name} must be at most {self.max}')
+                value = self.kind(self.max)
+            return value
+        if self.kind is str:
+            if not isinstance(value, str):
+                raise HttpError(400, f'{name} must be a string')
+            if self.strip:
+                value = value.strip()
+                if not value and self.required:
+                    raise HttpError(400, f'{name} is required')
+            if self.choices is not None and value not in self.choices:
+                raise HttpError(400, f'{name} must be one of: {", ".join(self.choices)}')
+            return value
+        if not isinstance(value, self.kind):
+            raise HttpError(400, f'{name} must be a {self.kind.__name__}')
+        return value
+
+
+Schema = Dict[str, Field]
+
+
+def validate(source: Dict[str, Any], schema: Schema) -> Dict[str, Any]:
+    return {name: field.parse(name, source.get(name)) for name, field in schema.items()}
+
+
+class Request:
+    def __init__(self, event: Dict[str, Any], context: Any):
+        self.event = event
+        self.context = context
+        self.method: str = event.get('httpMethod', 'GET')
+        self.params: Dict[str, Any] = event.get('queryStringParameters') or {}
+        self.raw_body: str = event.get('body') or ''
+        self.args: Dict[str, Any] = {}
+        self.data: Dict[str, Any] = {}
+        self.conn: Any = None
+        self._body: Optional[Any] = None
+
+    @property
+    def body(self) -> Any:
+        '''Request body parsed as JSON (an empty body is {})'''
+        if self._body is None:
+            try:
+                self._body = json.loads(self.raw_body) if self.raw_body.strip() else {}
+            except ValueError:
+                raise HttpError(400, 'Invalid JSON body')
+        return self._body
+
+    def header(self, name: str) -> Optional[str]:
+        lowered = name.lower()
+        for key, value in (self.event.get('headers') or {}).items():
+            if key.lower() == lowered:
+                return value
+        return None
+
+
+class Route:
+    def __init__(self, method: str, fn: Callable[..., Response], action: Optional[str],
+                 action_in: str, when: Optional[Callable[[Request], Any]],
+                 query: Optional[Schema], body: Optional[Schema], uses_db: bool,
+                 rate: Optional[str] = None, lane: str = 'default'):
+        self.method = method
+        self.fn = fn
+        self.name = fn.__name__
+        self.action = action
+        self.action_in = action_in
+        self.when = when
+        self.query = query
+        self.body = body
+        self.uses_db = uses_db
+        self.rate = rate
+        self.lane = lane
+
+    def matches(self, request: Request) -> bool:
+        if request.method != self.method:
+            return False
+        if self.action is not None:
+            source = request.params if self.action_in == 'query' else request.body
+            if not isinstance(source, dict) or source.get('action') != self.action:
+                return False
+        return self.when is None or bool(self.when(request))
+
+
+class Timing:
+    '''What a timing hook receives after each routed request'''
+
+    def __init__(self, route: str, method: str, status: int, handler_ms: float,
+                 serialize_ms: float, total_ms: float, request: Request, queries: db.QueryStats):
+        self.route = route
+        self.method = method
+        self.status = status
+        self.handler_ms = handler_ms
+        self.serialize_ms = serialize_ms
+        self.total_ms = total_ms
+        self.request = request
+        self.queries = queries
+
+
+def log_timing(timing: Timing) -> None:
+    print(json.dumps({
+        'request_id': timing.queries.request_id,
+        'route': timing.route, 'method': timing.method, 'status': timing.status,
+        'handler_ms': round(timing.handler_ms, 2), 'serialize_ms': round(timing.serialize_ms, 2),
+        'total_ms': round(timing.total_ms, 2),
+        **timing.queries.summary()
+    }))
+
+
+def server_timing(handler_ms: float, serialize_ms: float, queries: db.QueryStats) -> Dict[str, str]:
+    value = (f'db;dur={queries.total_ms:.1f};desc="{queries.count} queries", '
+             f'app;dur={max(handler_ms - queries.total_ms, 0):.1f}, serialize;dur={serialize_ms:.1f}')
+    return {'Server-Timing': value}
+
+
+def turned_away(status: int, message: str, retry_after: int) -> Response:
+    '''429/503 telling the client when to come back'''
+    return Response({'error': message}, status, {
+        'Access-Control-Expose-Headers': 'Retry-After',
+        'Retry-After': str(retry_after)
+    })
+
+
+def request_id_of(event: Dict[str, Any], context: Any) -> Optional[str]:
+    return getattr(context, 'request_id', None) or (event.get('requestContext') or {}).get('requestId')
+
+
+class Router:
+    def __init__(self, allow_headers: str = 'Content-Type, X-Auth-Token, X-User-Id'):
+        self.allow_headers = allow_headers
+        self.routes: List[Route] = [Route('POST', self.batch, 'batch', 'query', None, None, None, False)]
+        self.timing_hooks: List[Callable[[Timing], None]] = []
+        if os.environ.get('ROUTE_TIMING_LOG'):
+            self.timing_hooks.append(log_timing)
+
+    def route(self, method: str, action: Optional[str] = None, action_in: Optional[str] = None,
+              when: Optional[Callable[[Request], Any]] = None, query: Optional[Schema] = None,
+              body: Optional[Schema] = None, uses_db: bool = True, rate: Optional[str] = None,
+              lane: str = 'default') -> Callable:
+        '''
+        Register fn(request, cursor) - or fn(request) with uses_db=False;
+        request.conn holds the pooled connection for commits
+        action is compared with params['action'] for GET/HEAD and body['action']
+        otherwise (override with action_in); when is an extra predicate.
+        rate names the limits.RATE_LIMITS bucket charged before the route runs,
+        lane the admission lane its connection is held under ('long_poll' for
+        routes that park on it). uses_db=False routes that still query take
+        limits.admission() themselves. Routes are tried in registration order.
+        '''
+        if rate is not None and rate not in limits.RATE_LIMITS:
+            raise ValueError(f'unknown rate limit {rate!r}')
+        if lane not in limits.LANES:
+            raise ValueError(f'unknown admission lane {lane!r}')
+
+        def register(fn: Callable[..., Response]) -> Callable[..., Response]:
+            where = action_in or ('query' if method in ('GET', 'HEAD') else 'body')
+            self.routes.append(Route(method, fn, action, where, when, query, body, uses_db, rate, lane))
+            return fn
+        return register
+
+    def _preflight(self) -> Dict[str, Any]:
+        methods = sorted({route.method for route in self.routes} | {'OPTIONS'})
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': ', '.join(methods),
+                'Access-Control-Allow-Headers': self.allow_headers,
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    def _dispatch(self, request: Request) -> Tuple[Route, Response]:
+        route = next((r for r in self.routes if r.matches(request)), None)
+        if route is None:
+            if any(r.method == request.method for r in self.routes):
+                raise HttpError(400, 'Invalid request')
+            raise HttpError(405, 'Method not allowed')
+        if route.query:
+            request.args = validate(request.params, route.query)
+        if route.body:
+            if not isinstance(request.body, dict):
+                raise HttpError(400, 'Body must be a JSON object')
+            request.data = validate(request.body, route.body)
+        # The in-process bucket and the cap turn a flood away before it costs a connection
+        buckets = limits.take(route.rate, request.event, request.data) if route.rate else []
+        shared = bool(buckets) and limits.RATE_LIMIT_STORE == 'postgres'
+        if not route.uses_db:
+            if shared:
+                # The route manages its own connections, charge the shared buckets on a short one
+                with limits.admission(), db.connection() as conn, db.cursor(conn) as cursor:
+                    for limit, key in buckets:
+                        limits.take_shared(cursor, limit, key)
+                    conn.commit()
+            return route, route.fn(request)
+        with limits.admission(route.lane), db.connection() as conn, db.cursor(conn) as cursor:
+            if shared:
+                for limit, key in buckets:
+                    limits.take_shared(cursor, limit, key)
+                conn.commit()
+            request.conn = conn
+            return route, route.fn(request, cursor)
+
+    def _run(self, request: Request) -> Tuple[str, Response]:
+        '''_dispatch with an HttpError turned into its error response'''
+        try:
+            route, response = self._dispatch(request)
+            return route.name, response
+        except HttpError as error:
+            return 'unmatched', Response({'error': error.message}, error.status, error.headers)
+        except limits.Limited as error:
+            return 'limited', turned_away(error.status, error.message, error.retry_after)
+        except PoolError:
+            return 'limited', turned_away(503, 'Server busy, try again', limits.SHED_RETRY_AFTER)
+
+    def _run_tracked(self, request: Request) -> Tuple[Response, db.QueryStats]:
+        with db.track_queries() as queries:
+            return self._run(request)[1], queries
+
+    def _subrequest(self, parent: Request, entry: Any) -> Request:
+        '''Event for one batch entry: the batch's headers and context with its own method, query and body'''
+        if not isinstance(entry, dict):
+            raise HttpError(400, 'Each sub-request must be a JSON object')
+        method = str(entry.get('method') or 'GET').upper()
+        query = entry.get('query') or {}
+        if not isinstance(query, dict):
+            raise HttpError(400, 'query must be a JSON object')
+        if method == 'OPTIONS' or query.get('action') == 'batch':
+            raise HttpError(400, 'Batches cannot be nested')
+        # Sub-responses are inlined, so there is no cached copy a 304 could refer to
+        headers = {name: value for name, value in (parent.event.get('headers') or {}).items()
+                   if name.lower() != 'if-none-match'}
+        event = {
+            **parent.event,
+            'httpMethod': method,
+            'headers': headers,
+            'queryStringParameters': {name: str(value) for name, value in query.items() if value is not None},
+            'body': dumps(entry['body']) if entry.get('body') is not None else ''
+        }
+        return Request(event, parent.context)
+
+    def batch(self, request: Request) -> Response:
+        '''
+        Run up to BATCH_MAX_REQUESTS sub-requests against this router in one invocation
+        Body: {"requests": [{"method": "GET", "query": {...}, "body": {...}}, ...]}
+        Consecutive reads (GET/HEAD) run in parallel on the batch thread pool,
+        writes run one at a time in request order. Each sub-request carries the
+        batch's headers, so X-Auth-Token applies to all of them.
+        Returns: {"responses": [{"status", "headers", "body"}, ...]} in request order
+        '''
+        entries = request.body.get('requests') if isinstance(request.body, dict) else None
+        if not isinstance(entries, list) or not 1 <= len(entries) <= BATCH_MAX_REQUESTS:
+            raise HttpError(400, f'requests must be a list of 1 to {BATCH_MAX_REQUESTS} sub-requests')
+
+        responses: List[Optional[Response]] = [None] * len(entries)
+        subrequests: List[Optional[Request]] = []
+        for index, entry in enumerate(entries):
+            try:
+                subrequests.append(self._subrequest(request, entry))
+            except HttpError as error:
+                subrequests.append(None)
+                responses[index] = Response({'error': error.message}, error.status)
+
+        queries = db.current_queries()
+        reads: List[int] = []
+
+        def run_reads() -> None:
+            if len(reads) == 1:
+                responses[reads[0]] = self._run(subrequests[reads[0]])[1]
+            elif reads:
+                results = _batch_pool.map(self._run_tracked, [subrequests[index] for index in reads])
+                for index, (response, read_queries) in zip(reads, results):
+                    responses[index] = response
+                    if queries is not None:
+                        queries.merge(read_queries)
+            reads.clear()
+
+        for index, subrequest in enumerate(subrequests):
+            if subrequest is None:
+                continue
+            if subrequest.method in ('GET', 'HEAD'):
+                reads.append(index)
+                continue
+            run_reads()
+            responses[index] = self._run(subrequest)[1]
+        run_reads()
+
+        # Sub-response bodies are JSON already, splice them in instead of re-parsing
+        parts = [
+            '{"status":%d,"headers":%s,"body":%s}' % (
+                response.status, dumps(response.headers),
+                (response.body if response.body is not None else dumps(response.payload)) or 'null'
+            )
+            for response in responses
+        ]
+        return Response(body='{"responses":[' + ','.join(parts) + ']}')
+
+    def __call__(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        request = Request(event, context)
+        if request.method == 'OPTIONS':
+            return self._preflight()
+
+        started = time.perf_counter()
+        with db.track_queries(request_id_of(event, context)) as queries:
+            route_name, response = self._run(request)
+            handled = time.perf_counter()
+
+            body = response.body if response.body is not None else dumps(response.payload)
+            finished = time.perf_counter()
+
+        handler_ms, serialize_ms = (handled - started) * 1000, (finished - handled) * 1000
+        if self.timing_hooks:
+            timing = Timing(route_name, request.method, response.status, handler_ms,
+                            serialize_ms, (finished - started) * 1000, request, queries)
+            for hook in self.timing_hooks:
+                hook(timing)
+
+        headers = {**JSON_HEADERS, **response.headers}
+        if SERVER_TIMING:
+            headers.update(server_timing(handler_ms, serialize_ms, queries))
+            exposed = headers.get('Access-Control-Expose-Headers')
+            headers['Access-Control-Expose-Headers'] = f'{exposed}, Server-Timing' if exposed else 'Server-Timing'
+
+        return {
+            'statusCode': response.status,
+            'headers': headers,
+            'body': body,
+            'isBase64Encoded': False
+        }
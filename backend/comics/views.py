@@ -0,0 +1,130 @@
+'''
+Buffered view counting for comic detail reads.
+
+A read only bumps a counter in process memory, so readers of a hot comic never
+queue on its row lock. Once VIEW_FLUSH_INTERVAL has passed (or
+VIEW_FLUSH_MAX_PENDING comics are waiting) a background thread adds the
+buffered counts to this instance's shard row of each comic in one batched
+upsert; instances pick different shards so their flushes rarely touch the same
+rows. fold_views.py periodically moves the shard totals into comics.views.
+
+Repeat views by the same viewer (session token, otherwise client IP) within
+VIEW_DEDUPE_WINDOW are counted once per instance. Counts still buffered when an
+instance is shut down are lost - an accepted trade-off for a popularity metric.
+'''
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from psycopg2.extras import execute_values
+import db
+import sessions
+
+VIEW_FLUSH_INTERVAL = float(os.environ.get('VIEW_FLUSH_INTERVAL', '10'))
+VIEW_FLUSH_MAX_PENDING = int(os.environ.get('VIEW_FLUSH_MAX_PENDING', '1000'))
+VIEW_DEDUPE_WINDOW = float(os.environ.get('VIEW_DEDUPE_WINDOW', '1800'))
+VIEW_DEDUPE_SIZE = int(os.environ.get('VIEW_DEDUPE_SIZE', '10000'))
+VIEW_SHARDS = int(os.environ.get('VIEW_SHARDS', '16'))
+
+# Comics deleted since their views were buffered are skipped instead of failing the batch
+FLUSH_SQL = """
+    INSERT INTO comic_view_shards (comic_id, shard, views)
+    SELECT v.comic_id, v.shard, v.views
+    FROM (VALUES %s) v(comic_id, shard, views)
+    JOIN comics c ON c.id = v.comic_id
+    ON CONFLICT (comic_id, shard) DO UPDATE SET views = comic_view_shards.views + EXCLUDED.views
+"""
+
+# Total views of a comic c: folded count plus every shard not folded yet
+VIEWS_SQL = """COALESCE(c.views, 0) + COALESCE(
+    (SELECT SUM(s.views) FROM comic_view_shards s WHERE s.comic_id = c.id), 0
+)"""
+
+
+class ViewCounter:
+    '''Per-instance view buffer with a bounded, expiring set of recently seen (viewer, comic) pairs'''
+
+    def __init__(self, shard: int, dedupe_window: float = VIEW_DEDUPE_WINDOW,
+                 dedupe_size: int = VIEW_DEDUPE_SIZE):
+        self.shard = shard
+        self.dedupe_window = dedupe_window
+        self.dedupe_size = dedupe_size
+        self._pending: Dict[int, int] = {}
+        self._seen: 'OrderedDict[Tuple[str, int], float]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flushing = False
+
+    def record(self, comic_id: int, viewer: Optional[str]) -> bool:
+        '''Buffer one view, False when viewer already viewed comic_id within the window'''
+        now = time.monotonic()
+        with self._lock:
+            if viewer:
+                key = (viewer, comic_id)
+                expires = self._seen.get(key)
+                if expires is not None and expires > now:
+                    return False
+                self._seen[key] = now + self.dedupe_window
+                self._seen.move_to_end(key)
+                while len(self._seen) > self.dedupe_size:
+                    self._seen.popitem(last=False)
+            self._pending[comic_id] = self._pending.get(comic_id, 0) + 1
+            return True
+
+    def due(self) -> bool:
+        with self._lock:
+            if not self._pending or self._flushing:
+                return False
+            return (len(self._pending) >= VIEW_FLUSH_MAX_PENDING
+                    or time.monotonic() - self._last_flush >= VIEW_FLUSH_INTERVAL)
+
+    def flush(self) -> int:
+        '''
+        Write the buffered counts to this instance's shard rows
+        Returns: number of comics written; on failure the counts go back into the buffer
+        '''
+        with self._lock:
+            if self._flushing or not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            self._flushing = True
+        try:
+            with db.connection() as conn, db.cursor(conn) as cursor:
+                rows = [(comic_id, self.shard, views) for comic_id, views in sorted(pending.items())]
+                execute_values(cursor, FLUSH_SQL, rows, page_size=len(rows))
+                conn.commit()
+            return len(pending)
+        except Exception:
+            with self._lock:
+                for comic_id, views in pending.items():
+                    self._pending[comic_id] = self._pending.get(comic_id, 0) + views
+            raise
+        finally:
+            with self._lock:
+                self._flushing = False
+                self._last_flush = time.monotonic()
+
+    def flush_in_background(self) -> None:
+        '''Start a flush when one is due without making the current request wait for it'''
+        if self.due():
+            threading.Thread(target=self._flush_quietly, daemon=True).start()
+
+    def _flush_quietly(self) -> None:
+        try:
+            self.flush()
+        except Exception as error:
+            print(f'view flush failed, retrying with the next one: {error}')
+
+
+view_counter = ViewCounter(random.randrange(VIEW_SHARDS))
+
+
+def viewer_key(event: Dict[str, Any]) -> Optional[str]:
+    '''Who is viewing: the session token's hash, else the client IP, None if neither is known'''
+    token = sessions.token_from_event(event)
+    if token:
+        return 'token:' + sessions.hash_token(token)
+    source_ip = ((event.get('requestContext') or {}).get('identity') or {}).get('sourceIp')
+    return 'ip:' + source_ip if source_ip else None
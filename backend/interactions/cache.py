@@ -0,0 +1,172 @@
+'''
+Response cache for read-mostly endpoints with tag-based invalidation.
+
+comics and interactions ship identical copies of this module - change them
+together. Entries are keyed by the request plus the current generation of
+every tag they depend on (e.g. comic:12, user:3); invalidating a tag bumps its
+generation so old entries are simply never looked up again.
+
+Without CACHE_URL everything lives in process memory, so a write handled by
+another function instance only becomes visible once CACHE_TTL expires. With
+CACHE_URL pointing at a Redis-compatible server (needs the optional `redis`
+package) generations are shared and invalidation takes effect immediately.
+'''
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from router import Request, Response
+
+CACHE_URL = os.environ.get('CACHE_URL', '')
+CACHE_TTL = int(os.environ.get('CACHE_TTL', '60'))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '512'))
+CACHE_CONTROL = 'public, no-cache'
+
+
+class MemoryBackend:
+    '''Thread-safe LRU with per-entry expiry'''
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or entry[1] <= now:
+                    self._entries.pop(key, None)
+                    values.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    values.append(entry[0])
+        return values
+
+    def set(self, key: str, value: str, ttl: Optional[int]) -> None:
+        expires = time.monotonic() + ttl if ttl else float('inf')
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class RedisBackend:
+    '''Same interface on top of a Redis-compatible server'''
+
+    def __init__(self, url: str):
+        import redis
+        self._client = redis.Redis.from_url(url, socket_timeout=0.2, decode_responses=True)
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        return self._client.mget(keys)
+
+    def set(self, key: str, value: str, ttl: Optional[int]) -> None:
+        self._client.set(key, value, ex=ttl or None)
+
+    def incr(self, key: str) -> None:
+        self._client.incr(key)
+
+
+class ResponseCache:
+    '''
+    Two levels: a per-instance LRU in front of an optional shared backend.
+    Cache failures never fail a request, they only turn into misses.
+    '''
+
+    def __init__(self, shared: Optional[Any] = None, ttl: int = CACHE_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.local = MemoryBackend(max_entries)
+        self.shared = shared
+        # Kept outside the LRU: an evicted generation would resurrect stale entries
+        self._local_generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _generations(self, tags: List[str]) -> List[str]:
+        if self.shared is None:
+            with self._lock:
+                return [str(self._local_generations.get(tag, 0)) for tag in tags]
+        try:
+            return [value or '0' for value in self.shared.get_many(['gen:' + tag for tag in tags])]
+        except Exception:
+            return []
+
+    def _key(self, name: str, tags: List[str]) -> Optional[str]:
+        generations = self._generations(tags)
+        if len(generations) != len(tags):
+            return None
+        stamp = ','.join(f'{tag}@{gen}' for tag, gen in zip(tags, generations))
+        return f'resp:{name}|{stamp}'
+
+    def get(self, name: str, tags: List[str]) -> Optional[str]:
+        key = self._key(name, tags)
+        if key is None:
+            return None
+        body = self.local.get_many([key])[0]
+        if body is None and self.shared is not None:
+            try:
+                body = self.shared.get_many([key])[0]
+            except Exception:
+                return None
+            if body is not None:
+                self.local.set(key, body, self.ttl)
+        return body
+
+    def set(self, name: str, tags: List[str], body: str) -> None:
+        key = self._key(name, tags)
+        if key is None:
+            return
+        self.local.set(key, body, self.ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, body, self.ttl)
+            except Exception:
+                pass
+
+    def invalidate(self, *tags: str) -> None:
+        for tag in tags:
+            with self._lock:
+                self._local_generations[tag] = self._local_generations.get(tag, 0) + 1
+            if self.shared is not None:
+                try:
+                    self.shared.incr('gen:' + tag)
+                except Exception:
+                    pass
+
+
+def _shared_backend() -> Optional[Any]:
+    if not CACHE_URL:
+        return None
+    try:
+        return RedisBackend(CACHE_URL)
+    except ImportError:
+        print('CACHE_URL is set but the redis package is not installed, using the in-process cache only')
+        return None
+
+
+response_cache = ResponseCache(_shared_backend())
+
+
+def etag_for(body: str) -> str:
+    return '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+
+
+def cached_response(request: Request, body: str) -> Response:
+    '''200 with ETag/Cache-Control, or an empty 304 when the client already holds this body'''
+    etag = etag_for(body)
+    headers = {
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': CACHE_CONTROL,
+        'ETag': etag
+    }
+    if_none_match = request.header('If-None-Match') or ''
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        return Response(status=304, headers=headers, body='')
+    return Response(headers=headers, body=body)
@@ -0,0 +1,231 @@
+'''
+Write-behind queue for likes, unlikes and ratings.
+
+A request only appends its event to interaction_events and commits, which
+never waits on the comic's hot row. Whoever then wins the flush lock applies
+every pending event in one batch: the last like/unlike and the last rating per
+(user, comic) win, likes and ratings are written with set-based statements and
+each touched comic's counters and ranking scores, and its author's user_stats
+totals, are updated once per batch.
+Under a burst the other requests skip the flush and their events ride along
+with the next batch. Counters therefore lag by at most one in-flight batch;
+`python events.py` drains the queue from a periodic job as a safety net.
+'''
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+from psycopg2.extras import execute_values
+import db
+from cache import response_cache
+
+FLUSH_BATCH_SIZE = int(os.environ.get('INTERACTION_FLUSH_BATCH', '500'))
+EVENT_RETENTION_HOURS = int(os.environ.get('INTERACTION_EVENT_RETENTION_HOURS', '24'))
+# pg_try_advisory_xact_lock key, the same for every instance
+FLUSH_LOCK_ID = 6016
+
+
+def enqueue(cursor: Any, user_id: int, comic_id: int, kind: str, rating: Optional[int] = None,
+            idempotency_key: Optional[str] = None) -> Tuple[int, bool]:
+    '''
+    Append one event (caller commits)
+    Returns: (event id, duplicate) - duplicate when idempotency_key was already
+             used by this user, the id is then the one of the original event
+    '''
+    cursor.execute(
+        """INSERT INTO interaction_events (user_id, comic_id, kind, rating, idempotency_key)
+           VALUES (%s, %s, %s, %s, %s)
+           ON CONFLICT (user_id, idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+           RETURNING id""",
+        (user_id, comic_id, kind, rating, idempotency_key)
+    )
+    created = cursor.fetchone()
+    if created:
+        return created['id'], False
+    cursor.execute(
+        "SELECT id FROM interaction_events WHERE user_id = %s AND idempotency_key = %s",
+        (user_id, idempotency_key)
+    )
+    return cursor.fetchone()['id'], True
+
+
+def _trending_weights(cursor: Any) -> Any:
+    cursor.execute("SELECT trending_epoch, half_life_hours FROM ranking_params")
+    params = cursor.fetchone()
+
+    def weight(at: datetime) -> float:
+        # Same scale as V0010: 2^((event time - epoch) / half-life)
+        if not params:
+            return 0.0
+        return 2 ** ((at - params['trending_epoch']).total_seconds() / 3600 / params['half_life_hours'])
+    return weight
+
+
+def flush(cursor: Any, batch_size: int = FLUSH_BATCH_SIZE) -> Optional[Dict[str, Any]]:
+    '''
+    Apply up to batch_size pending events inside the caller's transaction (caller commits)
+    Returns: None if another flush holds the lock, otherwise {'applied': event ids,
+             'comics': {comic_id: author user_id}} for cache invalidation
+    '''
+    cursor.execute("SELECT pg_try_advisory_xact_lock(%s) as locked", (FLUSH_LOCK_ID,))
+    if not cursor.fetchone()['locked']:
+        return None
+
+    cursor.execute(
+        """SELECT id, user_id, comic_id, kind, rating, created_at
+           FROM interaction_events
+           WHERE applied_at IS NULL
+           ORDER BY id
+           LIMIT %s""",
+        (batch_size,)
+    )
+    events = cursor.fetchall()
+    if not events:
+        return {'applied': [], 'comics': {}}
+
+    # Events are in arrival order, so later ones overwrite earlier ones
+    like_state: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    rates: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    latest: Dict[int, datetime] = {}
+    for event in events:
+        target = rates if event['kind'] == 'rate' else like_state
+        target[(event['user_id'], event['comic_id'])] = event
+        latest[event['comic_id']] = event['created_at']
+
+    weight = _trending_weights(cursor)
+    # comic_id -> [likes, rating_sum, rating_count, trending]
+    deltas: Dict[int, List[Any]] = defaultdict(lambda: [0, 0, 0, 0.0])
+
+    likes = sorted((user_id, comic_id, event['created_at'])
+                   for (user_id, comic_id), event in like_state.items() if event['kind'] == 'like')
+    if likes:
+        added = execute_values(
+            cursor,
+            """INSERT INTO likes (user_id, comic_id, created_at) VALUES %s
+               ON CONFLICT (user_id, comic_id) DO NOTHING
+               RETURNING comic_id, created_at""",
+            likes, page_size=len(likes), fetch=True
+        )
+        for row in added:
+            deltas[row['comic_id']][0] += 1
+            deltas[row['comic_id']][3] += weight(row['created_at'])
+
+    unlikes = sorted(pair for pair, event in like_state.items() if event['kind'] == 'unlike')
+    if unlikes:
+        removed = execute_values(
+            cursor,
+            """DELETE FROM likes l USING (VALUES %s) v(user_id, comic_id)
+               WHERE l.user_id = v.user_id AND l.comic_id = v.comic_id
+               RETURNING l.comic_id, l.created_at""",
+            unlikes, page_size=len(unlikes), fetch=True
+        )
+        # Take back exactly what each like added: its weight at the time it was made
+        for row in removed:
+            deltas[row['comic_id']][0] -= 1
+            deltas[row['comic_id']][3] -= weight(row['created_at'])
+
+    if rates:
+        pairs = sorted(rates)
+        previous = {
+            (row['user_id'], row['comic_id']): row
+            for row in execute_values(
+                cursor,
+                """SELECT r.user_id, r.comic_id, r.rating, COALESCE(r.updated_at, r.created_at) as rated_at
+                   FROM ratings r JOIN (VALUES %s) v(user_id, comic_id)
+                     ON r.user_id = v.user_id AND r.comic_id = v.comic_id
+                   FOR UPDATE OF r""",
+                pairs, page_size=len(pairs), fetch=True
+            )
+        }
+        execute_values(
+            cursor,
+            """INSERT INTO ratings (user_id, comic_id, rating, created_at, updated_at) VALUES %s
+               ON CONFLICT (user_id, comic_id)
+               DO UPDATE SET rating = EXCLUDED.rating, updated_at = EXCLUDED.updated_at""",
+            [(user_id, comic_id, rates[(user_id, comic_id)]['rating'],
+              rates[(user_id, comic_id)]['created_at'], rates[(user_id, comic_id)]['created_at'])
+             for user_id, comic_id in pairs],
+            page_size=len(pairs)
+        )
+        for pair in pairs:
+            event, old = rates[pair], previous.get(pair)
+            delta = deltas[pair[1]]
+            delta[1] += event['rating'] - (old['rating'] if old else 0)
+            delta[2] += 0 if old else 1
+            # A changed rating replaces the old one for trending as well: take back what the
+            # old rating added at the time it was made, like an unlike does, then add the new one
+            if old:
+                delta[3] -= old['rating'] / 5.0 * weight(old['rated_at'])
+            delta[3] += event['rating'] / 5.0 * weight(event['created_at'])
+
+    comics: Dict[int, int] = {}
+    if deltas:
+        # One write per hot comic per batch, in id order so concurrent writers cannot deadlock
+        updated = execute_values(
+            cursor,
+            """UPDATE comics c SET
+                   likes_count = GREATEST(c.likes_count + v.likes, 0),
+                   rating_sum = c.rating_sum + v.rating_sum,
+                   rating_count = c.rating_count + v.rating_count,
+                   trending_score = GREATEST(c.trending_score + v.trending, 0),
+                   bayes_rating = COALESCE((
+                       SELECT (p.rating_prior_weight * p.rating_prior_mean + c.rating_sum + v.rating_sum)
+                              / (p.rating_prior_weight + c.rating_count + v.rating_count)
+                       FROM ranking_params p
+                   ), c.bayes_rating)
+               FROM (VALUES %s) v(comic_id, likes, rating_sum, rating_count, trending)
+               WHERE c.id = v.comic_id
+               RETURNING c.id, c.user_id""",
+            [(comic_id, *delta) for comic_id, delta in sorted(deltas.items())],
+            template='(%s, %s, %s, %s, %s::float8)', page_size=len(deltas), fetch=True
+        )
+        comics = {row['id']: row['user_id'] for row in updated}
+
+        # author_id -> [likes, rating_sum, rating_count, latest activity], one upsert per author
+        authors: Dict[int, List[Any]] = {}
+        for comic_id, author_id in comics.items():
+            totals = authors.setdefault(author_id, [0, 0, 0, latest[comic_id]])
+            for index in range(3):
+                totals[index] += deltas[comic_id][index]
+            totals[3] = max(totals[3], latest[comic_id])
+        if authors:
+            execute_values(
+                cursor,
+                """INSERT INTO user_stats (user_id, likes_received, rating_sum_received, ratings_received,
+                                          last_activity_at) VALUES %s
+                   ON CONFLICT (user_id) DO UPDATE SET
+                       likes_received = GREATEST(user_stats.likes_received + EXCLUDED.likes_received, 0),
+                       rating_sum_received = user_stats.rating_sum_received + EXCLUDED.rating_sum_received,
+                       ratings_received = user_stats.ratings_received + EXCLUDED.ratings_received,
+                       last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at)""",
+                [(author_id, *totals) for author_id, totals in sorted(authors.items())],
+                page_size=len(authors)
+            )
+
+    applied = [event['id'] for event in events]
+    cursor.execute("UPDATE interaction_events SET applied_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)", (applied,))
+    cursor.execute(
+        "DELETE FROM interaction_events WHERE applied_at < CURRENT_TIMESTAMP - make_interval(hours => %s)",
+        (EVENT_RETENTION_HOURS,)
+    )
+    return {'applied': applied, 'comics': comics}
+
+
+def drain() -> Tuple[int, Set[int]]:
+    '''Flush batches until the queue is empty or another instance holds the lock'''
+    total, touched = 0, set()
+    with db.connection() as conn, db.cursor(conn) as cursor:
+        while True:
+            result = flush(cursor)
+            conn.commit()
+            if not result or not result['applied']:
+                return total, touched
+            total += len(result['applied'])
+            for comic_id, author_id in result['comics'].items():
+                response_cache.invalidate(f'comic:{comic_id}', f'user:{author_id}')
+                touched.add(comic_id)
+
+
+if __name__ == '__main__':
+    applied, comic_ids = drain()
+    print(f'Applied {applied} interaction event(s) to {len(comic_ids)} comic(s)')
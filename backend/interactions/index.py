@@ -1,185 +1,323 @@
 import json
-import os
-from typing import Dict, Any
+import base64
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import cache
+import events
+import sessions
+from cache import response_cache
+from router import Field, HttpError, Request, Response, Router
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+DEFAULT_COMMENTS_PAGE = 20
+MAX_COMMENTS_PAGE = 100
+MAX_REPLIES_PREVIEW = 20
+MAX_IDEMPOTENCY_KEY = 100
+
+# Cached comic pages are served by the comics function; only a shared CACHE_URL
+# lets invalidations from here reach them before CACHE_TTL expires
+if not cache.CACHE_URL:
+    print(f'CACHE_URL is not set: comic pages stay stale for up to {cache.CACHE_TTL}s after interactions')
+
+router = Router(allow_headers='Content-Type, X-Auth-Token, X-User-Id, Idempotency-Key')
+
+COMIC_ACTION = {
+    'user_id': Field(int),
+    'comic_id': Field(int, required=True)
+}
+
+# Likes and ratings go through the write-behind queue in events.py
+QUEUED_ACTION = {
+    **COMIC_ACTION,
+    'idempotency_key': Field(str, strip=True)
+}
+
+COMMENT_COLUMNS = """
+    c.id, c.user_id, c.comic_id, c.parent_id, c.content, c.replies_count,
+    c.created_at, c.updated_at, u.username, u.display_name, u.avatar_url
+"""
+
+
+def encode_cursor(created_at: datetime, comment_id: int) -> str:
+    '''Pack the (created_at, id) keyset position into an opaque URL-safe token'''
+    raw = json.dumps([created_at.isoformat(), comment_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    '''Unpack a token produced by encode_cursor, None if it is malformed'''
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, comment_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(comment_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def fetch_comments(cursor: Any, comic_id: Any, position: Optional[Tuple[datetime, int]], limit: int,
+                   replies: Optional[int], parent_id: Optional[int]) -> List[Dict[str, Any]]:
     '''
-    Business: Handle likes, comments and ratings for comics
-    Args: event with httpMethod (GET/POST/DELETE), body with action
-          context with request_id
-    Returns: HTTP response with interaction result
+    Read one keyset page of comments
+    Args: cursor, comic_id, position after which to continue (or None), row limit,
+          replies - preview size per top-level comment (None for the flat newest-first list),
+          parent_id - page through the replies of one comment, oldest first
+    Returns: comment rows; in threaded mode each carries a "replies" list
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    if parent_id is not None:
+        cursor.execute("""
+            SELECT """ + COMMENT_COLUMNS + """
+            FROM comments c
+            JOIN users u ON c.user_id = u.id
+            WHERE c.parent_id = %s AND c.comic_id = %s
+        """ + ("AND (c.created_at, c.id) > (%s, %s)" if position else "") + """
+            ORDER BY c.created_at, c.id
+            LIMIT %s
+        """, (parent_id, comic_id) + (position or ()) + (limit,))
+        return [dict(comment) for comment in cursor.fetchall()]
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    keyset = "AND (c.created_at, c.id) < (%s, %s)" if position else ""
+    if replies is None:
+        cursor.execute("""
+            SELECT """ + COMMENT_COLUMNS + """
+            FROM comments c
+            JOIN users u ON c.user_id = u.id
+            WHERE c.comic_id = %s
+        """ + keyset + """
+            ORDER BY c.created_at DESC, c.id DESC
+            LIMIT %s
+        """, (comic_id,) + (position or ()) + (limit,))
+        return [dict(comment) for comment in cursor.fetchall()]
     
-    if method == 'GET':
-        params = event.get('queryStringParameters') or {}
-        action = params.get('action')
-        comic_id = params.get('comic_id')
-        
-        if action == 'comments' and comic_id:
-            cursor.execute("""
-                SELECT c.*, u.username, u.display_name, u.avatar_url
+    # Page of top-level comments plus the first N replies of each, in one round trip
+    cursor.execute("""
+        WITH page AS (
+            SELECT """ + COMMENT_COLUMNS + """
+            FROM comments c
+            JOIN users u ON c.user_id = u.id
+            WHERE c.comic_id = %s AND c.parent_id IS NULL
+        """ + keyset + """
+            ORDER BY c.created_at DESC, c.id DESC
+            LIMIT %s
+        )
+        SELECT page.*, COALESCE(thread.replies, '[]'::json) as replies
+        FROM page
+        LEFT JOIN LATERAL (
+            SELECT json_agg(row_to_json(r) ORDER BY r.created_at, r.id) as replies
+            FROM (
+                SELECT """ + COMMENT_COLUMNS + """
                 FROM comments c
                 JOIN users u ON c.user_id = u.id
-                WHERE c.comic_id = %s
-                ORDER BY c.created_at DESC
-            """, (comic_id,))
-            
-            comments = [dict(comment) for comment in cursor.fetchall()]
-            for comment in comments:
-                comment['created_at'] = comment['created_at'].isoformat()
-                comment['updated_at'] = comment['updated_at'].isoformat()
-            
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'comments': comments}),
-                'isBase64Encoded': False
-            }
+                WHERE c.parent_id = page.id
+                ORDER BY c.created_at, c.id
+                LIMIT %s
+            ) r
+        ) thread ON TRUE
+        ORDER BY page.created_at DESC, page.id DESC
+    """, (comic_id,) + (position or ()) + (limit, replies))
+    return [dict(comment) for comment in cursor.fetchall()]
+
+
+def invalidate_comic(comic_id: int, counters: Optional[Dict[str, Any]]) -> None:
+    '''Drop cached comic detail and the author's listings after a committed interaction'''
+    if counters:
+        response_cache.invalidate(f'comic:{comic_id}', f"user:{counters['user_id']}")
+
+
+def viewer_state(cursor: Any, user_id: int, comic_id: int) -> Dict[str, Any]:
+    '''The user's applied like and rating of a comic plus their newest queued ones (None if nothing is queued)'''
+    cursor.execute("""
+        SELECT EXISTS (SELECT 1 FROM likes WHERE user_id = %(user_id)s AND comic_id = %(comic_id)s) as liked,
+               (SELECT rating FROM ratings WHERE user_id = %(user_id)s AND comic_id = %(comic_id)s) as rating,
+               (SELECT kind FROM interaction_events
+                WHERE applied_at IS NULL AND user_id = %(user_id)s AND comic_id = %(comic_id)s AND kind <> 'rate'
+                ORDER BY id DESC LIMIT 1) as queued_like,
+               (SELECT rating FROM interaction_events
+                WHERE applied_at IS NULL AND user_id = %(user_id)s AND comic_id = %(comic_id)s AND kind = 'rate'
+                ORDER BY id DESC LIMIT 1) as queued_rating
+    """, {'user_id': user_id, 'comic_id': comic_id})
+    return cursor.fetchone()
+
+
+def record_interaction(request: Request, cursor: Any, kind: str, rating: Optional[int] = None) -> Dict[str, Any]:
+    '''
+    Queue a like/unlike/rate, apply the pending batch unless another request is
+    already doing so, then read the comic's maintained counters
+    Returns: counters plus pending (not applied yet) and duplicate (Idempotency-Key seen before);
+             while pending, the counters already include this user's queued like and rating
+    '''
+    user_id = sessions.require_user(cursor, request.event, request.data['user_id'])
+    comic_id = request.data['comic_id']
+    idempotency_key = request.header('Idempotency-Key') or request.data['idempotency_key']
+    if idempotency_key and len(idempotency_key) > MAX_IDEMPOTENCY_KEY:
+        raise HttpError(400, f'Idempotency-Key must be at most {MAX_IDEMPOTENCY_KEY} characters')
     
-    elif method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        action = body_data.get('action')
-        user_id = body_data.get('user_id')
-        comic_id = body_data.get('comic_id')
-        
-        if not user_id or not comic_id:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'user_id and comic_id required'}),
-                'isBase64Encoded': False
-            }
-        
-        if action == 'like':
-            cursor.execute(
-                "INSERT INTO likes (user_id, comic_id) VALUES (%s, %s) ON CONFLICT (user_id, comic_id) DO NOTHING",
-                (user_id, comic_id)
-            )
-            conn.commit()
-            
-            cursor.execute("SELECT COUNT(*) as count FROM likes WHERE comic_id = %s", (comic_id,))
-            likes_count = cursor.fetchone()['count']
-            
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'message': 'Liked', 'likes_count': likes_count}),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'comment':
-            content = body_data.get('content', '').strip()
-            if not content:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'content required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute(
-                "INSERT INTO comments (user_id, comic_id, content) VALUES (%s, %s, %s) RETURNING id, created_at",
-                (user_id, comic_id, content)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-            
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'message': 'Comment added',
-                    'comment_id': result['id'],
-                    'created_at': result['created_at'].isoformat()
-                }),
-                'isBase64Encoded': False
-            }
-        
-        elif action == 'rate':
-            rating = body_data.get('rating')
-            if not rating or rating < 1 or rating > 5:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'rating must be between 1 and 5'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute(
-                """INSERT INTO ratings (user_id, comic_id, rating) 
-                   VALUES (%s, %s, %s) 
-                   ON CONFLICT (user_id, comic_id) 
-                   DO UPDATE SET rating = EXCLUDED.rating, updated_at = CURRENT_TIMESTAMP""",
-                (user_id, comic_id, rating)
-            )
-            conn.commit()
-            
-            cursor.execute("SELECT AVG(rating) as avg_rating FROM ratings WHERE comic_id = %s", (comic_id,))
-            avg_rating = float(cursor.fetchone()['avg_rating'])
-            
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'message': 'Rated', 'avg_rating': avg_rating}),
-                'isBase64Encoded': False
-            }
+    try:
+        event_id, duplicate = events.enqueue(cursor, user_id, comic_id, kind, rating, idempotency_key)
+    except psycopg2.errors.ForeignKeyViolation:
+        raise HttpError(404, 'Comic not found')
+    request.conn.commit()
     
-    elif method == 'DELETE':
-        body_data = json.loads(event.get('body', '{}'))
-        action = body_data.get('action')
-        user_id = body_data.get('user_id')
-        comic_id = body_data.get('comic_id')
-        
-        if action == 'unlike' and user_id and comic_id:
-            cursor.execute("DELETE FROM likes WHERE user_id = %s AND comic_id = %s", (user_id, comic_id))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'message': 'Unliked'}),
-                'isBase64Encoded': False
-            }
+    # The event is durable now; a failed flush only leaves it for the next one
+    try:
+        result = events.flush(cursor)
+        request.conn.commit()
+    except psycopg2.Error as error:
+        request.conn.rollback()
+        print(f'interaction flush failed: {error}')
+        result = None
+    if result:
+        for touched_id, author_id in result['comics'].items():
+            invalidate_comic(touched_id, {'user_id': author_id})
     
-    cursor.close()
-    conn.close()
-    return {
-        'statusCode': 400,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Invalid request'}),
-        'isBase64Encoded': False
+    pending = not result or event_id not in set(result['applied'])
+    if pending:
+        cursor.execute("SELECT applied_at FROM interaction_events WHERE id = %s", (event_id,))
+        queued = cursor.fetchone()
+        pending = bool(queued) and queued['applied_at'] is None
+    
+    cursor.execute("SELECT likes_count, rating_sum, rating_count FROM comics WHERE id = %s", (comic_id,))
+    counters = dict(cursor.fetchone())
+    if pending:
+        # Another request holds the flush: count what it will apply for this user, so the
+        # client does not see its own action bounce back
+        state = viewer_state(cursor, user_id, comic_id)
+        if state['queued_like'] is not None:
+            counters['likes_count'] += (state['queued_like'] == 'like') - state['liked']
+        if state['queued_rating'] is not None:
+            counters['rating_sum'] += state['queued_rating'] - (state['rating'] or 0)
+            counters['rating_count'] += 0 if state['rating'] else 1
+    return {**counters, 'pending': pending, 'duplicate': duplicate}
+
+
+@router.route('HEAD', action='comments', query={'comic_id': Field(int, required=True)})
+@router.route('GET', action='comments', query={
+    'comic_id': Field(int, required=True),
+    'limit': Field(int, default=DEFAULT_COMMENTS_PAGE, min=1, max=MAX_COMMENTS_PAGE, clamp=True),
+    'cursor': Field(str),
+    'replies': Field(int, min=0, max=MAX_REPLIES_PREVIEW, clamp=True),
+    'parent_id': Field(int)
+})
+def get_comments(request: Request, cursor: Any) -> Response:
+    '''Keyset page of comments (flat, threaded or one thread); HEAD returns only the count'''
+    comic_id = request.args['comic_id']
+    
+    cursor.execute("SELECT comments_count FROM comics WHERE id = %s", (comic_id,))
+    counters = cursor.fetchone()
+    count_headers = {
+        'Access-Control-Expose-Headers': 'X-Comment-Count',
+        'X-Comment-Count': str(counters['comments_count'] if counters else 0)
     }
+    
+    if request.method == 'HEAD':
+        return Response(headers=count_headers, body='')
+    
+    position = None
+    if request.args['cursor']:
+        position = decode_cursor(request.args['cursor'])
+        if not position:
+            raise HttpError(400, 'Invalid cursor')
+    
+    limit = request.args['limit']
+    comments = fetch_comments(cursor, comic_id, position, limit + 1, request.args['replies'], request.args['parent_id'])
+    next_cursor = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        next_cursor = encode_cursor(comments[-1]['created_at'], comments[-1]['id'])
+    
+    return Response({'comments': comments, 'next_cursor': next_cursor}, headers=count_headers)
+
+
+@router.route('GET', action='state', query=COMIC_ACTION)
+def get_state(request: Request, cursor: Any) -> Response:
+    '''The viewer's like and rating of a comic, including queued actions not applied yet'''
+    user_id = sessions.require_user(cursor, request.event, request.args['user_id'])
+    state = viewer_state(cursor, user_id, request.args['comic_id'])
+    liked = state['liked'] if state['queued_like'] is None else state['queued_like'] == 'like'
+    return Response({'liked': liked, 'rating': state['queued_rating'] or state['rating']})
+
+
+@router.route('POST', action='like', rate='interaction', body=QUEUED_ACTION)
+def like(request: Request, cursor: Any) -> Response:
+    '''Like once per user and return the maintained count'''
+    result = record_interaction(request, cursor, 'like')
+    return Response({'message': 'Liked', 'likes_count': result['likes_count'], 'pending': result['pending']})
+
+
+@router.route('POST', action='comment', rate='comment', body={
+    **COMIC_ACTION,
+    'content': Field(str, required=True, strip=True),
+    'parent_id': Field(int)
+})
+def comment(request: Request, cursor: Any) -> Response:
+    '''Add a comment or a reply to a top-level comment'''
+    user_id = sessions.require_user(cursor, request.event, request.data['user_id'])
+    comic_id, parent_id = request.data['comic_id'], request.data['parent_id']
+    
+    if parent_id:
+        # Threads are one level deep: replies attach to top-level comments of the same comic
+        cursor.execute(
+            """UPDATE comments SET replies_count = replies_count + 1
+               WHERE id = %s AND comic_id = %s AND parent_id IS NULL
+               RETURNING id""",
+            (parent_id, comic_id)
+        )
+        if not cursor.fetchone():
+            raise HttpError(400, 'parent_id must be a top-level comment on this comic')
+    
+    try:
+        cursor.execute(
+            "INSERT INTO comments (user_id, comic_id, content, parent_id) VALUES (%s, %s, %s, %s) RETURNING id, created_at",
+            (user_id, comic_id, request.data['content'], parent_id or None)
+        )
+    except psycopg2.errors.ForeignKeyViolation:
+        raise HttpError(404, 'Comic not found')
+    result = cursor.fetchone()
+    cursor.execute("UPDATE comics SET comments_count = comments_count + 1 WHERE id = %s RETURNING user_id", (comic_id,))
+    counters = cursor.fetchone()
+    if counters:
+        cursor.execute(
+            """INSERT INTO user_stats (user_id, comments_received, last_activity_at) VALUES (%s, 1, %s)
+               ON CONFLICT (user_id) DO UPDATE SET
+                   comments_received = user_stats.comments_received + 1,
+                   last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at)""",
+            (counters['user_id'], result['created_at'])
+        )
+    request.conn.commit()
+    invalidate_comic(comic_id, counters)
+    
+    return Response({
+        'message': 'Comment added',
+        'comment_id': result['id'],
+        'created_at': result['created_at']
+    }, status=201)
+
+
+@router.route('POST', action='rate', rate='interaction', body={
+    **QUEUED_ACTION,
+    'rating': Field(int, required=True, min=1, max=5)
+})
+def rate(request: Request, cursor: Any) -> Response:
+    '''Set or change the user's rating and return the maintained average'''
+    result = record_interaction(request, cursor, 'rate', request.data['rating'])
+    avg_rating = result['rating_sum'] / result['rating_count'] if result['rating_count'] else 0.0
+    return Response({'message': 'Rated', 'avg_rating': avg_rating, 'pending': result['pending']})
+
+
+@router.route('DELETE', action='unlike', rate='interaction', body=QUEUED_ACTION)
+def unlike(request: Request, cursor: Any) -> Response:
+    '''Remove the like and return the maintained count'''
+    result = record_interaction(request, cursor, 'unlike')
+    return Response({'message': 'Unliked', 'likes_count': result['likes_count'], 'pending': result['pending']})
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Handle likes, comments and ratings for comics
+    Args: event with httpMethod (GET/HEAD/POST/DELETE), queryStringParameters for
+          action=comments (comic_id, limit, cursor, replies, parent_id) and
+          action=state (comic_id, the viewer's like and rating), body with action;
+          like/unlike/rate take an Idempotency-Key header (or idempotency_key) per client action
+          context with request_id
+    Returns: HTTP response with interaction result
+    '''
+    return router(event, context)
@@ -0,0 +1,165 @@
+'''
+Session tokens: issuing, hashing and verifying X-Auth-Token.
+
+Every function directory ships an identical copy of this module - change them
+together. Verification results are cached per warm instance, so most
+authenticated requests need no database round trip. A revoked or expired
+session can stay accepted for at most TOKEN_CACHE_TTL seconds.
+
+Routes that act as a user need a live session. REQUIRE_AUTH_TOKEN=0 is a
+rollout escape hatch only: requests without X-Auth-Token then act as the
+user_id they claim, which lets anyone act as anyone.
+'''
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from router import HttpError
+
+SESSION_TTL_DAYS = int(os.environ.get('SESSION_TTL_DAYS', '30'))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '2048'))
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', '60'))
+# Expired sessions deleted per new session, bounded so a login never pays for a large backlog
+EXPIRED_PURGE_BATCH = int(os.environ.get('EXPIRED_SESSION_PURGE_BATCH', '100'))
+REQUIRE_AUTH_TOKEN = os.environ.get('REQUIRE_AUTH_TOKEN', '1') == '1'
+
+
+class TokenCache:
+    '''Bounded LRU of token hash -> user id where every entry also expires after a TTL'''
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[int, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user_id, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user_id
+
+    def put(self, key: str, user_id: int, max_age: Optional[float] = None) -> None:
+        ttl = self.ttl if max_age is None else min(self.ttl, max_age)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (user_id, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def token_from_event(event: Dict[str, Any]) -> Optional[str]:
+    '''X-Auth-Token header of the request, header names are matched case-insensitively'''
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == 'x-auth-token' and value:
+            return value
+    return None
+
+
+def cached_user(event: Dict[str, Any]) -> Optional[int]:
+    '''User id of the event's token if this instance verified it recently - never queries'''
+    token = token_from_event(event)
+    return _cache.get(hash_token(token)) if token else None
+
+
+def create_session(cursor: Any, user_id: int) -> str:
+    '''Store a new session for user_id and return its raw token (only the hash is persisted)'''
+    token = secrets.token_urlsafe(32)
+    # Expired rows are never read again, new sessions clear them out a batch at a time
+    cursor.execute(
+        "DELETE FROM sessions WHERE id IN ("
+        "SELECT id FROM sessions WHERE expires_at < CURRENT_TIMESTAMP LIMIT %s FOR UPDATE SKIP LOCKED)",
+        (EXPIRED_PURGE_BATCH,)
+    )
+    cursor.execute(
+        "INSERT INTO sessions (user_id, token_hash, expires_at) VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(days => %s))",
+        (user_id, hash_token(token), SESSION_TTL_DAYS)
+    )
+    return token
+
+
+def revoke_session(cursor: Any, token: str) -> None:
+    '''Delete the session behind token, this instance stops accepting it immediately'''
+    token_hash = hash_token(token)
+    cursor.execute("DELETE FROM sessions WHERE token_hash = %s", (token_hash,))
+    _cache.discard(token_hash)
+
+
+def verify_token(cursor: Any, token: Optional[str]) -> Optional[int]:
+    '''
+    Resolve a raw token to its user id
+    Args: open cursor (only used on a cache miss), raw token or None
+    Returns: user id of a live session, None for missing, unknown or expired tokens
+    '''
+    if not token:
+        return None
+    token_hash = hash_token(token)
+    user_id = _cache.get(token_hash)
+    if user_id is not None:
+        return user_id
+    cursor.execute(
+        """SELECT user_id, EXTRACT(EPOCH FROM (expires_at - CURRENT_TIMESTAMP)) as remaining
+           FROM sessions
+           WHERE token_hash = %s AND expires_at > CURRENT_TIMESTAMP""",
+        (token_hash,)
+    )
+    session = cursor.fetchone()
+    if not session:
+        return None
+    _cache.put(token_hash, session['user_id'], float(session['remaining']))
+    return session['user_id']
+
+
+def authenticate(cursor: Any, event: Dict[str, Any], claimed_user_id: Any) -> Tuple[Optional[Any], bool]:
+    '''
+    Decide which user a write request acts as
+    Args: open cursor, the event, user_id sent in the request body
+    Returns: (user_id, ok) - the session owner when X-Auth-Token is sent; ok is
+             False when the token is not a live session, and when none is sent
+             unless REQUIRE_AUTH_TOKEN=0 lets the claimed id through
+    '''
+    token = token_from_event(event)
+    if not token:
+        return (None, False) if REQUIRE_AUTH_TOKEN else (claimed_user_id, True)
+    user_id = verify_token(cursor, token)
+    return user_id, user_id is not None
+
+
+def unauthorized(event: Dict[str, Any]) -> HttpError:
+    '''401 telling a missing token apart from one that is not a live session'''
+    if token_from_event(event):
+        return HttpError(401, 'Invalid or expired token')
+    return HttpError(401, 'Authentication required')
+
+
+def require_user(cursor: Any, event: Dict[str, Any], claimed_user_id: Any) -> Any:
+    '''authenticate() for routes that act as a user: 401 without a live session, 400 without any user'''
+    user_id, ok = authenticate(cursor, event, claimed_user_id)
+    if not ok:
+        raise unauthorized(event)
+    if not user_id:
+        raise HttpError(400, 'user_id required')
+    return user_id
@@ -0,0 +1,57 @@
+'''
+Per-request latency with a fresh psycopg2.connect() versus the pooled db module.
+
+Usage: DATABASE_URL=postgresql://localhost/forum python benchmarks/db_pool.py [requests]
+Each simulated request runs one small indexed query, which is roughly what the
+cheaper handler paths do, so the difference is dominated by connection setup.
+'''
+import os
+import statistics
+import sys
+import time
+from typing import Callable, List
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'comics'))
+import db  # noqa: E402
+
+QUERY = 'SELECT id FROM users ORDER BY id LIMIT 1'
+
+
+def per_request_connect() -> None:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor()
+    cursor.execute(QUERY)
+    cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+
+def pooled() -> None:
+    with db.connection() as conn, db.cursor(conn) as cursor:
+        cursor.execute(QUERY)
+        cursor.fetchall()
+
+
+def measure(fn: Callable[[], None], requests: int) -> List[float]:
+    fn()  # warm-up: pays the pool's first connect outside the measurement
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(name: str, timings: List[float]) -> None:
+    ordered = sorted(timings)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f'{name:<22} mean {statistics.mean(timings):7.2f} ms   '
+          f'p50 {statistics.median(timings):7.2f} ms   p99 {p99:7.2f} ms')
+
+
+if __name__ == '__main__':
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    report('connect per request', measure(per_request_connect, requests))
+    report('pooled', measure(pooled, requests))
+    db.close_pool()
@@ -0,0 +1,277 @@
+'''
+In-process load test: drives every function's handler with synthetic events.
+
+Usage: DATABASE_URL=postgresql://localhost/forum_bench python benchmarks/load_test.py [options]
+  --requests N      requests per endpoint (default 300)
+  --concurrency C   client threads per endpoint (default 4, keep <= DB_POOL_MAX_SIZE)
+  --only TEXT       run only endpoints whose name contains TEXT
+  --writes          also run the write endpoints (they add rows to the database)
+  --no-cache        disable the response cache to measure the queries themselves
+  --json PATH       save the results, --compare PATH checks them against a saved run
+
+Seed the database with benchmarks/seed.py first. Each endpoint runs on its own
+so the numbers are not blended; for each one the report shows throughput,
+p50/p95/p99 latency, non-2xx answers and SQL statements per request (taken
+from the router's query tracking). With --compare the run fails (exit 1) when
+an endpoint's p95 grows by more than --tolerance or it issues more statements
+than before, so a listing that suddenly does N+1 queries is caught before deploy.
+Per-client rate limits are off unless RATE_LIMIT=1 is set: a handful of seeded
+users would otherwise spend most of the run answering 429.
+'''
+import argparse
+import importlib
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), '..', 'backend')
+FUNCTIONS = ('auth', 'chat', 'comics', 'interactions')
+# Modules every function ships its own copy of; they must not leak from one function to the next
+FUNCTION_MODULES = ('index', 'db', 'router', 'sessions', 'cache', 'passwords', 'events', 'views', 'limits', 'archive')
+BENCH_PASSWORD = 'bench-password'
+# Words the seed puts into titles, genres and author names, plus a misspelling
+SEARCH_TERMS = ('comic', 'fantasy', 'horror', 'bench', 'synthetc', 'drama comic')
+
+# Read by every function's limits.py at import time
+os.environ.setdefault('RATE_LIMIT', '0')
+# No endpoint here long-polls: give the whole pool to the measured requests
+os.environ.setdefault('MAX_LONG_POLLS', '0')
+
+_counters = threading.local()
+
+
+def load_function(name: str) -> Dict[str, ModuleType]:
+    '''Import one function's index with its own db/router/sessions copies and record its query counts'''
+    for module in FUNCTION_MODULES:
+        sys.modules.pop(module, None)
+    path = os.path.join(BACKEND_DIR, name)
+    sys.path.insert(0, path)
+    try:
+        importlib.import_module('index')
+    finally:
+        sys.path.remove(path)
+    modules = {module: sys.modules.pop(module) for module in FUNCTION_MODULES if module in sys.modules}
+    # Timing hooks run on the request's thread, right before the handler returns
+    modules['index'].router.timing_hooks.append(
+        lambda timing: setattr(_counters, 'queries', timing.queries.count)
+    )
+    return modules
+
+
+def event(method: str, params: Optional[Dict[str, Any]] = None, body: Optional[Dict[str, Any]] = None,
+          token: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        'httpMethod': method,
+        'queryStringParameters': {key: str(value) for key, value in (params or {}).items()},
+        'headers': {'X-Auth-Token': token} if token else {},
+        'body': json.dumps(body) if body is not None else None,
+        'requestContext': {'requestId': 'load-test'}
+    }
+
+
+class Context:
+    '''Ids and tokens picked from the seeded database that the endpoint events refer to'''
+
+    def __init__(self, functions: Dict[str, Dict[str, ModuleType]], sessions_per_run: int = 50):
+        auth = functions['auth']
+        with auth['db'].connection() as conn, auth['db'].cursor(conn) as cursor:
+            cursor.execute("SELECT MIN(id) as low, MAX(id) as high FROM comics")
+            comics = cursor.fetchone()
+            if comics['low'] is None:
+                raise SystemExit('No comics found - run benchmarks/seed.py first')
+            self.comic_range = (comics['low'], comics['high'])
+            # Hot comics: the ones the seed skewed likes and comments towards
+            cursor.execute("SELECT id FROM comics ORDER BY comments_count DESC LIMIT 20")
+            self.hot_comics = [row['id'] for row in cursor.fetchall()]
+            cursor.execute("SELECT user_id FROM comics GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 50")
+            self.authors = [row['user_id'] for row in cursor.fetchall()]
+            cursor.execute("SELECT id, username FROM users WHERE username LIKE 'bench\\_%%' ORDER BY id LIMIT %s",
+                           (sessions_per_run,))
+            self.users = cursor.fetchall()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) as last_id FROM chat_messages")
+            self.last_chat_id = cursor.fetchone()['last_id']
+            self.tokens = {user['id']: auth['sessions'].create_session(cursor, user['id']) for user in self.users}
+            cursor.execute("SELECT user_id, peer_id FROM conversations WHERE user_id = ANY(%s)",
+                           (list(self.tokens),))
+            self.conversations = [(row['user_id'], row['peer_id']) for row in cursor.fetchall()]
+            conn.commit()
+
+        first_page = json.loads(functions['comics']['index'].handler(event('GET'), None)['body'])
+        self.feed_cursor = first_page.get('next_cursor')
+        self.ids = iter(range(10 ** 9))
+        self._lock = threading.Lock()
+
+    def comic(self) -> int:
+        return random.randint(*self.comic_range)
+
+    def hot_comic(self) -> int:
+        return random.choice(self.hot_comics)
+
+    def user(self) -> Dict[str, Any]:
+        return random.choice(self.users)
+
+    def token(self) -> str:
+        return self.tokens[self.user()['id']]
+
+    def conversation(self) -> Dict[str, Any]:
+        user_id, peer_id = random.choice(self.conversations)
+        return {'token': self.tokens[user_id], 'peer_id': peer_id}
+
+    def unique(self) -> int:
+        with self._lock:
+            return next(self.ids)
+
+
+class Endpoint:
+    def __init__(self, name: str, function: str, make_event: Callable[[Context], Dict[str, Any]],
+                 writes: bool = False):
+        self.name = name
+        self.function = function
+        self.make_event = make_event
+        self.writes = writes
+
+
+ENDPOINTS = [
+    Endpoint('comics.feed', 'comics', lambda ctx: event('GET')),
+    Endpoint('comics.feed_page2', 'comics', lambda ctx: event('GET', {'cursor': ctx.feed_cursor} if ctx.feed_cursor else {})),
+    Endpoint('comics.trending', 'comics', lambda ctx: event('GET', {'sort': 'trending'})),
+    Endpoint('comics.top_rated', 'comics', lambda ctx: event('GET', {'sort': 'top_rated'})),
+    Endpoint('comics.search', 'comics', lambda ctx: event('GET', {'action': 'search', 'q': random.choice(SEARCH_TERMS)})),
+    Endpoint('comics.by_author', 'comics', lambda ctx: event('GET', {'user_id': random.choice(ctx.authors)})),
+    Endpoint('comics.profile', 'comics', lambda ctx: event('GET', {'action': 'profile', 'user_id': random.choice(ctx.authors)})),
+    Endpoint('comics.detail', 'comics', lambda ctx: event('GET', {'id': ctx.comic()})),
+    Endpoint('comics.related', 'comics', lambda ctx: event('GET', {'action': 'related', 'id': ctx.comic()})),
+    Endpoint('interactions.comments', 'interactions',
+             lambda ctx: event('GET', {'action': 'comments', 'comic_id': ctx.hot_comic()})),
+    Endpoint('interactions.comments_threaded', 'interactions',
+             lambda ctx: event('GET', {'action': 'comments', 'comic_id': ctx.hot_comic(), 'replies': 3})),
+    Endpoint('interactions.comic_view', 'interactions', lambda ctx: (lambda comic_id: event(
+        'POST', {'action': 'batch'}, {'requests': [
+            {'query': {'action': 'comments', 'comic_id': comic_id, 'replies': 3}},
+            {'query': {'action': 'state', 'comic_id': comic_id}}
+        ]}, token=ctx.token()))(ctx.hot_comic())),
+    Endpoint('chat.room', 'chat', lambda ctx: event('GET')),
+    Endpoint('chat.after_id', 'chat', lambda ctx: event('GET', {'after_id': max(ctx.last_chat_id - 20, 0)})),
+    Endpoint('chat.inbox', 'chat', lambda ctx: event('GET', {'action': 'inbox'}, token=ctx.token())),
+    Endpoint('chat.thread', 'chat', lambda ctx: (lambda conv: event(
+        'GET', {'action': 'thread', 'peer_id': conv['peer_id']}, token=conv['token']))(ctx.conversation())),
+    Endpoint('auth.verify', 'auth', lambda ctx: event('POST', {}, {'action': 'verify'}, token=ctx.token())),
+    Endpoint('auth.login', 'auth', lambda ctx: event(
+        'POST', {}, {'action': 'login', 'username': ctx.user()['username'], 'password': BENCH_PASSWORD})),
+    Endpoint('interactions.comment', 'interactions', lambda ctx: event(
+        'POST', {}, {'action': 'comment', 'comic_id': ctx.hot_comic(), 'content': f'load test {ctx.unique()}'},
+        token=ctx.token()), writes=True),
+    Endpoint('interactions.like', 'interactions', lambda ctx: event(
+        'POST', {}, {'action': 'like', 'comic_id': ctx.comic()}, token=ctx.token()), writes=True),
+    Endpoint('interactions.rate', 'interactions', lambda ctx: event(
+        'POST', {}, {'action': 'rate', 'comic_id': ctx.comic(), 'rating': random.randint(1, 5)},
+        token=ctx.token()), writes=True),
+    Endpoint('chat.send', 'chat', lambda ctx: event(
+        'POST', {}, {'message': f'load test {ctx.unique()}'}, token=ctx.token()), writes=True),
+    Endpoint('chat.dm', 'chat', lambda ctx: (lambda conv: event(
+        'POST', {}, {'action': 'dm', 'receiver_id': conv['peer_id'], 'content': f'load test {ctx.unique()}'},
+        token=conv['token']))(ctx.conversation()), writes=True),
+]
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_endpoint(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]], endpoint: Endpoint,
+                 ctx: Context, requests: int, concurrency: int) -> Dict[str, Any]:
+    def one(_: int) -> tuple:
+        request_event = endpoint.make_event(ctx)
+        _counters.queries = 0
+        started = time.perf_counter()
+        response = handler(request_event, None)
+        return (time.perf_counter() - started) * 1000, response['statusCode'], _counters.queries
+
+    one(0)  # warm-up: pool connections, caches and the first plan of every statement
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = list(clients.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(result[0] for result in results)
+    return {
+        'requests': requests,
+        'throughput': requests / elapsed,
+        'p50': statistics.median(timings),
+        'p95': percentile(timings, 0.95),
+        'p99': percentile(timings, 0.99),
+        'errors': sum(1 for result in results if result[1] >= 400),
+        'queries': statistics.mean(result[2] for result in results)
+    }
+
+
+def report(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f'{"endpoint":<32} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7} {"queries":>8}')
+    for name, result in results.items():
+        print(f'{name:<32} {result["throughput"]:8.1f} {result["p50"]:8.2f} {result["p95"]:8.2f} '
+              f'{result["p99"]:8.2f} {result["errors"]:7d} {result["queries"]:8.2f}')
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if result['p95'] > before['p95'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {before["p95"]:.2f} -> {result["p95"]:.2f} ms')
+        if result['queries'] > before['queries'] + 0.01:
+            regressions.append(f'{name}: queries/request {before["queries"]:.2f} -> {result["queries"]:.2f}')
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Load test the backend handlers in-process')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--only', default='')
+    parser.add_argument('--writes', action='store_true')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--json', dest='json_path')
+    parser.add_argument('--compare', dest='baseline_path')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.no_cache:
+        os.environ['CACHE_MAX_ENTRIES'] = '0'
+    random.seed(42)
+
+    functions = {name: load_function(name) for name in FUNCTIONS}
+    ctx = Context(functions)
+
+    results = {}
+    for endpoint in ENDPOINTS:
+        if args.only not in endpoint.name or (endpoint.writes and not args.writes):
+            continue
+        handler = functions[endpoint.function]['index'].handler
+        results[endpoint.name] = run_endpoint(handler, endpoint, ctx, args.requests, args.concurrency)
+    report(results)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    for modules in functions.values():
+        modules['db'].close_pool()
+
+    if args.baseline_path:
+        with open(args.baseline_path) as saved:
+            regressions = compare(results, json.load(saved), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,70 @@
+'''
+Throughput of per-row versus batched comic_pages inserts.
+
+Usage: DATABASE_URL=postgresql://localhost/forum python benchmarks/page_insert.py [pages] [rounds]
+Each round creates a throwaway comic inside a transaction that is rolled back,
+so the benchmark leaves no data behind. Needs at least one row in users.
+'''
+import os
+import statistics
+import sys
+import time
+from typing import Any, Callable, List, Tuple
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'comics'))
+from index import insert_comics  # noqa: E402
+
+
+def make_pages(count: int) -> List[dict]:
+    return [
+        {'page_number': n, 'image_url': f'https://example.com/bench/{n}.jpg', 'caption': f'Page {n}'}
+        for n in range(1, count + 1)
+    ]
+
+
+def per_row(cursor: Any, user_id: int, pages: List[dict]) -> None:
+    cursor.execute(
+        "INSERT INTO comics (user_id, title, description, genre, cover_url) VALUES (%s, %s, '', '', '') RETURNING id",
+        (user_id, 'bench')
+    )
+    comic_id = cursor.fetchone()['id']
+    for page in pages:
+        cursor.execute(
+            "INSERT INTO comic_pages (comic_id, page_number, image_url, caption) VALUES (%s, %s, %s, %s)",
+            (comic_id, page['page_number'], page['image_url'], page.get('caption', ''))
+        )
+
+
+def batched(cursor: Any, user_id: int, pages: List[dict]) -> None:
+    insert_comics(cursor, [(user_id, 'bench', '', '', '', pages)])
+
+
+def run(conn: Any, fn: Callable[[Any, int, List[dict]], None], user_id: int,
+        pages: List[dict], rounds: int) -> Tuple[float, float]:
+    timings = []
+    for _ in range(rounds):
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        started = time.perf_counter()
+        fn(cursor, user_id, pages)
+        timings.append(time.perf_counter() - started)
+        cursor.close()
+        conn.rollback()
+    mean = statistics.mean(timings)
+    return mean * 1000, len(pages) / mean
+
+
+if __name__ == '__main__':
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM users ORDER BY id LIMIT 1')
+    user_id = cursor.fetchone()[0]
+    cursor.close()
+    pages = make_pages(page_count)
+    for name, fn in (('per-row', per_row), ('execute_values', batched)):
+        latency, throughput = run(conn, fn, user_id, pages, rounds)
+        print(f'{name:<15} {page_count} pages   {latency:8.2f} ms/comic   {throughput:10.0f} pages/s')
+    conn.close()
@@ -0,0 +1,51 @@
+'''
+Login-path password verification throughput and latency at the configured scrypt cost.
+
+Usage: python benchmarks/password_hashing.py [logins] [concurrency]
+Tune with the same env vars the auth function reads: SCRYPT_N, SCRYPT_R,
+SCRYPT_P, HASH_WORKERS, HASH_QUEUE. No database is needed - this isolates the
+CPU/memory cost the KDF adds to each login. Requests rejected with HasherBusy
+are counted separately; they would be answered with 503.
+'''
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'auth'))
+import passwords  # noqa: E402
+
+
+def login(stored: str) -> Optional[float]:
+    started = time.perf_counter()
+    try:
+        matches, _ = passwords.verify_password('correct horse battery staple', stored)
+    except passwords.HasherBusy:
+        return None
+    assert matches
+    return (time.perf_counter() - started) * 1000
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+if __name__ == '__main__':
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    stored = passwords.hash_password('correct horse battery staple')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = list(clients.map(lambda _: login(stored), range(logins)))
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(r for r in results if r is not None)
+    print(f'scrypt n={passwords.SCRYPT_N} r={passwords.SCRYPT_R} p={passwords.SCRYPT_P}, '
+          f'{passwords.HASH_WORKERS} workers, {concurrency} concurrent clients')
+    print(f'throughput {len(timings) / elapsed:8.1f} logins/s   rejected {len(results) - len(timings)}')
+    if timings:
+        print(f'latency    p50 {statistics.median(timings):7.1f} ms   '
+              f'p95 {percentile(timings, 0.95):7.1f} ms   p99 {percentile(timings, 0.99):7.1f} ms')
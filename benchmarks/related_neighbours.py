@@ -0,0 +1,60 @@
+'''
+Cost of the "readers also liked" job at production-like scale, without a database.
+
+Usage: python benchmarks/related_neighbours.py [interactions] [readers] [comics] [changed]
+Defaults: 1M interactions from 100k readers over 20k comics, popularity skewed
+like seed.py (random()^3), and an incremental run over 1% changed comics.
+Reports matrix build, full recompute and incremental recompute times plus the
+neighbour rows they would write. Tune block memory with RECOMMEND_BLOCK_CELLS.
+Needs numpy and scipy.
+'''
+import os
+import sys
+import time
+from typing import Any, Callable, Tuple, TypeVar
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'comics'))
+from recommendations import build_matrix, neighbour_rows, top_neighbours  # noqa: E402
+
+T = TypeVar('T')
+
+
+def synthetic(interactions: int, readers: int, comics: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(42)
+    user_ids = rng.integers(1, readers + 1, interactions)
+    comic_ids = 1 + np.floor(rng.random(interactions) ** 3 * comics).astype(np.int64)
+    # A third of the interactions are ratings, weighted like recommendations.INTERACTIONS_SQL
+    ratings = rng.integers(1, 6, interactions)
+    weights = np.where(rng.random(interactions) < 1 / 3, np.maximum(ratings - 2, 0) / 3.0, 1.0).astype(np.float32)
+    # Duplicate (reader, comic) pairs are summed by the matrix build, the SQL keeps the max - close enough here
+    return user_ids, comic_ids, weights
+
+
+def timed(fn: Callable[[], T]) -> Tuple[T, float]:
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def recompute_rows(matrix: Any, comics: np.ndarray, readers: np.ndarray, targets: np.ndarray) -> int:
+    return sum(len(neighbour_rows(comics, *block)) for block in top_neighbours(matrix, readers, targets))
+
+
+if __name__ == '__main__':
+    interactions = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+    comics = int(sys.argv[3]) if len(sys.argv) > 3 else 20_000
+    changed = float(sys.argv[4]) if len(sys.argv) > 4 else 0.01
+
+    user_ids, comic_ids, weights = synthetic(interactions, readers, comics)
+    (matrix, comic_index, reader_counts), build_ms = timed(lambda: build_matrix(user_ids, comic_ids, weights))
+    print(f'matrix       {matrix.shape[0]} readers x {matrix.shape[1]} comics, {matrix.nnz} entries   {build_ms:10.1f} ms')
+
+    everything = np.arange(matrix.shape[1])
+    rows, full_ms = timed(lambda: recompute_rows(matrix, comic_index, reader_counts, everything))
+    print(f'full         {len(everything)} comics, {rows} rows   {full_ms:10.1f} ms')
+
+    sample = np.random.default_rng(7).choice(everything, max(1, int(len(everything) * changed)), replace=False)
+    rows, incremental_ms = timed(lambda: recompute_rows(matrix, comic_index, reader_counts, np.sort(sample)))
+    print(f'incremental  {len(sample)} comics, {rows} rows   {incremental_ms:10.1f} ms')
@@ -0,0 +1,197 @@
+'''
+Scalable synthetic data for the load tests, generated server-side with generate_series.
+
+Usage: DATABASE_URL=postgresql://localhost/forum_bench python benchmarks/seed.py [options]
+  --migrate      apply db_migrations/*.sql in order first (fresh database)
+  --reset        TRUNCATE every forum table before seeding - never point this at real data
+  --scale F      multiply every default volume below by F (default 1.0)
+  --users N ...  override a single volume, see VOLUMES for the names
+
+Every user gets the password BENCH_PASSWORD. Popularity is skewed (a few comics
+collect most likes and comments) so the hot paths look like production, and
+ids grow with timestamps the way they do for real inserts. Denormalized
+counters, ranking scores and the DM conversations summary are rebuilt at the end.
+'''
+import argparse
+import glob
+import os
+import sys
+import time
+from typing import Any, Dict
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'auth'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'comics'))
+import passwords  # noqa: E402
+from reconcile_stats import reconcile_stats  # noqa: E402
+from refresh_rankings import refresh_rankings  # noqa: E402
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), '..', 'db_migrations')
+BENCH_PASSWORD = 'bench-password'
+
+VOLUMES = {
+    'users': 1000,
+    'comics': 5000,
+    'pages_per_comic': 20,
+    'likes': 50000,
+    'ratings': 30000,
+    'comments': 40000,
+    'replies': 10000,
+    'chat_messages': 50000,
+    'direct_messages': 20000
+}
+
+TABLES = ('user_stats', 'rate_limit_buckets', 'comic_neighbours', 'comic_view_shards', 'interaction_events',
+          'conversations', 'messages', 'chat_messages', 'comments', 'ratings', 'likes', 'comic_pages', 'comics', 'sessions', 'users')
+
+# random()^3 piles most picks onto the first ids of a range: a small hot set of comics and users
+SKEWED = "{low} + floor(power(random(), 3) * ({high} - {low} + 1))::int"
+UNIFORM = "{low} + floor(random() * ({high} - {low} + 1))::int"
+
+
+def migrate(cursor: Any) -> None:
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, 'V*.sql'))):
+        print(f'migrating {os.path.basename(path)}')
+        with open(path) as migration:
+            cursor.execute(migration.read())
+
+
+def id_range(cursor: Any, table: str) -> Dict[str, int]:
+    cursor.execute(f"SELECT MIN(id), MAX(id) FROM {table}")
+    low, high = cursor.fetchone()
+    if low is None:
+        raise SystemExit(f'{table} is empty, nothing to reference')
+    return {'low': low, 'high': high}
+
+
+def seed(cursor: Any, volumes: Dict[str, int]) -> None:
+    password_hash = passwords.hash_password(BENCH_PASSWORD)
+    cursor.execute("SELECT setseed(0.42)")
+
+    cursor.execute("""
+        INSERT INTO users (username, email, password_hash, display_name, created_at)
+        SELECT 'bench_' || g, 'bench_' || g || '@example.com', %s, 'Bench User ' || g,
+               CURRENT_TIMESTAMP - interval '400 days' + g * interval '1 minute'
+        FROM generate_series(1, %s) g
+        ON CONFLICT DO NOTHING
+    """, (password_hash, volumes['users']))
+    users = id_range(cursor, 'users')
+
+    cursor.execute("""
+        INSERT INTO comics (user_id, title, description, genre, cover_url, created_at)
+        SELECT """ + SKEWED.format(**users) + """, 'Bench comic ' || g, 'Synthetic comic ' || g,
+               (ARRAY['action', 'comedy', 'drama', 'fantasy', 'horror', 'sci-fi'])[1 + g %% 6],
+               'https://example.com/bench/cover/' || g || '.jpg',
+               CURRENT_TIMESTAMP - interval '365 days' + g * (interval '365 days' / %s)
+        FROM generate_series(1, %s) g
+    """, (volumes['comics'], volumes['comics']))
+    comics = id_range(cursor, 'comics')
+
+    cursor.execute("""
+        INSERT INTO comic_pages (comic_id, page_number, image_url, caption)
+        SELECT c.id, p, 'https://example.com/bench/' || c.id || '/' || p || '.jpg', 'Page ' || p
+        FROM comics c, generate_series(1, %s) p
+        WHERE c.id BETWEEN %s AND %s
+        ON CONFLICT DO NOTHING
+    """, (volumes['pages_per_comic'], comics['low'], comics['high']))
+
+    for table, extra_column, extra_value in (('likes', '', ''),
+                                             ('ratings', ', rating', ', 1 + floor(random() * 5)::int')):
+        cursor.execute(
+            f"INSERT INTO {table} (user_id, comic_id{extra_column}) "
+            f"SELECT {UNIFORM.format(**users)}, {SKEWED.format(**comics)}{extra_value} "
+            f"FROM generate_series(1, %s) g ON CONFLICT DO NOTHING",
+            (volumes[table],)
+        )
+
+    cursor.execute("""
+        INSERT INTO comments (user_id, comic_id, content, created_at)
+        SELECT """ + UNIFORM.format(**users) + """, """ + SKEWED.format(**comics) + """,
+               'Synthetic comment ' || g, CURRENT_TIMESTAMP - interval '180 days' + g * (interval '180 days' / %s)
+        FROM generate_series(1, %s) g
+    """, (volumes['comments'], volumes['comments']))
+
+    cursor.execute("""
+        INSERT INTO comments (user_id, comic_id, parent_id, content, created_at)
+        SELECT """ + UNIFORM.format(**users) + """, p.comic_id, p.id, 'Synthetic reply', p.created_at + interval '1 hour'
+        FROM (
+            SELECT id, comic_id, created_at FROM comments
+            WHERE parent_id IS NULL
+            ORDER BY random()
+            LIMIT %s
+        ) p
+    """, (volumes['replies'],))
+
+    # chat_messages is partitioned by month, make sure every seeded month has one
+    cursor.execute("SELECT chat_ensure_partitions(CURRENT_TIMESTAMP - %s * interval '1 second', 3)",
+                   (volumes['chat_messages'],))
+    cursor.execute("""
+        INSERT INTO chat_messages (user_id, message, created_at)
+        SELECT """ + UNIFORM.format(**users) + """, 'Synthetic chat message ' || g,
+               CURRENT_TIMESTAMP - (%s - g) * interval '1 second'
+        FROM generate_series(1, %s) g
+    """, (volumes['chat_messages'], volumes['chat_messages']))
+
+    # Direct messages mostly between a user and a few "friends" with nearby ids
+    cursor.execute("""
+        INSERT INTO messages (sender_id, receiver_id, content, is_read, created_at)
+        SELECT s.sender_id, %s + (s.sender_id - %s + 1 + floor(random() * 10)::int) %% %s,
+               'Synthetic direct message ' || s.g, random() < 0.8,
+               CURRENT_TIMESTAMP - (%s - s.g) * interval '1 second'
+        FROM (
+            SELECT g, """ + SKEWED.format(**users) + """ as sender_id
+            FROM generate_series(1, %s) g
+        ) s
+    """, (users['low'], users['low'], users['high'] - users['low'] + 1,
+          volumes['direct_messages'], volumes['direct_messages']))
+    cursor.execute("DELETE FROM messages WHERE sender_id = receiver_id")
+
+    cursor.execute("TRUNCATE conversations")
+    cursor.execute("""
+        INSERT INTO conversations (user_id, peer_id, last_message_id, last_message_at, unread_count)
+        SELECT pairs.user_id, pairs.peer_id, MAX(pairs.id), MAX(pairs.created_at),
+               COUNT(*) FILTER (WHERE pairs.unread)
+        FROM (
+            SELECT sender_id as user_id, receiver_id as peer_id, id, created_at, FALSE as unread FROM messages
+            UNION ALL
+            SELECT receiver_id, sender_id, id, created_at, NOT COALESCE(is_read, FALSE) FROM messages
+        ) pairs
+        GROUP BY pairs.user_id, pairs.peer_id
+    """)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Seed a local database for the load tests')
+    parser.add_argument('--migrate', action='store_true')
+    parser.add_argument('--reset', action='store_true')
+    parser.add_argument('--scale', type=float, default=1.0)
+    for name in VOLUMES:
+        parser.add_argument('--' + name.replace('_', '-'), type=int, dest=name)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    volumes = {
+        name: getattr(args, name) if getattr(args, name) is not None
+        else max(1, int(default * (1 if name == 'pages_per_comic' else args.scale)))
+        for name, default in VOLUMES.items()
+    }
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor()
+    if args.migrate:
+        migrate(cursor)
+    if args.reset:
+        cursor.execute("TRUNCATE " + ", ".join(TABLES) + " RESTART IDENTITY CASCADE")
+        cursor.execute("UPDATE recommendation_state SET computed_at = NULL")
+
+    started = time.perf_counter()
+    seed(cursor, volumes)
+    conn.commit()
+    reconciled = reconcile_stats(conn)
+    refresh_rankings(conn)
+    cursor.execute("ANALYZE")
+    conn.commit()
+    print(f'seeded {volumes} in {time.perf_counter() - started:.1f}s, reconciled {reconciled} comics')
+    conn.close()
@@ -0,0 +1,3 @@
+-- Keyset pagination indexes for the comics feed (ORDER BY created_at DESC, id DESC)
+CREATE INDEX IF NOT EXISTS idx_comics_created_at_id ON comics(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_comics_user_created_at_id ON comics(user_id, created_at DESC, id DESC);
@@ -0,0 +1,12 @@
+-- Denormalized per-comic counters maintained by the interactions function
+ALTER TABLE comics ADD COLUMN IF NOT EXISTS likes_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE comics ADD COLUMN IF NOT EXISTS rating_sum INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE comics ADD COLUMN IF NOT EXISTS rating_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE comics ADD COLUMN IF NOT EXISTS comments_count INTEGER NOT NULL DEFAULT 0;
+
+-- Backfill from existing interactions
+UPDATE comics c SET
+    likes_count = (SELECT COUNT(*) FROM likes l WHERE l.comic_id = c.id),
+    rating_sum = (SELECT COALESCE(SUM(r.rating), 0) FROM ratings r WHERE r.comic_id = c.id),
+    rating_count = (SELECT COUNT(*) FROM ratings r WHERE r.comic_id = c.id),
+    comments_count = (SELECT COUNT(*) FROM comments cm WHERE cm.comic_id = c.id);
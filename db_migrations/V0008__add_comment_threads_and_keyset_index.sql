@@ -0,0 +1,7 @@
+-- One-level reply threads on comments
+ALTER TABLE comments ADD COLUMN IF NOT EXISTS parent_id INTEGER REFERENCES comments(id);
+ALTER TABLE comments ADD COLUMN IF NOT EXISTS replies_count INTEGER NOT NULL DEFAULT 0;
+
+-- Keyset pagination of a comic's comments (newest first) and of a thread's replies (oldest first)
+CREATE INDEX IF NOT EXISTS idx_comments_comic_created_id ON comments(comic_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_comments_parent_created_id ON comments(parent_id, created_at, id) WHERE parent_id IS NOT NULL;
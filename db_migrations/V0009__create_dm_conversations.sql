@@ -0,0 +1,29 @@
+-- Per-user summary of direct-message conversations maintained by the chat function.
+-- Every conversation has one row per participant so the inbox is a single index range.
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    peer_id INTEGER NOT NULL REFERENCES users(id),
+    last_message_id INTEGER NOT NULL REFERENCES messages(id),
+    last_message_at TIMESTAMP NOT NULL,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, peer_id)
+);
+
+-- Inbox order: message ids grow with time, so the newest conversation has the highest last_message_id
+CREATE INDEX IF NOT EXISTS idx_conversations_user_last_message ON conversations(user_id, last_message_id DESC);
+
+-- Thread history in both directions and unread lookups for mark-as-read
+CREATE INDEX IF NOT EXISTS idx_messages_sender_receiver_id ON messages(sender_id, receiver_id, id DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages(receiver_id, sender_id, id) WHERE NOT is_read;
+
+-- Backfill from existing messages
+INSERT INTO conversations (user_id, peer_id, last_message_id, last_message_at, unread_count)
+SELECT pairs.user_id, pairs.peer_id, MAX(pairs.id), MAX(pairs.created_at),
+       COUNT(*) FILTER (WHERE pairs.unread)
+FROM (
+    SELECT sender_id as user_id, receiver_id as peer_id, id, created_at, FALSE as unread FROM messages
+    UNION ALL
+    SELECT receiver_id, sender_id, id, created_at, NOT COALESCE(is_read, FALSE) FROM messages
+) pairs
+GROUP BY pairs.user_id, pairs.peer_id
+ON CONFLICT (user_id, peer_id) DO NOTHING;
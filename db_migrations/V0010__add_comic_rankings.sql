@@ -0,0 +1,42 @@
+-- Materialized ranking scores on comics, see backend/comics/refresh_rankings.py.
+-- trending_score sums every like (weight 1) and rating (weight rating/5) as
+-- 2^((event time - trending_epoch) / half_life_hours): newer events weigh more
+-- without ever rewriting old scores, so writes add to the score incrementally.
+-- The refresh job moves the epoch forward and recomputes before weights grow large.
+CREATE TABLE IF NOT EXISTS ranking_params (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    trending_epoch TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    half_life_hours DOUBLE PRECISION NOT NULL DEFAULT 48,
+    rating_prior_mean DOUBLE PRECISION NOT NULL DEFAULT 3,
+    rating_prior_weight DOUBLE PRECISION NOT NULL DEFAULT 10
+);
+
+INSERT INTO ranking_params DEFAULT VALUES ON CONFLICT (id) DO NOTHING;
+
+ALTER TABLE comics ADD COLUMN IF NOT EXISTS trending_score DOUBLE PRECISION NOT NULL DEFAULT 0;
+-- Bayesian average: (prior_weight * prior_mean + rating_sum) / (prior_weight + rating_count)
+ALTER TABLE comics ADD COLUMN IF NOT EXISTS bayes_rating DOUBLE PRECISION NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_comics_trending_id ON comics(trending_score DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_comics_bayes_rating_id ON comics(bayes_rating DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_comics_likes_count_id ON comics(likes_count DESC, id DESC);
+
+-- Backfill
+UPDATE ranking_params SET rating_prior_mean = COALESCE(
+    (SELECT SUM(rating_sum)::float / NULLIF(SUM(rating_count), 0) FROM comics), rating_prior_mean
+);
+
+UPDATE comics c SET
+    trending_score = COALESCE((
+        SELECT SUM(e.weight * power(2, EXTRACT(EPOCH FROM (e.at - p.trending_epoch)) / 3600.0 / p.half_life_hours))
+        FROM (
+            SELECT created_at as at, 1.0 as weight FROM likes WHERE comic_id = c.id
+            UNION ALL
+            SELECT COALESCE(updated_at, created_at), rating / 5.0 FROM ratings WHERE comic_id = c.id
+        ) e, ranking_params p
+        WHERE e.at > p.trending_epoch - make_interval(hours => (p.half_life_hours * 10)::int)
+    ), 0),
+    bayes_rating = (
+        SELECT (p.rating_prior_weight * p.rating_prior_mean + c.rating_sum) / (p.rating_prior_weight + c.rating_count)
+        FROM ranking_params p
+    );
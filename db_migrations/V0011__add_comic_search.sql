@@ -0,0 +1,23 @@
+-- Full-text and typo-tolerant search over comics and their authors
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- 'simple' config: titles mix languages and names, so no stemming or stop words
+ALTER TABLE comics ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(genre, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+) STORED;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    to_tsvector('simple', coalesce(username, '') || ' ' || coalesce(display_name, ''))
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_comics_search_vector ON comics USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_users_search_vector ON users USING GIN (search_vector);
+
+-- Trigram indexes answer misspelled queries (word_similarity operator <%)
+CREATE INDEX IF NOT EXISTS idx_comics_title_trgm ON comics USING GIN (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_names_trgm ON users USING GIN ((coalesce(username, '') || ' ' || coalesce(display_name, '')) gin_trgm_ops);
+
+-- Genre filter on search results and facet counts
+CREATE INDEX IF NOT EXISTS idx_comics_genre ON comics(genre);
@@ -0,0 +1,17 @@
+-- Write-behind queue for likes, unlikes and ratings, applied in batches by the interactions function
+CREATE TABLE IF NOT EXISTS interaction_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    comic_id INTEGER NOT NULL REFERENCES comics(id),
+    kind VARCHAR(10) NOT NULL CHECK (kind IN ('like', 'unlike', 'rate')),
+    rating INTEGER CHECK (rating >= 1 AND rating <= 5),
+    idempotency_key VARCHAR(100),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    applied_at TIMESTAMP
+);
+
+-- A retried client action (same Idempotency-Key) is recorded once; applied rows are kept for the retention window
+CREATE UNIQUE INDEX IF NOT EXISTS idx_interaction_events_idempotency
+    ON interaction_events(user_id, idempotency_key) WHERE idempotency_key IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_interaction_events_pending ON interaction_events(id) WHERE applied_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_interaction_events_applied_at ON interaction_events(applied_at) WHERE applied_at IS NOT NULL;
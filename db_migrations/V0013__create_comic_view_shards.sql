@@ -0,0 +1,13 @@
+-- Unfolded view counts: each comics function instance adds its buffered views to one shard row per comic,
+-- fold_views.py periodically moves the totals into comics.views
+CREATE TABLE IF NOT EXISTS comic_view_shards (
+    comic_id INTEGER NOT NULL REFERENCES comics(id) ON DELETE CASCADE,
+    shard SMALLINT NOT NULL,
+    views BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (comic_id, shard)
+);
+
+-- V0001 creates comics without views and V0002's CREATE TABLE IF NOT EXISTS is then skipped,
+-- so a database migrated in order may not have the column the shards fold into
+ALTER TABLE comics ADD COLUMN IF NOT EXISTS views INTEGER NOT NULL DEFAULT 0;
+UPDATE comics SET views = 0 WHERE views IS NULL;
@@ -0,0 +1,22 @@
+-- "Readers also liked": the top neighbours of every comic by item-item similarity,
+-- computed offline by backend/comics/recommendations.py. The related endpoint reads
+-- one primary key range per comic.
+CREATE TABLE IF NOT EXISTS comic_neighbours (
+    comic_id INTEGER NOT NULL REFERENCES comics(id) ON DELETE CASCADE,
+    rank SMALLINT NOT NULL,
+    neighbour_id INTEGER NOT NULL REFERENCES comics(id) ON DELETE CASCADE,
+    score REAL NOT NULL,
+    PRIMARY KEY (comic_id, rank)
+);
+
+-- Deleting a comic cascades to the lists it appears in
+CREATE INDEX IF NOT EXISTS idx_comic_neighbours_neighbour ON comic_neighbours(neighbour_id);
+
+-- When the last recommendations run started; the next incremental run recomputes
+-- comics with likes, unlikes or ratings after it (NULL: next run is a full one)
+CREATE TABLE IF NOT EXISTS recommendation_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    computed_at TIMESTAMP
+);
+
+INSERT INTO recommendation_state DEFAULT VALUES ON CONFLICT (id) DO NOTHING;
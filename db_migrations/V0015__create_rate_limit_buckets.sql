@@ -0,0 +1,10 @@
+-- Token buckets shared by all function instances when RATE_LIMIT_STORE=postgres, see limits.py.
+-- Unlogged: no WAL per request, and losing the buckets in a crash only resets the limits.
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+    key VARCHAR(120) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    allowed BOOLEAN NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_updated_at ON rate_limit_buckets(updated_at);
@@ -0,0 +1,67 @@
+-- The public chat becomes a table partitioned by month on created_at: the room only
+-- ever reads the newest rows, so old months can be archived and dropped as a whole
+-- (backend/chat/archive.py) instead of bloating one table and its indexes forever.
+-- id keeps its sequence and stays the clients' after_id/before_id cursor.
+
+-- Months already archived and dropped; chat_ensure_partitions never recreates them
+CREATE TABLE IF NOT EXISTS chat_archives (
+    month DATE PRIMARY KEY,
+    file_name VARCHAR(100) NOT NULL,
+    row_count INTEGER NOT NULL,
+    min_id INTEGER,
+    max_id INTEGER,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE chat_messages RENAME TO chat_messages_unpartitioned;
+ALTER INDEX chat_messages_pkey RENAME TO chat_messages_unpartitioned_pkey;
+DROP INDEX IF EXISTS idx_chat_messages_created_at;
+ALTER SEQUENCE chat_messages_id_seq OWNED BY NONE;
+
+-- The partition key has to be part of the primary key; (id, created_at) still serves
+-- every id-ordered read, one index range per partition merged in id order
+CREATE TABLE chat_messages (
+    id INTEGER NOT NULL DEFAULT nextval('chat_messages_id_seq'),
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    message TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE chat_messages_id_seq OWNED BY chat_messages.id;
+
+-- Create the monthly partitions from the month of since through months_ahead months
+-- from now that do not exist yet and were not archived. Returns how many it created.
+CREATE OR REPLACE FUNCTION chat_ensure_partitions(since TIMESTAMP, months_ahead INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', since);
+    last_month TIMESTAMP := date_trunc('month', LOCALTIMESTAMP) + make_interval(months => months_ahead);
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := 'chat_messages_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL
+           AND NOT EXISTS (SELECT 1 FROM chat_archives WHERE month = month_start::date) THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF chat_messages FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_start + interval '1 month'
+            );
+            created := created + 1;
+        END IF;
+        month_start := month_start + interval '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT chat_ensure_partitions(
+    LEAST(COALESCE((SELECT MIN(created_at) FROM chat_messages_unpartitioned), LOCALTIMESTAMP), LOCALTIMESTAMP),
+    3
+);
+
+INSERT INTO chat_messages (id, user_id, message, created_at)
+SELECT id, user_id, message, COALESCE(created_at, LOCALTIMESTAMP) FROM chat_messages_unpartitioned;
+
+DROP TABLE chat_messages_unpartitioned;
@@ -0,0 +1,30 @@
+-- Per-author totals for profile pages, one row per user who has published.
+-- Maintained next to the per-comic counters: comic creation (comics function),
+-- the interaction flush and comments (interactions function).
+-- backend/comics/reconcile_stats.py rebuilds them from the comic counters.
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    comics_count INTEGER NOT NULL DEFAULT 0,
+    likes_received INTEGER NOT NULL DEFAULT 0,
+    rating_sum_received INTEGER NOT NULL DEFAULT 0,
+    ratings_received INTEGER NOT NULL DEFAULT 0,
+    comments_received INTEGER NOT NULL DEFAULT 0,
+    last_published_at TIMESTAMP,
+    last_activity_at TIMESTAMP
+);
+
+-- Backfill from the comic counters; latest activity is the newest comic, like,
+-- rating or comment on any of the author's works
+INSERT INTO user_stats (user_id, comics_count, likes_received, rating_sum_received, ratings_received,
+                        comments_received, last_published_at, last_activity_at)
+SELECT c.user_id, COUNT(*), SUM(c.likes_count), SUM(c.rating_sum), SUM(c.rating_count), SUM(c.comments_count),
+       MAX(c.created_at),
+       GREATEST(
+           MAX(c.created_at),
+           (SELECT MAX(l.created_at) FROM likes l JOIN comics lc ON lc.id = l.comic_id WHERE lc.user_id = c.user_id),
+           (SELECT MAX(r.updated_at) FROM ratings r JOIN comics rc ON rc.id = r.comic_id WHERE rc.user_id = c.user_id),
+           (SELECT MAX(cm.created_at) FROM comments cm JOIN comics cc ON cc.id = cm.comic_id WHERE cc.user_id = c.user_id)
+       )
+FROM comics c
+GROUP BY c.user_id
+ON CONFLICT (user_id) DO NOTHING;
@@ -1,5 +1,5 @@
 import { createContext, useContext, useState, useEffect, ReactNode } from 'react';
-import { User } from '@/lib/api';
+import { authApi, User } from '@/lib/api';
 
 interface AuthContextType {
   user: User | null;
@@ -33,6 +33,8 @@ export const AuthProvider = ({ children }: { children: ReactNode }) => {
   };
 
   const logout = () => {
+    // Revoke the session server-side too; signing out locally must not wait for it
+    if (token) authApi.logout(token).catch((error) => console.error('Failed to revoke session:', error));
     setUser(null);
     setToken(null);
     localStorage.removeItem('user');
@@ -5,6 +5,36 @@ const API_URLS = {
   chat: 'https://functions.poehali.dev/75200214-3304-4483-8f85-3500669d42f1',
 };
 
+const jsonHeaders = (): Record<string, string> => {
+  const token = localStorage.getItem('token');
+  return token
+    ? { 'Content-Type': 'application/json', 'X-Auth-Token': token }
+    : { 'Content-Type': 'application/json' };
+};
+
+export interface BatchRequest {
+  method?: 'GET' | 'HEAD' | 'POST' | 'DELETE';
+  query?: Record<string, string | number>;
+  body?: unknown;
+}
+
+export interface BatchResponse<T = unknown> {
+  status: number;
+  headers: Record<string, string>;
+  body: T;
+}
+
+// Several requests to one function in a single invocation, answered in request order
+const batch = async (url: string, requests: BatchRequest[]): Promise<BatchResponse[]> => {
+  const response = await fetch(`${url}?action=batch`, {
+    method: 'POST',
+    headers: jsonHeaders(),
+    body: JSON.stringify({ requests }),
+  });
+  const data = await response.json();
+  return data.responses;
+};
+
 export interface User {
   id: number;
   username: string;
@@ -42,13 +72,39 @@ export interface ComicPage {
 
 export interface ComicDetail extends Comic {
   pages: ComicPage[];
+  page_count: number;
+}
+
+export type ComicCard = Pick<
+  Comic,
+  'id' | 'user_id' | 'title' | 'cover_url' | 'genre' | 'username' | 'display_name'
+  | 'avatar_url' | 'likes_count' | 'avg_rating' | 'created_at'
+>;
+
+export interface AuthorProfile {
+  id: number;
+  username: string;
+  display_name: string;
+  avatar_url?: string;
+  bio?: string;
+  created_at: string;
+  comics_count: number;
+  likes_received: number;
+  ratings_received: number;
+  comments_received: number;
+  avg_rating: number;
+  last_published_at: string | null;
+  last_activity_at: string | null;
 }
 
 export interface Comment {
   id: number;
   user_id: number;
   comic_id: number;
+  parent_id?: number | null;
   content: string;
+  replies_count?: number;
+  replies?: Comment[];
   username: string;
   display_name: string;
   avatar_url?: string;
@@ -56,6 +112,11 @@ export interface Comment {
   updated_at: string;
 }
 
+export interface ViewerState {
+  liked: boolean;
+  rating: number | null;
+}
+
 export interface Message {
   id: number;
   user_id: number;
@@ -84,21 +145,94 @@ export const authApi = {
     });
     return response.json();
   },
+
+  verify: async (token: string) => {
+    const response = await fetch(API_URLS.auth, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'verify', token }),
+    });
+    return response.json();
+  },
+
+  logout: async (token: string) => {
+    const response = await fetch(API_URLS.auth, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'logout', token }),
+    });
+    return response.json();
+  },
 };
 
+export type ComicSort = 'newest' | 'trending' | 'top_rated' | 'most_liked';
+
+export interface ComicsPage<T = Comic> {
+  comics: T[];
+  next_cursor: string | null;
+}
+
+const pageQuery = (limit?: number, cursor?: string | null) => {
+  const params = new URLSearchParams();
+  if (limit) params.set('limit', String(limit));
+  if (cursor) params.set('cursor', cursor);
+  return params.toString();
+};
+
+export interface SearchPage extends ComicsPage {
+  facets?: { genre: { genre: string; count: number }[] };
+}
+
 export const comicsApi = {
-  getAll: async (): Promise<{ comics: Comic[] }> => {
-    const response = await fetch(API_URLS.comics);
+  getAll: async (limit?: number, cursor?: string | null, sort?: ComicSort): Promise<ComicsPage> => {
+    const params = new URLSearchParams(pageQuery(limit, cursor));
+    if (sort && sort !== 'newest') params.set('sort', sort);
+    const query = params.toString();
+    const response = await fetch(query ? `${API_URLS.comics}?${query}` : API_URLS.comics);
+    return response.json();
+  },
+
+  getCards: async (limit?: number, cursor?: string | null, sort?: ComicSort): Promise<ComicsPage<ComicCard>> => {
+    const params = new URLSearchParams(pageQuery(limit, cursor));
+    params.set('view', 'card');
+    if (sort && sort !== 'newest') params.set('sort', sort);
+    const response = await fetch(`${API_URLS.comics}?${params.toString()}`);
     return response.json();
   },
 
-  getById: async (id: number): Promise<{ comic: ComicDetail }> => {
-    const response = await fetch(`${API_URLS.comics}?id=${id}`);
+  search: async (q: string, genre?: string, cursor?: string | null): Promise<SearchPage> => {
+    const params = new URLSearchParams(pageQuery(undefined, cursor));
+    params.set('action', 'search');
+    params.set('q', q);
+    if (genre) params.set('genre', genre);
+    const response = await fetch(`${API_URLS.comics}?${params.toString()}`);
     return response.json();
   },
 
-  getByUser: async (userId: number): Promise<{ comics: Comic[] }> => {
-    const response = await fetch(`${API_URLS.comics}?user_id=${userId}`);
+  getById: async (id: number, pagesFrom?: number, pagesTo?: number): Promise<{ comic: ComicDetail }> => {
+    const params = new URLSearchParams({ id: String(id) });
+    if (pagesFrom) params.set('pages_from', String(pagesFrom));
+    if (pagesTo) params.set('pages_to', String(pagesTo));
+    const response = await fetch(`${API_URLS.comics}?${params.toString()}`);
+    return response.json();
+  },
+
+  getRelated: async (id: number, limit?: number): Promise<{ comics: ComicCard[]; source: 'readers' | 'genre' }> => {
+    const params = new URLSearchParams({ action: 'related', id: String(id) });
+    if (limit) params.set('limit', String(limit));
+    const response = await fetch(`${API_URLS.comics}?${params.toString()}`);
+    return response.json();
+  },
+
+  getProfile: async (userId: number): Promise<AuthorProfile> => {
+    const response = await fetch(`${API_URLS.comics}?action=profile&user_id=${userId}`);
+    if (!response.ok) throw new Error('Profile not found');
+    return response.json();
+  },
+
+  getByUser: async (userId: number, limit?: number, cursor?: string | null): Promise<ComicsPage> => {
+    const query = pageQuery(limit, cursor);
+    const response = await fetch(`${API_URLS.comics}?user_id=${userId}${query ? `&${query}` : ''}`);
     return response.json();
   },
 
@@ -114,64 +248,71 @@ export const comicsApi = {
   ) => {
     const response = await fetch(API_URLS.comics, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
+      headers: jsonHeaders(),
       body: JSON.stringify(data),
     });
     return response.json();
   },
 };
 
+// Likes and ratings carry one Idempotency-Key per user action; retries after a lost
+// response or a 5xx resend the same key, so the server records the action once
+const QUEUED_RETRIES = 2;
+
+const sendQueued = async (method: string, body: Record<string, unknown>, idempotencyKey: string) => {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await fetch(API_URLS.interactions, {
+        method,
+        headers: { ...jsonHeaders(), 'Idempotency-Key': idempotencyKey },
+        body: JSON.stringify(body),
+      });
+      if (response.status < 500 || attempt === QUEUED_RETRIES) return response.json();
+    } catch (error) {
+      if (attempt === QUEUED_RETRIES) throw error;
+    }
+    await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** attempt));
+  }
+};
+
 export const interactionsApi = {
-  like: async (userId: number, comicId: number) => {
-    const response = await fetch(API_URLS.interactions, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ action: 'like', user_id: userId, comic_id: comicId }),
-    });
-    return response.json();
-  },
+  like: (userId: number, comicId: number, idempotencyKey: string = crypto.randomUUID()) =>
+    sendQueued('POST', { action: 'like', user_id: userId, comic_id: comicId }, idempotencyKey),
 
-  unlike: async (userId: number, comicId: number) => {
-    const response = await fetch(API_URLS.interactions, {
-      method: 'DELETE',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ action: 'unlike', user_id: userId, comic_id: comicId }),
-    });
-    return response.json();
-  },
+  unlike: (userId: number, comicId: number, idempotencyKey: string = crypto.randomUUID()) =>
+    sendQueued('DELETE', { action: 'unlike', user_id: userId, comic_id: comicId }, idempotencyKey),
 
-  rate: async (userId: number, comicId: number, rating: number) => {
-    const response = await fetch(API_URLS.interactions, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({ action: 'rate', user_id: userId, comic_id: comicId, rating }),
-    });
-    return response.json();
-  },
+  rate: (userId: number, comicId: number, rating: number, idempotencyKey: string = crypto.randomUUID()) =>
+    sendQueued('POST', { action: 'rate', user_id: userId, comic_id: comicId, rating }, idempotencyKey),
 
   addComment: async (userId: number, comicId: number, content: string) => {
     const response = await fetch(API_URLS.interactions, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
+      headers: jsonHeaders(),
       body: JSON.stringify({ action: 'comment', user_id: userId, comic_id: comicId, content }),
     });
     return response.json();
   },
 
-  getComments: async (comicId: number): Promise<{ comments: Comment[] }> => {
-    const response = await fetch(`${API_URLS.interactions}?action=comments&comic_id=${comicId}`);
+  getComments: async (
+    comicId: number,
+    cursor?: string | null
+  ): Promise<{ comments: Comment[]; next_cursor: string | null }> => {
+    const query = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+    const response = await fetch(`${API_URLS.interactions}?action=comments&comic_id=${comicId}${query}`);
     return response.json();
   },
+
+  getComicView: async (
+    comicId: number,
+    userId?: number
+  ): Promise<{ comments: Comment[]; next_cursor: string | null; state: ViewerState | null }> => {
+    const requests: BatchRequest[] = [{ query: { action: 'comments', comic_id: comicId } }];
+    if (userId) requests.push({ query: { action: 'state', comic_id: comicId, user_id: userId } });
+    const [comments, state] = await batch(API_URLS.interactions, requests);
+    const page = comments.body as { comments: Comment[]; next_cursor: string | null };
+    return { ...page, state: state?.status === 200 ? (state.body as ViewerState) : null };
+  },
 };
 
 export interface ChatMessage {
@@ -184,20 +325,103 @@ export interface ChatMessage {
   created_at: string;
 }
 
+export interface ChatWindow {
+  messages: ChatMessage[];
+  last_id: number | null;
+  has_more: boolean;
+}
+
+export interface ChatMonth {
+  messages: ChatMessage[];
+  last_id: number | null;
+  has_more: boolean;
+  archived: boolean;
+}
+
 export const chatApi = {
-  getMessages: async (): Promise<{ messages: ChatMessage[] }> => {
-    const response = await fetch(API_URLS.chat);
+  getMessages: async (afterId?: number | null): Promise<ChatWindow> => {
+    const response = await fetch(afterId ? `${API_URLS.chat}?after_id=${afterId}` : API_URLS.chat);
+    return response.json();
+  },
+
+  getHistory: async (beforeId: number, limit = 50): Promise<ChatWindow> => {
+    const response = await fetch(`${API_URLS.chat}?before_id=${beforeId}&limit=${limit}`);
+    return response.json();
+  },
+
+  getMonth: async (month: string, afterId?: number | null, includeArchived = false): Promise<ChatMonth> => {
+    const params = new URLSearchParams({ action: 'history', month });
+    if (afterId) params.set('after_id', String(afterId));
+    if (includeArchived) params.set('include_archived', '1');
+    const response = await fetch(`${API_URLS.chat}?${params}`);
     return response.json();
   },
 
   sendMessage: async (userId: number, message: string) => {
     const response = await fetch(API_URLS.chat, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
+      headers: jsonHeaders(),
       body: JSON.stringify({ user_id: userId, message }),
     });
     return response.json();
   },
-};
\ No newline at end of file
+};
+
+export interface DirectMessage {
+  id: number;
+  sender_id: number;
+  receiver_id: number;
+  content: string;
+  is_read: boolean;
+  created_at: string;
+}
+
+export interface Conversation {
+  peer_id: number;
+  unread_count: number;
+  last_message_id: number;
+  last_message_at: string;
+  last_sender_id: number;
+  last_message: string;
+  username: string;
+  display_name: string;
+  avatar_url?: string;
+}
+
+export interface Inbox {
+  conversations: Conversation[];
+  next_before: number | null;
+  unread_total: number;
+}
+
+export const dmApi = {
+  getInbox: async (before?: number | null): Promise<Inbox> => {
+    const query = before ? `&before=${before}` : '';
+    const response = await fetch(`${API_URLS.chat}?action=inbox${query}`, { headers: jsonHeaders() });
+    return response.json();
+  },
+
+  getThread: async (peerId: number, beforeId?: number | null): Promise<{ messages: DirectMessage[]; has_more: boolean }> => {
+    const query = beforeId ? `&before_id=${beforeId}` : '';
+    const response = await fetch(`${API_URLS.chat}?action=thread&peer_id=${peerId}${query}`, { headers: jsonHeaders() });
+    return response.json();
+  },
+
+  send: async (receiverId: number, content: string) => {
+    const response = await fetch(API_URLS.chat, {
+      method: 'POST',
+      headers: jsonHeaders(),
+      body: JSON.stringify({ action: 'dm', receiver_id: receiverId, content }),
+    });
+    return response.json();
+  },
+
+  markRead: async (peerId: number, upToId?: number) => {
+    const response = await fetch(API_URLS.chat, {
+      method: 'POST',
+      headers: jsonHeaders(),
+      body: JSON.stringify({ action: 'read', peer_id: peerId, up_to_id: upToId }),
+    });
+    return response.json();
+  },
+};
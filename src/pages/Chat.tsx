@@ -17,6 +17,7 @@ const Chat = () => {
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [messageText, setMessageText] = useState('');
   const scrollRef = useRef<HTMLDivElement>(null);
+  const lastIdRef = useRef<number | null>(null);
 
   useEffect(() => {
     if (isAuthenticated) {
@@ -32,8 +33,16 @@ const Chat = () => {
 
   const loadMessages = async () => {
     try {
-      const data = await chatApi.getMessages();
-      setMessages(data.messages || []);
+      const data = await chatApi.getMessages(lastIdRef.current);
+      const fresh = data.messages || [];
+      if (data.last_id) lastIdRef.current = Math.max(lastIdRef.current ?? 0, data.last_id);
+      if (fresh.length) {
+        // Overlapping polls (interval + send) can return the same rows twice
+        setMessages((prev) => {
+          const lastSeen = prev.length ? prev[prev.length - 1].id : 0;
+          return [...prev, ...fresh.filter((msg) => msg.id > lastSeen)];
+        });
+      }
     } catch (error) {
       console.error('Failed to load messages:', error);
     }
@@ -8,9 +8,12 @@ import { Textarea } from '@/components/ui/textarea';
 import { Label } from '@/components/ui/label';
 import Icon from '@/components/ui/icon';
 import { useAuth } from '@/context/AuthContext';
-import { comicsApi, interactionsApi, ComicDetail, Comment } from '@/lib/api';
+import { comicsApi, interactionsApi, ComicCard, ComicDetail, Comment } from '@/lib/api';
 import { useToast } from '@/hooks/use-toast';
 
+const PAGE_BATCH = 5;
+const RELATED_LIMIT = 6;
+
 const ComicView = () => {
   const { id } = useParams<{ id: string }>();
   const navigate = useNavigate();
@@ -23,25 +26,80 @@ const ComicView = () => {
   const [isLiked, setIsLiked] = useState(false);
   const [commentText, setCommentText] = useState('');
   const [comments, setComments] = useState<Comment[]>([]);
+  const [loadingPages, setLoadingPages] = useState(false);
+  const [related, setRelated] = useState<ComicCard[]>([]);
 
   useEffect(() => {
     if (id) {
       loadComic();
-      loadComments();
+      loadRelated();
     }
   }, [id]);
 
+  useEffect(() => {
+    if (id) loadComicView();
+  }, [id, user?.id]);
+
   const loadComic = async () => {
     if (!id) return;
     try {
-      const data = await comicsApi.getById(parseInt(id));
+      const data = await comicsApi.getById(parseInt(id), 1, PAGE_BATCH);
       setComic(data.comic);
+      setCurrentPage(0);
     } catch (error) {
       console.error('Failed to load comic:', error);
       toast({ title: 'Ошибка', description: 'Не удалось загрузить комикс', variant: 'destructive' });
     }
   };
 
+  useEffect(() => {
+    if (!comic || loadingPages || comic.pages.length >= comic.page_count) return;
+    if (currentPage < comic.pages.length - 2) return;
+    loadMorePages(comic, Math.max(PAGE_BATCH, currentPage - comic.pages.length + 3));
+  }, [comic, currentPage, loadingPages]);
+
+  const loadMorePages = async (loaded: ComicDetail, count: number) => {
+    const last = loaded.pages[loaded.pages.length - 1];
+    const from = last ? last.page_number + 1 : 1;
+    setLoadingPages(true);
+    try {
+      const data = await comicsApi.getById(loaded.id, from, from + count - 1);
+      setComic((current) => current && {
+        ...current,
+        pages: [...current.pages, ...data.comic.pages],
+        page_count: data.comic.page_count,
+      });
+    } catch (error) {
+      console.error('Failed to load pages:', error);
+    } finally {
+      setLoadingPages(false);
+    }
+  };
+
+  const loadRelated = async () => {
+    if (!id) return;
+    try {
+      const data = await comicsApi.getRelated(parseInt(id), RELATED_LIMIT);
+      setRelated(data.comics);
+    } catch (error) {
+      console.error('Failed to load related comics:', error);
+    }
+  };
+
+  const loadComicView = async () => {
+    if (!id) return;
+    try {
+      const data = await interactionsApi.getComicView(parseInt(id), user?.id);
+      setComments(data.comments);
+      if (data.state) {
+        setIsLiked(data.state.liked);
+        setUserRating(data.state.rating ?? 0);
+      }
+    } catch (error) {
+      console.error('Failed to load comments:', error);
+    }
+  };
+
   const loadComments = async () => {
     if (!id) return;
     try {
@@ -58,19 +116,13 @@ const ComicView = () => {
       return;
     }
     try {
-      if (isLiked) {
-        await interactionsApi.unlike(user.id, parseInt(id));
-        setIsLiked(false);
-        if (comic) {
-          setComic({ ...comic, likes_count: comic.likes_count - 1 });
-        }
-      } else {
-        const result = await interactionsApi.like(user.id, parseInt(id));
-        setIsLiked(true);
-        if (comic && result.likes_count) {
-          setComic({ ...comic, likes_count: result.likes_count });
-        }
-      }
+      // The returned count already includes this action even while it is still queued (pending)
+      const result = isLiked
+        ? await interactionsApi.unlike(user.id, parseInt(id))
+        : await interactionsApi.like(user.id, parseInt(id));
+      if (result.error) throw new Error(result.error);
+      setIsLiked(!isLiked);
+      setComic((current) => current && { ...current, likes_count: result.likes_count });
     } catch (error) {
       toast({ title: 'Ошибка', description: 'Не удалось поставить лайк', variant: 'destructive' });
     }
@@ -83,10 +135,9 @@ const ComicView = () => {
     }
     try {
       const result = await interactionsApi.rate(user.id, parseInt(id), rating);
+      if (result.error) throw new Error(result.error);
       setUserRating(rating);
-      if (comic && result.avg_rating) {
-        setComic({ ...comic, avg_rating: result.avg_rating });
-      }
+      setComic((current) => current && { ...current, avg_rating: result.avg_rating });
       toast({ title: 'Готово', description: 'Ваша оценка учтена' });
     } catch (error) {
       toast({ title: 'Ошибка', description: 'Не удалось оценить', variant: 'destructive' });
@@ -119,6 +170,7 @@ const ComicView = () => {
   }
 
   const currentPageData = comic.pages[currentPage];
+  const pageCount = Math.max(comic.page_count, comic.pages.length);
 
   return (
     <div className="min-h-screen bg-white">
@@ -147,7 +199,7 @@ const ComicView = () => {
                     className="w-full h-auto max-h-[800px] object-contain"
                   />
                   
-                  {comic.pages.length > 1 && (
+                  {pageCount > 1 && (
                     <>
                       <Button
                         variant="secondary"
@@ -162,8 +214,8 @@ const ComicView = () => {
                         variant="secondary"
                         size="icon"
                         className="absolute right-4 top-1/2 -translate-y-1/2 shadow-lg"
-                        onClick={() => setCurrentPage(Math.min(comic.pages.length - 1, currentPage + 1))}
-                        disabled={currentPage === comic.pages.length - 1}
+                        onClick={() => setCurrentPage(Math.min(pageCount - 1, currentPage + 1))}
+                        disabled={currentPage === pageCount - 1}
                       >
                         <Icon name="ChevronRight" size={24} />
                       </Button>
@@ -174,10 +226,10 @@ const ComicView = () => {
                 <div className="p-4 bg-white border-t border-gray-200">
                   <div className="flex items-center justify-between">
                     <span className="text-sm text-gray-600">
-                      Страница {currentPage + 1} из {comic.pages.length}
+                      Страница {currentPage + 1} из {pageCount}
                     </span>
                     <div className="flex gap-2">
-                      {comic.pages.map((_, idx) => (
+                      {Array.from({ length: pageCount }, (_, idx) => (
                         <button
                           key={idx}
                           onClick={() => setCurrentPage(idx)}
@@ -314,6 +366,30 @@ const ComicView = () => {
                     </div>
                   )}
                 </div>
+
+                {related.length > 0 && (
+                  <>
+                    <Separator className="my-4" />
+                    <p className="text-sm text-gray-600 mb-2">Читатели также оценили:</p>
+                    <div className="space-y-2">
+                      {related.map((item) => (
+                        <div
+                          key={item.id}
+                          className="flex items-center gap-3 cursor-pointer hover:opacity-80"
+                          onClick={() => navigate(`/comic/${item.id}`)}
+                        >
+                          {item.cover_url && (
+                            <img src={item.cover_url} alt={item.title} className="w-10 h-14 object-cover border border-black" />
+                          )}
+                          <div className="min-w-0">
+                            <p className="text-sm font-semibold line-clamp-1">{item.title}</p>
+                            <p className="text-xs text-gray-500">{item.display_name}</p>
+                          </div>
+                        </div>
+                      ))}
+                    </div>
+                  </>
+                )}
               </CardContent>
             </Card>
           </div>
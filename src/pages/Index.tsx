@@ -16,14 +16,19 @@ import {
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import Icon from '@/components/ui/icon';
 import { useAuth } from '@/context/AuthContext';
-import { comicsApi, authApi, Comic } from '@/lib/api';
+import { comicsApi, authApi, ComicCard } from '@/lib/api';
 import { useToast } from '@/hooks/use-toast';
 
+// The API's default page size, only used to restart the card animation per page
+const FEED_PAGE_SIZE = 20;
+
 const Index = () => {
   const navigate = useNavigate();
   const { user, login, logout, isAuthenticated } = useAuth();
   const { toast } = useToast();
-  const [comics, setComics] = useState<Comic[]>([]);
+  const [comics, setComics] = useState<ComicCard[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [authDialogOpen, setAuthDialogOpen] = useState(false);
   
   const [loginData, setLoginData] = useState({ username: '', password: '' });
@@ -38,15 +43,22 @@ const Index = () => {
     loadComics();
   }, []);
 
-  const loadComics = async () => {
+  const loadComics = async (cursor?: string | null) => {
     try {
-      const data = await comicsApi.getAll();
-      setComics(data.comics);
+      const data = await comicsApi.getCards(undefined, cursor);
+      setComics((prev) => (cursor ? [...prev, ...data.comics] : data.comics));
+      setNextCursor(data.next_cursor);
     } catch (error) {
       console.error('Failed to load comics:', error);
     }
   };
 
+  const loadMoreComics = async () => {
+    setLoadingMore(true);
+    await loadComics(nextCursor);
+    setLoadingMore(false);
+  };
+
   const handleLogin = async (e: React.FormEvent) => {
     e.preventDefault();
     try {
@@ -246,7 +258,7 @@ const Index = () => {
                   <Card
                     key={comic.id}
                     className="group overflow-hidden border-2 border-black manga-shadow transition-all hover:manga-shadow-hover hover:-translate-y-1 cursor-pointer animate-slide-up"
-                    style={{ animationDelay: `${index * 0.1}s` }}
+                    style={{ animationDelay: `${(index % FEED_PAGE_SIZE) * 0.1}s` }}
                     onClick={() => navigate(`/comic/${comic.id}`)}
                   >
                     <div className="aspect-[3/4] overflow-hidden bg-gray-100">
@@ -286,6 +298,13 @@ const Index = () => {
                   </Card>
                 ))}
               </div>
+              {nextCursor && (
+                <div className="flex justify-center mt-8">
+                  <Button variant="outline" className="font-medium" disabled={loadingMore} onClick={loadMoreComics}>
+                    {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+                  </Button>
+                </div>
+              )}
             </div>
           </div>
 
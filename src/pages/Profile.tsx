@@ -6,9 +6,12 @@ import { Badge } from '@/components/ui/badge';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import Icon from '@/components/ui/icon';
 import { useAuth } from '@/context/AuthContext';
-import { comicsApi, Comic } from '@/lib/api';
+import { comicsApi, AuthorProfile, Comic } from '@/lib/api';
 import { useToast } from '@/hooks/use-toast';
 
+// The API's default page size, only used to restart the card animation per page
+const WORKS_PAGE_SIZE = 20;
+
 const Profile = () => {
   const { userId } = useParams<{ userId: string }>();
   const navigate = useNavigate();
@@ -16,7 +19,9 @@ const Profile = () => {
   const { toast } = useToast();
   
   const [userComics, setUserComics] = useState<Comic[]>([]);
-  const [profileUser, setProfileUser] = useState<{ display_name: string; username: string } | null>(null);
+  const [profileUser, setProfileUser] = useState<AuthorProfile | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const isOwnProfile = isAuthenticated && user?.id === parseInt(userId || '0');
 
@@ -29,24 +34,35 @@ const Profile = () => {
   const loadUserComics = async () => {
     if (!userId) return;
     try {
-      const data = await comicsApi.getByUser(parseInt(userId));
+      const [profile, data] = await Promise.all([
+        comicsApi.getProfile(parseInt(userId)),
+        comicsApi.getByUser(parseInt(userId)),
+      ]);
+      setProfileUser(profile);
       setUserComics(data.comics);
-      if (data.comics.length > 0) {
-        setProfileUser({
-          display_name: data.comics[0].display_name,
-          username: data.comics[0].username || '',
-        });
-      }
+      setNextCursor(data.next_cursor);
     } catch (error) {
       console.error('Failed to load user comics:', error);
       toast({ title: 'Ошибка', description: 'Не удалось загрузить профиль', variant: 'destructive' });
     }
   };
 
-  const totalLikes = userComics.reduce((sum, comic) => sum + comic.likes_count, 0);
-  const avgRating = userComics.length > 0
-    ? userComics.reduce((sum, comic) => sum + comic.avg_rating, 0) / userComics.length
-    : 0;
+  const loadMoreComics = async () => {
+    if (!userId || !nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const data = await comicsApi.getByUser(parseInt(userId), undefined, nextCursor);
+      setUserComics((prev) => [...prev, ...data.comics]);
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      console.error('Failed to load more comics:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const totalLikes = profileUser?.likes_received ?? 0;
+  const avgRating = Number(profileUser?.avg_rating ?? 0);
 
   return (
     <div className="min-h-screen bg-white">
@@ -90,7 +106,7 @@ const Profile = () => {
                   
                   <div className="flex flex-wrap gap-6 justify-center md:justify-start mt-6">
                     <div className="text-center">
-                      <div className="text-2xl font-bold">{userComics.length}</div>
+                      <div className="text-2xl font-bold">{profileUser?.comics_count ?? userComics.length}</div>
                       <div className="text-sm text-gray-600">Работ</div>
                     </div>
                     <div className="text-center">
@@ -104,6 +120,10 @@ const Profile = () => {
                       </div>
                       <div className="text-sm text-gray-600">Средний рейтинг</div>
                     </div>
+                    <div className="text-center">
+                      <div className="text-2xl font-bold">{profileUser?.comments_received ?? 0}</div>
+                      <div className="text-sm text-gray-600">Комментариев</div>
+                    </div>
                   </div>
                 </div>
               </div>
@@ -112,51 +132,60 @@ const Profile = () => {
 
           <Tabs defaultValue="works" className="w-full">
             <TabsList className="grid w-full max-w-md mx-auto grid-cols-2 mb-8">
-              <TabsTrigger value="works">Работы ({userComics.length})</TabsTrigger>
+              <TabsTrigger value="works">Работы ({profileUser?.comics_count ?? userComics.length})</TabsTrigger>
               <TabsTrigger value="about">О себе</TabsTrigger>
             </TabsList>
 
             <TabsContent value="works">
               {userComics.length > 0 ? (
-                <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 gap-6">
-                  {userComics.map((comic, index) => (
-                    <Card
-                      key={comic.id}
-                      className="group overflow-hidden border-2 border-black manga-shadow transition-all hover:manga-shadow-hover hover:-translate-y-1 cursor-pointer animate-slide-up"
-                      style={{ animationDelay: `${index * 0.1}s` }}
-                      onClick={() => navigate(`/comic/${comic.id}`)}
-                    >
-                      <div className="aspect-[3/4] overflow-hidden bg-gray-100">
-                        <img
-                          src={comic.cover_url || 'https://cdn.poehali.dev/files/18f33c11-5a4b-4f82-8b77-0f2b676b951e.jpg'}
-                          alt={comic.title}
-                          className="w-full h-full object-cover transition-transform duration-300 group-hover:scale-105"
-                        />
-                      </div>
-                      <CardContent className="p-4">
-                        <div className="flex items-start justify-between mb-2">
-                          <h4 className="font-bold text-lg mb-1 font-heading line-clamp-1 flex-1">
-                            {comic.title}
-                          </h4>
-                          {comic.genre && <Badge variant="secondary" className="ml-2 shrink-0">{comic.genre}</Badge>}
+                <>
+                  <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 gap-6">
+                    {userComics.map((comic, index) => (
+                      <Card
+                        key={comic.id}
+                        className="group overflow-hidden border-2 border-black manga-shadow transition-all hover:manga-shadow-hover hover:-translate-y-1 cursor-pointer animate-slide-up"
+                        style={{ animationDelay: `${(index % WORKS_PAGE_SIZE) * 0.1}s` }}
+                        onClick={() => navigate(`/comic/${comic.id}`)}
+                      >
+                        <div className="aspect-[3/4] overflow-hidden bg-gray-100">
+                          <img
+                            src={comic.cover_url || 'https://cdn.poehali.dev/files/18f33c11-5a4b-4f82-8b77-0f2b676b951e.jpg'}
+                            alt={comic.title}
+                            className="w-full h-full object-cover transition-transform duration-300 group-hover:scale-105"
+                          />
                         </div>
+                        <CardContent className="p-4">
+                          <div className="flex items-start justify-between mb-2">
+                            <h4 className="font-bold text-lg mb-1 font-heading line-clamp-1 flex-1">
+                              {comic.title}
+                            </h4>
+                            {comic.genre && <Badge variant="secondary" className="ml-2 shrink-0">{comic.genre}</Badge>}
+                          </div>
 
-                        <div className="flex items-center justify-between mt-4 pt-3 border-t border-gray-200">
-                          <div className="flex items-center gap-3 text-sm">
-                            <div className="flex items-center gap-1">
-                              <Icon name="Star" size={16} className="fill-black" />
-                              <span className="font-semibold">{comic.avg_rating.toFixed(1)}</span>
-                            </div>
-                            <div className="flex items-center gap-1 text-gray-600">
-                              <Icon name="Heart" size={16} />
-                              <span>{comic.likes_count}</span>
+                          <div className="flex items-center justify-between mt-4 pt-3 border-t border-gray-200">
+                            <div className="flex items-center gap-3 text-sm">
+                              <div className="flex items-center gap-1">
+                                <Icon name="Star" size={16} className="fill-black" />
+                                <span className="font-semibold">{comic.avg_rating.toFixed(1)}</span>
+                              </div>
+                              <div className="flex items-center gap-1 text-gray-600">
+                                <Icon name="Heart" size={16} />
+                                <span>{comic.likes_count}</span>
+                              </div>
                             </div>
                           </div>
-                        </div>
-                      </CardContent>
-                    </Card>
-                  ))}
-                </div>
+                        </CardContent>
+                      </Card>
+                    ))}
+                  </div>
+                  {nextCursor && (
+                    <div className="flex justify-center mt-8">
+                      <Button variant="outline" disabled={loadingMore} onClick={loadMoreComics}>
+                        {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+                      </Button>
+                    </div>
+                  )}
+                </>
               ) : (
                 <Card className="border-2 border-black manga-shadow">
                   <CardContent className="p-12 text-center">